@@ -277,6 +277,7 @@ class BotMessage {
     const stats = {
       processed: 0,
       processing: 0,
+      parsed: 0,
       error: 0,
       new: 0
     };
@@ -232,7 +232,7 @@ function buildUiPayloadFromCheck(check) {
   };
 }
 
-async function processSingleMessage({ record, chatId, messageId, rawText }) {
+async function processSingleMessage({ record, chatId, messageId, rawText, preparsed }) {
   let text = (rawText ?? record?.text ?? '').trim();
 
   if (!text) {
@@ -290,6 +290,7 @@ async function processSingleMessage({ record, chatId, messageId, rawText }) {
       sourceBotTitle: chatMeta?.title || record?.bot_title,
       sourceApp: 'telegram_userbot',
       notifyMessageId,
+      preparsed,
     });
   } catch (error) {
     if (!error.notifyMessageId && notifyMessageId) {
@@ -321,6 +322,8 @@ router.post('/process', async (req, res) => {
     const rawChatId = body.chat_id ?? body.chatId ?? body.bot_id ?? body.botId;
     const rawMessageId = body.message_id ?? body.messageId ?? body.telegram_message_id ?? body.telegramMessageId;
     const rawText = body.raw_text ?? body.rawText ?? body.text ?? '';
+    // Операции, уже разобранные userbot по известному шаблону
+    const preparsed = Array.isArray(body.parsed) && body.parsed.length > 0 ? body.parsed : null;
 
     const chatId = rawChatId != null ? String(rawChatId).trim() : null;
     const messageId = rawMessageId != null ? String(rawMessageId).trim() : null;
@@ -366,7 +369,8 @@ router.post('/process', async (req, res) => {
         record,
         chatId,
         messageId,
-        rawText
+        rawText,
+        preparsed
       });
 
       const duration = Date.now() - startedAt;
@@ -492,6 +496,8 @@ router.post('/process-multiple', async (req, res) => {
       const chatId = item.chat_id || item.chatId;
       const messageId = item.message_id || item.messageId || item.telegram_message_id;
       const rawText = item.raw_text || item.text;
+      // Операции, уже разобранные userbot по известному шаблону
+      const preparsed = Array.isArray(item.parsed) && item.parsed.length > 0 ? item.parsed : null;
 
       try {
         const record = await resolveMessageRecord({
@@ -523,7 +529,8 @@ router.post('/process-multiple', async (req, res) => {
             record,
             chatId: String(chatId ?? record.chat_id),
             messageId: String(messageId ?? record.message_id),
-            rawText
+            rawText,
+            preparsed
           });
           if (primaryCheck) {
             const uiData = buildUiPayloadFromCheck(primaryCheck);
@@ -634,7 +641,11 @@ router.post('/retry', async (req, res) => {
 
 /**
  * POST /api/userbot-chat/load-history/:botId
- * Загрузить историю сообщений от бота через userbot
+ * Запустить загрузку истории сообщений от бота через userbot
+ *
+ * Загрузка идёт в userbot фоном и может длиться дольше таймаутов HTTP,
+ * поэтому ответ - 202 сразу после запуска; результат -
+ * GET /api/userbot-chat/load-history/:botId
  *
  * Body: {days: number (optional)}
  * days = null означает загрузить всю историю
@@ -659,7 +670,7 @@ router.post('/load-history/:botId', async (req, res) => {
 
     console.log(`📥 Loading history for bot ${bot.name} (${bot.username}), days: ${days || 'all'}`);
 
-    // Вызвать userbot service для загрузки истории
+    // Запустить загрузку истории в userbot
     const response = await fetch(`${USERBOT_SERVICE_URL}/load-history`, {
       method: 'POST',
       headers: {
@@ -682,19 +693,63 @@ router.post('/load-history/:botId', async (req, res) => {
       });
     }
 
-    console.log(`✅ History loaded: ${result.loaded} messages, ${result.saved} saved`);
-
-    res.json({
+    res.status(202).json({
       success: true,
+      state: result.state,
+      progress: result.progress,
+      requestId
+    });
+
+  } catch (error) {
+    console.error('Error loading history:', error);
+    res.status(500).json({
+      success: false,
+      error: error.message,
+      requestId: req.requestId
+    });
+  }
+});
+
+/**
+ * GET /api/userbot-chat/load-history/:botId
+ * Состояние загрузки истории: state = running | done | failed
+ */
+router.get('/load-history/:botId', async (req, res) => {
+  try {
+    const { botId } = req.params;
+    const requestId = req.requestId;
+
+    const bot = MONITORED_BOTS.find(b => b.id === parseInt(botId));
+
+    if (!bot) {
+      return res.status(404).json({
+        success: false,
+        error: 'Bot not found',
+        requestId
+      });
+    }
+
+    const response = await fetch(`${USERBOT_SERVICE_URL}/load-history?bot_id=${encodeURIComponent(bot.id)}`);
+    const result = await response.json();
+
+    if (result.state === 'done') {
+      console.log(`✅ History loaded: ${result.loaded} messages, ${result.saved} saved`);
+    }
+
+    res.status(response.status).json({
+      success: result.success,
+      state: result.state,
+      progress: result.progress,
       loaded: result.loaded,
       saved: result.saved,
       skipped: result.skipped,
       errors: result.errors,
+      error: result.error,
       requestId
     });
 
   } catch (error) {
-    console.error('Error loading history:', error);
+    console.error('Error getting history load status:', error);
     res.status(500).json({
       success: false,
       error: error.message,
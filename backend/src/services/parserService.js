@@ -380,6 +380,25 @@ class ParserService {
     return normalized;
   }
 
+  async fromPreparsed(operations, rawText, context) {
+    // Операции разобраны userbot по известному шаблону: только нормализация
+    if (isDeclinedText(rawText)) {
+      throw new ParserError('DECLINED', 'Операция отклонена или не выполнена', {
+        requestId: context.requestId
+      });
+    }
+
+    const normalized = [];
+    for (const operation of operations) {
+      const payload = await this.postProcessData(operation, rawText, context.source, {
+        ...context,
+        strategy: 'userbot-local'
+      });
+      normalized.push(payload);
+    }
+    return normalized;
+  }
+
   async parseWithLLM(rawText, context) {
     const messages = [
       {
@@ -575,7 +594,9 @@ class ParserService {
   async parseAndInsert(rawText, options = {}) {
     const requestId = randomUUID();
     const context = this.buildContext(rawText, options, requestId);
-    const transactions = await this.parseTransactionsFromText(rawText, context);
+    const transactions = options.preparsed
+      ? await this.fromPreparsed(options.preparsed, rawText, context)
+      : await this.parseTransactionsFromText(rawText, context);
 
     const created = [];
     const duplicates = [];
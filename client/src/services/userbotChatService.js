@@ -135,15 +135,38 @@ export const retryMessage = async (messageId) => {
   return response.data;
 };
 
+// Интервал опроса состояния загрузки истории
+const HISTORY_POLL_MS = 2000;
+
+/**
+ * Get history loading state for specific bot
+ * @param {number} botId - Bot ID
+ * @returns {Promise<object>} {success, state: running|done|failed, progress, loaded, saved, skipped, errors}
+ */
+export const getHistoryLoadStatus = async (botId) => {
+  const response = await api.get(`/load-history/${botId}`);
+  return response.data;
+};
+
 /**
  * Load message history from Telegram for specific bot
+ * Loading runs in the background on the server; this polls until it finishes
  * @param {number} botId - Bot ID
  * @param {number|null} days - Number of days to load (null = all history)
  * @returns {Promise<object>} Loading result: {success, loaded, saved, skipped, errors}
  */
 export const loadHistory = async (botId, days = null) => {
   const response = await api.post(`/load-history/${botId}`, { days });
-  return response.data;
+  if (!response.data.success) {
+    return response.data;
+  }
+  for (;;) {
+    await new Promise(resolve => setTimeout(resolve, HISTORY_POLL_MS));
+    const status = await getHistoryLoadStatus(botId);
+    if (status.state !== 'running') {
+      return status;
+    }
+  }
 };
 
 // Export default service object
@@ -154,7 +177,8 @@ const userbotChatService = {
   processMessage,
   processMultiple,
   retryMessage,
-  loadHistory
+  loadHistory,
+  getHistoryLoadStatus
 };
 
 export default userbotChatService;
@@ -0,0 +1,35 @@
+-- Migration: DB-backed chat history for the userbot /messages endpoint
+-- Date: 2026-10-19
+-- Purpose:
+--   * /messages pages are read from bot_messages by a numeric cursor instead
+--     of calling Telegram for every page; message_id is TEXT, so a generated
+--     BIGINT copy is indexed for ordering
+--   * bot_message_ranges records id ranges known to be complete per chat:
+--     every text message with low_id <= id <= high_id is in bot_messages.
+--     Only ids outside these ranges are fetched from Telegram
+--   * sender_id is kept for messages written back from Telegram
+
+BEGIN;
+
+ALTER TABLE IF EXISTS bot_messages
+  ADD COLUMN IF NOT EXISTS sender_id TEXT,
+  ADD COLUMN IF NOT EXISTS message_num BIGINT
+    GENERATED ALWAYS AS (CASE WHEN message_id ~ '^[0-9]+$' THEN message_id::bigint END) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_bot_messages_chat_num
+  ON bot_messages (chat_id, message_num DESC);
+
+CREATE TABLE IF NOT EXISTS bot_message_ranges (
+  chat_id TEXT NOT NULL,
+  low_id BIGINT NOT NULL,
+  high_id BIGINT NOT NULL,
+  reaches_start BOOLEAN NOT NULL DEFAULT FALSE,
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  PRIMARY KEY (chat_id, low_id),
+  CHECK (low_id <= high_id)
+);
+
+COMMENT ON TABLE bot_message_ranges IS 'Диапазоны message_id чата, полностью сохранённые в bot_messages (userbot /messages)';
+COMMENT ON COLUMN bot_message_ranges.reaches_start IS 'Диапазон начинается с первого сообщения чата - старше ничего нет';
+
+COMMIT;
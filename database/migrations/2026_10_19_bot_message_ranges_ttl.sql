@@ -0,0 +1,18 @@
+-- Migration: expiring complete ranges for the userbot /messages endpoint
+-- Date: 2026-10-19
+-- Purpose:
+--   * bot_message_ranges.updated_at is the time a range was last checked
+--     against Telegram; /messages re-checks ranges older than
+--     USERBOT_MESSAGES_RANGE_TTL_SEC, so edits and deletions show up
+--   * a re-check overwrites edited text and marks messages that are gone
+--     from Telegram with telegram_deleted_at; the rows stay, checks link to them
+
+BEGIN;
+
+ALTER TABLE IF EXISTS bot_messages
+  ADD COLUMN IF NOT EXISTS telegram_deleted_at TIMESTAMPTZ;
+
+COMMENT ON COLUMN bot_messages.telegram_deleted_at IS 'Сообщение удалено в Telegram (обнаружено при повторной проверке /messages)';
+COMMENT ON COLUMN bot_message_ranges.updated_at IS 'Когда диапазон последний раз проверен в Telegram (TTL /messages)';
+
+COMMIT;
@@ -0,0 +1,25 @@
+-- Migration: bot_messages as the userbot outbox for backend dispatch
+-- Date: 2026-10-19
+-- Purpose:
+--   * the userbot no longer pushes each message with a fire-and-forget POST;
+--     rows with status new/parsed and a due next_attempt_at are claimed
+--     (FOR UPDATE SKIP LOCKED) and sent in batches to /process-multiple
+--   * next_attempt_at doubles as a lease: a claimed row is pushed into the
+--     future, so rows of a crashed dispatcher are picked up again
+--   * rows inserted before this migration keep next_attempt_at = NULL
+--     and are not dispatched automatically
+
+BEGIN;
+
+ALTER TABLE IF EXISTS bot_messages
+  ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMPTZ,
+  ADD COLUMN IF NOT EXISTS dispatch_attempts INTEGER NOT NULL DEFAULT 0;
+
+CREATE INDEX IF NOT EXISTS idx_bot_messages_outbox_due
+  ON bot_messages (next_attempt_at)
+  WHERE next_attempt_at IS NOT NULL AND status IN ('new', 'parsed');
+
+COMMENT ON COLUMN bot_messages.next_attempt_at IS 'Когда userbot отправит сообщение в backend (NULL - не отправлять)';
+COMMENT ON COLUMN bot_messages.dispatch_attempts IS 'Число попыток отправки в backend из outbox userbot';
+
+COMMIT;
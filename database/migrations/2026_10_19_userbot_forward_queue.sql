@@ -0,0 +1,31 @@
+-- Migration: durable retry queue for userbot forwards to OUR_BOT_ID
+-- Date: 2026-10-19
+-- Purpose:
+--   * keep forwards that failed (long FloodWait, Telegram errors, shutdown)
+--     until they are delivered, instead of only logging the error
+--   * retry with exponential backoff (next_attempt_at)
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS userbot_forward_queue (
+  id BIGSERIAL PRIMARY KEY,
+  chat_id TEXT NOT NULL,
+  message_id TEXT NOT NULL,
+  text TEXT,
+  attempts INTEGER NOT NULL DEFAULT 0,
+  next_attempt_at TIMESTAMPTZ,          -- NULL: попытки исчерпаны
+  last_error TEXT,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_userbot_forward_queue_message
+  ON userbot_forward_queue (chat_id, message_id);
+
+CREATE INDEX IF NOT EXISTS idx_userbot_forward_queue_due
+  ON userbot_forward_queue (next_attempt_at)
+  WHERE next_attempt_at IS NOT NULL;
+
+COMMENT ON TABLE userbot_forward_queue IS 'Недоставленные пересылки userbot в наш бот (повтор с backoff)';
+
+COMMIT;
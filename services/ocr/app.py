@@ -3,7 +3,10 @@ patch-017 §2: OCR Service Flask App
 
 Эндпоинты:
 - POST /ocr/process - обработка изображения чека
-- GET /health - healthcheck
+- POST /ocr/parse-text - разбор текстового сообщения банковского бота
+- GET /health - healthcheck (liveness)
+- GET /ready - готовность: прогрев и canary-распознавание выполнены
+- GET /ocr/templates - покрытие шаблонами сообщений
 """
 
 import os
@@ -12,37 +15,152 @@ import traceback
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 
-from preprocessing import preprocess_image
-from ocr_engine import extract_text
-from classifiers import classify_and_parse
+from pdf import is_pdf, process_pdf, PdfError
+from operators import get_operator_stats, start_operator_refresh
+from preprocessing import preprocess_image, ImageTooLargeError
+from ocr_engine import extract_text, extract_text_multi_psm, extract_lines
+from classifiers import classify_and_parse, cache_stats
+from segmentation import segment_source, segment_receipts
+from templates import parse_message, template_registry
+from warmup import get_readiness, start_warmup
 
 
 app = Flask(__name__)
 CORS(app)
 
+# Multi-PSM по умолчанию (можно включить per-request полем "multi_psm")
+MULTI_PSM_DEFAULT = os.getenv('OCR_MULTI_PSM', 'false').lower() in ('1', 'true', 'yes')
+
+# Разбиение длинных скриншотов на несколько чеков по умолчанию (per-request поле "segment")
+SEGMENT_DEFAULT = os.getenv('OCR_SEGMENT', 'false').lower() in ('1', 'true', 'yes')
+
+# Вес уверенности OCR в комбинированной оценке multi-PSM (остальное - уверенность парсинга)
+OCR_SCORE_WEIGHT = 0.4
+
+
+def score_ocr_result(ocr_result):
+    """
+    Комбинированная оценка результата OCR: уверенность Tesseract
+    и уверенность парсинга классификатором (0-100)
+    """
+    try:
+        parse_confidence = classify_and_parse(ocr_result['text'])['confidence']
+    except ValueError:
+        parse_confidence = 0
+    return OCR_SCORE_WEIGHT * ocr_result['confidence'] + (1 - OCR_SCORE_WEIGHT) * parse_confidence
+
 
 @app.route('/health', methods=['GET'])
 def health():
     """
-    Healthcheck endpoint
+    Healthcheck endpoint (+ счётчики кэша разбора чеков)
     """
     return jsonify({
         'status': 'healthy',
         'service': 'ocr',
-        'version': '1.0.0'
+        'version': '1.0.0',
+        'parse_cache': cache_stats(),
+        'operators': get_operator_stats()
     })
 
 
+@app.route('/ready', methods=['GET'])
+def ready():
+    """
+    Readiness endpoint: 200 только после успешного прогрева
+
+    Response:
+    {
+        "ready": true/false,
+        "status": "pending" | "warming" | "ready" | "failed",
+        "tesseract_version": "5.3.0",
+        "languages": ["eng", "rus", ...],
+        "canary_ms": 850.2,
+        "canary_confidence": 91.5,
+        "warmed_at": "2025-01-15T14:30:00+00:00",
+        "error": null,
+        "attempts": 1,
+        "next_retry_at": null
+    }
+    """
+    state = get_readiness()
+    return jsonify(state), 200 if state['ready'] else 503
+
+
+@app.route('/ocr/templates', methods=['GET'])
+def templates_coverage():
+    """
+    Покрытие шаблонами сообщений
+
+    Response:
+    {
+        "templates": 12,
+        "active": 11,
+        "disabled": 1,
+        "evicted": 40,
+        "template_hits": 9400,
+        "fallbacks": 600,
+        "coverage": 0.94,
+        "items": [{"shape": "...", "classifier": "...", "hits": 5000, ...}]
+    }
+    """
+    return jsonify(template_registry.coverage())
+
+
+@app.route('/ocr/parse-text', methods=['POST'])
+def parse_text():
+    """
+    Разбирает текст сообщения банковского бота через реестр шаблонов
+
+    Request body:
+    {
+        "text": "💸 Оплата\n➖ 50 000.00 UZS\n..."
+    }
+
+    Response:
+    {
+        "success": true/false,
+        "parsed_data": {"classifier": "CardXabarClassifier", "data": {...}, "confidence": 100},
+        "error": "..." (если формат не распознан)
+    }
+    """
+    text = (request.get_json(silent=True) or {}).get('text')
+    if not isinstance(text, str) or not text.strip():
+        return jsonify({
+            'success': False,
+            'error': 'Missing "text" field in request body'
+        }), 400
+
+    try:
+        parsed_result = parse_message(text)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 422
+
+    return jsonify({
+        'success': True,
+        'parsed_data': parsed_result
+    }), 200
+
+
 @app.route('/ocr/process', methods=['POST'])
 def process_receipt():
     """
-    Обрабатывает изображение чека
+    Обрабатывает изображение чека (или PDF-чек/выписку)
 
     Request body:
     {
-        "image": "base64-encoded image data",
+        "image": "base64-encoded image data" (или PDF-документ),
         "preprocess": true/false (default: true),
-        "preprocess_steps": ["resize", "sharpen", "binarize", "denoise"] (optional)
+        "preprocess_steps": ["resize", "sharpen", "binarize", "denoise"] (optional,
+            по умолчанию шаги выбираются по типу изображения: скриншот/фото),
+        "multi_psm": true/false (default: OCR_MULTI_PSM) - параллельно
+            распознать в нескольких режимах PSM и выбрать лучший,
+        "psm_modes": [4, 6, 11] (optional),
+        "segment": true/false (default: OCR_SEGMENT) - длинный скриншот истории
+            операций разбить на области и вернуть список чеков
     }
 
     Response:
@@ -51,7 +169,8 @@ def process_receipt():
         "ocr_result": {
             "text": "распознанный текст",
             "confidence": 85.5,
-            "lines": [...]
+            "lines": [...],
+            "psm": 6, "candidates": [...] (только в режиме multi_psm)
         },
         "parsed_data": {
             "classifier": "UzumBankClassifier",
@@ -67,11 +186,34 @@ def process_receipt():
         },
         "preprocessing": {
             "original_size": [1920, 1080],
+            "decoded_size": [1920, 1080],
+            "decode_ms": 12.5,
             "processed_size": [1200, 675],
-            "steps_applied": ["resize", "sharpen", "binarize", "denoise"]
+            "steps_applied": ["photo", "resize", "sharpen", "binarize", "denoise"]
         },
         "error": "..." (если success: false)
     }
+
+    Для длинного скриншота с "segment": true:
+    {
+        "success": true,
+        "status": "segmented",
+        "regions": 12,
+        "receipts": [{"region": [0, 640], "text": "...", "ocr_confidence": 88.1,
+                      "parsed_data": {...}}, ...],
+        "unparsed": [{"region": [640, 700], "text": "..."}],
+        "preprocessing": {...}
+    }
+
+    Для PDF:
+    {
+        "success": true,
+        "status": "pdf",
+        "pages": 3,
+        "receipts": [{"page": 1, "source": "text" | "ocr", "text": "...",
+                      "ocr_confidence": null, "parsed_data": {...}}, ...],
+        "unparsed": [{"page": 3, "source": "ocr", "text": "...", "error": "..."}]
+    }
     """
     try:
         # Валидация запроса
@@ -105,21 +247,70 @@ def process_receipt():
                 'error': f'Image size exceeds {max_size_mb} MB limit'
             }), 400
 
+        # PDF: текстовый слой разбирается напрямую, сканы - через OCR постранично
+        if is_pdf(image_bytes):
+            try:
+                pdf_result = process_pdf(image_bytes)
+            except PdfError as e:
+                return jsonify({
+                    'success': False,
+                    'error': str(e)
+                }), 422
+            return jsonify({
+                'success': bool(pdf_result['receipts']),
+                'status': 'pdf',
+                **pdf_result
+            }), 200 if pdf_result['receipts'] else 422
+
         # Предобработка (если включена)
         should_preprocess = request.json.get('preprocess', True)
         preprocessing_metadata = None
 
         if should_preprocess:
             preprocess_steps = request.json.get('preprocess_steps', None)
-            processed_bytes, preprocessing_metadata = preprocess_image(
-                image_bytes,
-                steps=preprocess_steps
-            )
+            try:
+                processed_bytes, preprocessing_metadata = preprocess_image(
+                    image_bytes,
+                    steps=preprocess_steps
+                )
+            except ImageTooLargeError as e:
+                return jsonify({
+                    'success': False,
+                    'error': str(e)
+                }), 413
         else:
             processed_bytes = image_bytes
 
+        def recognize(data):
+            if request.json.get('multi_psm', MULTI_PSM_DEFAULT):
+                return extract_text_multi_psm(
+                    data,
+                    psm_modes=request.json.get('psm_modes'),
+                    score_fn=score_ocr_result
+                )
+            return extract_text(data)
+
+        # Длинный скриншот истории операций: несколько чеков на одном изображении.
+        # Режется изображение в исходном разрешении (уменьшенное фото - по оригиналу);
+        # геометрия строк - один проход Tesseract по обработанному изображению,
+        # а текст распознаётся только по областям
+        if request.json.get('segment', SEGMENT_DEFAULT):
+            segment_image, scale = segment_source(image_bytes, processed_bytes, preprocessing_metadata)
+            if segment_image is not None:
+                segmented = segment_receipts(
+                    segment_image,
+                    get_lines=lambda: extract_lines(processed_bytes, scale=scale)
+                )
+                if segmented is not None:
+                    return jsonify({
+                        'success': bool(segmented['receipts']),
+                        'status': 'segmented',
+                        **segmented,
+                        'preprocessing': preprocessing_metadata
+                    }), 200 if segmented['receipts'] else 422
+
         # OCR - извлечение текста
-        ocr_result = extract_text(processed_bytes)
+        ocr_result = recognize(processed_bytes)
 
         # Проверяем уверенность OCR
         if ocr_result['confidence'] < 30:
@@ -133,7 +324,7 @@ def process_receipt():
 
         # Классификация и парсинг
         try:
-            parsed_result = classify_and_parse(ocr_result['text'])
+            parsed_result = parse_message(ocr_result['text'])
         except ValueError as e:
             # Не удалось распознать формат чека
             return jsonify({
@@ -187,6 +378,13 @@ if __name__ == '__main__':
 
     print(f"🔍 OCR Service starting on port {port}...")
     print(f"📊 Max image size: {os.getenv('MAX_IMAGE_SIZE_MB', 10)} MB")
+    print(f"🧮 Max image pixels: {os.getenv('OCR_MAX_IMAGE_PIXELS', 60_000_000)}")
     print(f"🌐 Tesseract language: {os.getenv('TESSERACT_LANG', 'rus+eng')}")
 
+    # Прогрев и canary-распознавание в фоне; до завершения /ready отвечает 503
+    start_warmup()
+
+    # Справочник операторов в памяти, обновляется в фоне
+    start_operator_refresh()
+
     app.run(host='0.0.0.0', port=port, debug=debug)
@@ -1,11 +1,28 @@
 """
 patch-017 §2: Классификаторы чеков для разных банков
 
-Каждый банк/платёжная система имеет свой формат чека с уникальными маркерами
+Каждый банк/платёжная система имеет свой формат чека с уникальными маркерами.
+Суммы, даты, время и маски карт извлекаются один раз общим лексером
+(lexer.tokenize), классификаторы работают с готовым потоком токенов.
+
+Результаты classify_and_parse кэшируются (LRU) по нормализованному тексту:
+боты шлют однотипные сообщения, а backend повторно запрашивает разбор
+после ретраев и правок.
 """
 
+import copy
+import hashlib
+import os
 import re
-from datetime import datetime
+import threading
+from collections import OrderedDict
+
+from lexer import AMOUNT, tokenize, find_amount, find_card, find_datetime, line_prefix, parse_amount
+from markers import FuzzyMarkerIndex
+
+
+# Общий индекс нечётких маркеров всех банков (см. markers.py)
+MARKER_INDEX = None  # заполняется _build_marker_index ниже, после классификаторов
 
 
 class ReceiptClassifier:
@@ -27,12 +44,13 @@ class ReceiptClassifier:
         raise NotImplementedError
 
     @staticmethod
-    def parse(text):
+    def parse(text, tokens=None):
         """
         Парсит чек и извлекает поля
 
         Args:
             text: str - OCR-текст чека
+            tokens: list - токены lexer.tokenize(text) (если None - строятся заново)
 
         Returns:
             dict - распарсенные поля или None если не удалось
@@ -57,15 +75,32 @@ class UzumBankClassifier(ReceiptClassifier):
         r'транзакция',
         r'transaction'
     ]
+    MARKERS_RE = re.compile('|'.join(MARKERS), re.IGNORECASE)
+
+    # Слова-маркеры для нечёткого поиска по OCR-тексту с ошибками
+    FUZZY_MARKERS = ['uzum', 'транзакция', 'transaction']
+
+    OPERATOR_RE = re.compile(
+        r'(?:продавец|merchant|получатель)[:\s]+(.+?)(?:\n|$)',
+        re.IGNORECASE | re.MULTILINE
+    )
+
+    # Признаки P2P-перевода
+    P2P_RE = re.compile(r'перевод|p2p|transfer', re.IGNORECASE)
+
+    # Метки строк, суммы/карты на которых приоритетнее
+    AMOUNT_LABELS = ('сумма', 'amount')
+    CARD_LABELS = ('карта', 'card')
 
     @staticmethod
     def identify(text):
-        """Проверяет наличие маркеров Uzum Bank"""
-        text_lower = text.lower()
-        return any(re.search(marker, text_lower) for marker in UzumBankClassifier.MARKERS)
+        """Проверяет наличие маркеров Uzum Bank (точно, затем с учётом OCR-ошибок)"""
+        if UzumBankClassifier.MARKERS_RE.search(text):
+            return True
+        return 'UzumBankClassifier' in MARKER_INDEX.labels(text)
 
     @staticmethod
-    def parse(text):
+    def parse(text, tokens=None):
         """
         Парсит чек Uzum Bank
 
@@ -90,67 +125,32 @@ class UzumBankClassifier(ReceiptClassifier):
             'confidence': 0
         }
 
+        if tokens is None:
+            tokens = tokenize(text)
+
         # Извлекаем продавца (operator)
-        operator_patterns = [
-            r'продавец[:\s]+(.+?)(?:\n|$)',
-            r'merchant[:\s]+(.+?)(?:\n|$)',
-            r'получатель[:\s]+(.+?)(?:\n|$)'
-        ]
-        for pattern in operator_patterns:
-            match = re.search(pattern, text, re.IGNORECASE | re.MULTILINE)
-            if match:
-                result['operator'] = match.group(1).strip()
-                break
-
-        # Извлекаем сумму
-        amount_patterns = [
-            r'сумма[:\s]+([-+]?\d+[\s,]?\d*\.?\d*)\s*(uzs|сум)',
-            r'amount[:\s]+([-+]?\d+[\s,]?\d*\.?\d*)\s*(uzs|сум)',
-            r'([-+]?\d+[\s,]?\d*\.?\d*)\s*(uzs|сум)'
-        ]
-        for pattern in amount_patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                amount_str = match.group(1).replace(' ', '').replace(',', '')
-                try:
-                    result['amount'] = float(amount_str)
-                    result['currency'] = 'UZS'
-                    break
-                except ValueError:
-                    continue
+        match = UzumBankClassifier.OPERATOR_RE.search(text)
+        if match:
+            result['operator'] = match.group(1).strip()
+
+        # Извлекаем сумму (приоритет - строка «Сумма:»)
+        amount = find_amount(tokens, text, currencies={'UZS'}, labels=UzumBankClassifier.AMOUNT_LABELS)
+        if amount:
+            result['amount'] = amount.value
+            result['currency'] = 'UZS'
 
         # Извлекаем дату и время
-        datetime_patterns = [
-            r'дата[:\s]+(\d{2}\.\d{2}\.\d{4})\s+(\d{2}:\d{2})',
-            r'date[:\s]+(\d{2}\.\d{2}\.\d{4})\s+(\d{2}:\d{2})',
-            r'(\d{2}\.\d{2}\.\d{4})\s+(\d{2}:\d{2})'
-        ]
-        for pattern in datetime_patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                date_str = match.group(1)
-                time_str = match.group(2)
-                try:
-                    dt = datetime.strptime(f"{date_str} {time_str}", "%d.%m.%Y %H:%M")
-                    result['datetime'] = dt.strftime("%Y-%m-%d %H:%M:%S")
-                    break
-                except ValueError:
-                    continue
-
-        # Извлекаем последние 4 цифры карты
-        card_patterns = [
-            r'карта[:\s]+\*(\d{4})',
-            r'card[:\s]+\*(\d{4})',
-            r'\*(\d{4})'
-        ]
-        for pattern in card_patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                result['card_last4'] = match.group(1)
-                break
+        dt = find_datetime(tokens, text)
+        if dt:
+            result['datetime'] = dt.strftime("%Y-%m-%d %H:%M:%S")
+
+        # Извлекаем последние 4 цифры карты (приоритет - строка «Карта:»)
+        card = find_card(tokens, text, labels=UzumBankClassifier.CARD_LABELS)
+        if card:
+            result['card_last4'] = card.value
 
         # Определяем тип транзакции
-        if 'перевод' in text.lower() or 'p2p' in text.lower() or 'transfer' in text.lower():
+        if UzumBankClassifier.P2P_RE.search(text):
             result['is_p2p'] = True
             result['transaction_type'] = 'P2P перевод'
         else:
@@ -176,6 +176,177 @@ class UzumBankClassifier(ReceiptClassifier):
         return None
 
 
+def _clean_operator(raw):
+    if not raw:
+        return None
+    return re.sub(r'[.,]+$', '', re.sub(r'\s+', ' ', raw)).strip() or None
+
+
+class CardXabarClassifier(ReceiptClassifier):
+    """
+    Классификатор уведомлений @CardXabarBot / HUMO
+
+    Ожидаемый формат:
+    💸 Оплата
+    ➖ 50 000.00 UZS
+    📍 [продавец]
+    💳 HUMOCARD *[последние 4 цифры]
+    🕓 HH:MM DD.MM.YYYY
+    💰 [баланс] UZS
+    """
+
+    HEADER_RE = re.compile(r'[^\W\d_][\w ]*[^\W\d_]|[^\W\d_]')
+    MERCHANT_RE = re.compile(r'^[^\S\n]*📍[^\S\n]*(.+?)[^\S\n]*$', re.MULTILINE)
+    CARD_TYPE_RE = re.compile(r'💳[^\S\n]*([\w-]+)?[^\S\n]*\*')
+
+    # Заголовок -> тип операции; прочие заголовки (отказы, OTP) - не этот формат
+    TYPES = {
+        'оплата': 'Оплата',
+        'покупка': 'Оплата',
+        'списание': 'Списание',
+        'пополнение': 'Пополнение',
+        'перевод': 'Перевод',
+        'возврат': 'Возврат',
+        'снятие наличных': 'Снятие наличных',
+    }
+
+    @staticmethod
+    def identify(text):
+        """Строки карты и времени с эмодзи и сумма со знаком"""
+        return '💳' in text and '🕓' in text and ('➖' in text or '➕' in text)
+
+    @staticmethod
+    def parse(text, tokens=None):
+        """
+        Парсит уведомление CardXabar: сумма - строка со знаком ➖/➕,
+        баланс - строка 💰, карта - строка 💳
+        """
+        lines = text.strip().splitlines()
+        header = CardXabarClassifier.HEADER_RE.search(lines[0]) if lines else None
+        transaction_type = CardXabarClassifier.TYPES.get(header.group().lower()) if header else None
+        if not transaction_type:
+            return None
+
+        if tokens is None:
+            tokens = tokenize(text)
+
+        amount = balance = None
+        is_income = False
+        for token in tokens:
+            if token.kind != AMOUNT or not token.currency:
+                continue
+            prefix = line_prefix(text, token)
+            if amount is None and ('➖' in prefix or '➕' in prefix):
+                amount = token
+                is_income = '➕' in prefix
+            elif balance is None and '💰' in prefix:
+                balance = token
+
+        card = find_card(tokens, text, labels=('💳',))
+        dt = find_datetime(tokens, text)
+        if not (amount and card and dt):
+            return None
+
+        merchant = CardXabarClassifier.MERCHANT_RE.search(text)
+        card_type = CardXabarClassifier.CARD_TYPE_RE.search(text)
+        operator = _clean_operator(merchant.group(1)) if merchant else None
+        return {
+            'operator': operator,
+            'amount': amount.value,
+            'currency': amount.currency,
+            'datetime': dt.strftime("%Y-%m-%d %H:%M:%S"),
+            'card_last4': card.value,
+            'card_type': card_type.group(1) if card_type else None,
+            'balance': balance.value if balance else None,
+            'is_income': is_income,
+            'transaction_type': transaction_type,
+            'is_p2p': transaction_type == 'Перевод' or 'P2P' in (operator or '').upper(),
+            'app_name': 'CardXabar',
+            'source': 'bot',
+            'confidence': 100 if operator else 75
+        }
+
+
+class UzumSmsClassifier(ReceiptClassifier):
+    """
+    Классификатор SMS Uzum Bank (по операции на строку, даты в SMS нет)
+
+    Ожидаемый формат:
+    Spisanie, karta ***1234: 25000.00 UZS, [продавец]. Dostupno: 100500.00 UZS
+    Popolnenie ot [отправитель] na 300000.00 UZS, karta ***1234. Dostupno: 400500.00 UZS
+
+    Несколько операций одного SMS возвращаются в data['operations'].
+    """
+
+    OTP_RE = re.compile(r'^<#>\s*Uzum\s*bank\s+Podtverdite', re.IGNORECASE)
+    DEBIT_RE = re.compile(
+        r'Spisanie,\s*karta\s*\*{0,4}(\d{4})\s*:\s*([\d.,]+)\s*UZS,\s*(.+?)\.\s*Dostupno:\s*([\d.,]+)\s*UZS',
+        re.IGNORECASE
+    )
+    CREDIT_RE = re.compile(
+        r'Popolnenie\s+ot\s+(.+?)\s+na\s*([\d.,]+)\s*UZS.*karta\s*\*{0,4}(\d{4}).*Dostupno:\s*([\d.,]+)\s*UZS',
+        re.IGNORECASE
+    )
+    P2P_RE = re.compile(r'\bto\s+(HUMO|UZCARD|VISAUZUM)\b', re.IGNORECASE)
+
+    @staticmethod
+    def identify(text):
+        """Маркеры «Spisanie»/«Popolnenie» и «Dostupno»"""
+        lowered = text.lower()
+        return 'dostupno' in lowered and ('spisanie' in lowered or 'popolnenie' in lowered)
+
+    @staticmethod
+    def parse(text, tokens=None):
+        """
+        Парсит SMS: data - первая операция, при нескольких - все в operations
+        """
+        operations = []
+        for index, line in enumerate(line.strip() for line in text.splitlines()):
+            if not line or UzumSmsClassifier.OTP_RE.search(line):
+                continue
+
+            debit = UzumSmsClassifier.DEBIT_RE.search(line)
+            credit = None if debit else UzumSmsClassifier.CREDIT_RE.search(line)
+            if debit:
+                card, amount_raw, operator_raw, balance_raw = debit.groups()
+            elif credit:
+                operator_raw, amount_raw, card, balance_raw = credit.groups()
+            else:
+                continue
+
+            try:
+                amount = parse_amount(amount_raw)
+                balance = parse_amount(balance_raw)
+            except ValueError:
+                continue
+            operations.append({
+                'operator': _clean_operator(operator_raw) or 'Uzum Bank',
+                'amount': amount,
+                'card_last4': card,
+                'balance': balance,
+                'is_income': not debit,
+                'is_p2p': bool(UzumSmsClassifier.P2P_RE.search(line)),
+                'transaction_type': 'Оплата' if debit else 'Пополнение',
+                'direction': 'debit' if debit else 'credit',
+                'index': index,
+            })
+
+        if not operations:
+            return None
+
+        result = {
+            **operations[0],
+            'currency': 'UZS',
+            'datetime': None,
+            'app_name': 'Uzum Bank',
+            'source': 'bot',
+            'confidence': 70
+        }
+        if len(operations) > 1:
+            result['operations'] = operations
+        return result
+
+
 class GenericBankClassifier(ReceiptClassifier):
     """
     Универсальный классификатор для чеков с общими паттернами
@@ -188,7 +359,7 @@ class GenericBankClassifier(ReceiptClassifier):
         return True
 
     @staticmethod
-    def parse(text):
+    def parse(text, tokens=None):
         """
         Парсит чек используя общие паттерны
 
@@ -210,47 +381,24 @@ class GenericBankClassifier(ReceiptClassifier):
             'confidence': 0
         }
 
+        if tokens is None:
+            tokens = tokenize(text)
+
         # Ищем любые суммы с валютой
-        amount_match = re.search(r'([-+]?\d+[\s,]?\d*\.?\d*)\s*(uzs|usd|rub|сум)', text, re.IGNORECASE)
-        if amount_match:
-            amount_str = amount_match.group(1).replace(' ', '').replace(',', '')
-            try:
-                result['amount'] = float(amount_str)
-                result['currency'] = amount_match.group(2).upper()
-                if result['currency'] == 'СУМ':
-                    result['currency'] = 'UZS'
-            except ValueError:
-                pass
-
-        # Ищем даты
-        datetime_patterns = [
-            r'(\d{2}\.\d{2}\.\d{4})\s+(\d{2}:\d{2})',
-            r'(\d{4}-\d{2}-\d{2})\s+(\d{2}:\d{2})',
-            r'(\d{2}/\d{2}/\d{4})\s+(\d{2}:\d{2})'
-        ]
-        for pattern in datetime_patterns:
-            match = re.search(pattern, text)
-            if match:
-                date_str = match.group(1)
-                time_str = match.group(2)
-                try:
-                    # Пробуем разные форматы
-                    for fmt in ["%d.%m.%Y %H:%M", "%Y-%m-%d %H:%M", "%d/%m/%Y %H:%M"]:
-                        try:
-                            dt = datetime.strptime(f"{date_str} {time_str}", fmt)
-                            result['datetime'] = dt.strftime("%Y-%m-%d %H:%M:%S")
-                            break
-                        except ValueError:
-                            continue
-                    if result['datetime']:
-                        break
-                except ValueError:
-                    continue
+        amount = find_amount(tokens, text)
+        if amount:
+            result['amount'] = amount.value
+            result['currency'] = amount.currency
+
+        # Ищем дату и время
+        dt = find_datetime(tokens, text)
+        if dt:
+            result['datetime'] = dt.strftime("%Y-%m-%d %H:%M:%S")
 
         # Ищем последние 4 цифры карты
-        card_match = re.search(r'\*(\d{4})', text)
-        if card_match:
-            result['card_last4'] = card_match.group(1)
+        card = find_card(tokens, text)
+        if card:
+            result['card_last4'] = card.value
 
         # Уверенность
         confidence_score = 0
@@ -272,30 +420,83 @@ class GenericBankClassifier(ReceiptClassifier):
 
 # Список всех классификаторов в порядке приоритета
 CLASSIFIERS = [
+    # Форматы ботов строже чеков: проверяются первыми (продавец «UZUM MARKET»
+    # иначе уводит уведомление в UzumBankClassifier)
+    CardXabarClassifier,
+    UzumSmsClassifier,
     UzumBankClassifier,
     GenericBankClassifier  # Последний как fallback
 ]
 
+def _build_marker_index(classifiers):
+    index = FuzzyMarkerIndex()
+    for classifier in classifiers:
+        for marker in getattr(classifier, 'FUZZY_MARKERS', ()):
+            index.add(classifier.__name__, marker)
+    return index
+
+
+MARKER_INDEX = _build_marker_index(CLASSIFIERS)
+
+# Версия реестра классификаторов: входит в ключ кэша, растёт при перезагрузке
+_registry_version = 1
+
+# Размер LRU-кэша результатов (0 - кэш выключен)
+PARSE_CACHE_SIZE = int(os.getenv('OCR_PARSE_CACHE_SIZE', '4096'))
+
+_WHITESPACE_RE = re.compile(r'[^\S\n]+')
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
 
-def classify_and_parse(text):
+
+def registry_version():
+    """Текущая версия реестра классификаторов"""
+    return _registry_version
+
+
+def marker_labels(text):
     """
-    Определяет банк и парсит чек
+    Маркеры текста, влияющие на выбор классификатора и тип транзакции
 
-    Args:
-        text: str - OCR-текст чека
+    Метки входят в форму сообщения (templates.py), так что тексты с разными
+    маркерами не делят шаблон.
 
     Returns:
-        dict - результат парсинга с полями:
-            - classifier: str - имя использованного классификатора
-            - data: dict - распарсенные поля
-            - confidence: float - уверенность парсинга (0-100)
+        frozenset - например {'p2p', 'UzumBankClassifier'}
+    """
+    labels = set(MARKER_INDEX.find(text))
+    if UzumBankClassifier.MARKERS_RE.search(text):
+        labels.add('uzum')
+    if UzumBankClassifier.P2P_RE.search(text):
+        labels.add('p2p')
+    if UzumSmsClassifier.P2P_RE.search(text):
+        labels.add('sms_p2p')
+    return frozenset(labels)
 
-    Raises:
-        ValueError: если ни один классификатор не смог распарсить чек
+
+def _cache_key(text):
     """
+    Ключ кэша: хэш текста без лишних пробелов + версия реестра
+
+    Переводы строк сохраняются: по ним классификаторы отделяют поля.
+    Регистр сохраняется: operator/merchant в результате берутся из текста
+    как есть.
+    """
+    lines = (_WHITESPACE_RE.sub(' ', line).strip() for line in text.split('\n'))
+    normalized = '\n'.join(line for line in lines if line)
+    digest = hashlib.blake2b(normalized.encode('utf-8'), digest_size=16).digest()
+    return _registry_version, digest
+
+
+def _parse_uncached(text):
+    # Текст токенизируется один раз для всех классификаторов
+    tokens = tokenize(text)
+
     for classifier in CLASSIFIERS:
         if classifier.identify(text):
-            parsed = classifier.parse(text)
+            parsed = classifier.parse(text, tokens)
             if parsed:
                 return {
                     'classifier': classifier.__name__,
@@ -303,4 +504,89 @@ def classify_and_parse(text):
                     'confidence': parsed['confidence']
                 }
 
-    raise ValueError("Не удалось распознать формат чека")
+    return None
+
+
+def classify_and_parse(text, use_cache=True):
+    """
+    Определяет банк и парсит чек
+
+    Args:
+        text: str - OCR-текст чека
+        use_cache: bool - использовать LRU-кэш (False - всегда разбирать заново)
+
+    Returns:
+        dict - результат парсинга с полями (копия, её можно изменять):
+            - classifier: str - имя использованного классификатора
+            - data: dict - распарсенные поля
+            - confidence: float - уверенность парсинга (0-100)
+
+    Raises:
+        ValueError: если ни один классификатор не смог распарсить чек
+    """
+    if not use_cache or PARSE_CACHE_SIZE <= 0:
+        result = _parse_uncached(text)
+    else:
+        key = _cache_key(text)
+        with _cache_lock:
+            cached = key in _cache
+            if cached:
+                _cache.move_to_end(key)
+                result = _cache[key]
+                _cache_stats['hits'] += 1
+            else:
+                _cache_stats['misses'] += 1
+
+        if not cached:
+            result = _parse_uncached(text)
+            with _cache_lock:
+                # Реестр могли перезагрузить, пока шёл разбор
+                if key[0] == _registry_version:
+                    _cache[key] = result
+                    _cache.move_to_end(key)
+                    while len(_cache) > PARSE_CACHE_SIZE:
+                        _cache.popitem(last=False)
+                        _cache_stats['evictions'] += 1
+
+    if result is None:
+        raise ValueError("Не удалось распознать формат чека")
+
+    # Вызывающий код получает копию и не может испортить запись в кэше
+    return copy.deepcopy(result)
+
+
+def reload_classifiers(classifiers=None):
+    """
+    Заменяет реестр классификаторов и сбрасывает кэш результатов
+
+    Индекс маркеров строится заново: маркеры убранных классификаторов
+    в нём не остаются.
+
+    Args:
+        classifiers: list - новые классификаторы в порядке приоритета
+                     (None - оставить текущие, только сбросить кэш)
+    """
+    global _registry_version, MARKER_INDEX
+    with _cache_lock:
+        if classifiers is not None:
+            CLASSIFIERS[:] = classifiers
+            MARKER_INDEX = _build_marker_index(classifiers)
+        _registry_version += 1
+        _cache.clear()
+
+
+def cache_stats():
+    """
+    Счётчики кэша результатов
+
+    Returns:
+        dict - size, max_size, hits, misses, evictions, hit_rate, registry_version
+    """
+    with _cache_lock:
+        stats = dict(_cache_stats)
+        stats['size'] = len(_cache)
+        stats['registry_version'] = _registry_version
+    lookups = stats['hits'] + stats['misses']
+    stats['max_size'] = PARSE_CACHE_SIZE
+    stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else None
+    return stats
@@ -0,0 +1,222 @@
+"""
+OCR Service: лексер чисел, дат и карт в тексте чека
+
+Текст чека разбирается один раз одним регулярным выражением в поток
+типизированных токенов, который затем используют все классификаторы:
+- AMOUNT   - сумма (float), разделители тысяч и десятичных уже разобраны,
+             валюта подставляется, если сразу за суммой идёт код валюты
+- DATE     - дата (datetime.date)
+- TIME     - время (datetime.time)
+- CARD     - маска карты, значение - последние 4 цифры
+- CURRENCY - код валюты (UZS, USD, RUB, EUR)
+
+Поддерживаемые форматы сумм: 150000, 150 000, 1 250 000,00, 1,250,000.00,
+1.250.000,00, 12,50, 99.9
+"""
+
+import re
+from collections import namedtuple
+from datetime import date, datetime, time
+
+
+AMOUNT = 'AMOUNT'
+DATE = 'DATE'
+TIME = 'TIME'
+CARD = 'CARD'
+CURRENCY = 'CURRENCY'
+
+Token = namedtuple('Token', ['kind', 'value', 'start', 'end', 'currency'], defaults=[None])
+
+# Нормализация кодов валют
+CURRENCY_CODES = {
+    'uzs': 'UZS',
+    'сум': 'UZS',
+    'сўм': 'UZS',
+    "so'm": 'UZS',
+    'som': 'UZS',
+    'usd': 'USD',
+    'rub': 'RUB',
+    'руб': 'RUB',
+    'eur': 'EUR',
+}
+
+# Порядок альтернатив важен: даты и время раньше сумм, маски карт раньше сумм.
+# Опережающая проверка первого символа отсекает позиции, с которых
+# не начинается ни один токен, без перебора всех альтернатив
+_TOKEN_RE = re.compile(
+    r"""
+    (?=[\d*•+\-usreср])
+    (?:
+    (?P<date>
+        \b(?:\d{2}[./]\d{2}[./]\d{4}|\d{4}-\d{2}-\d{2}|\d{2}\.\d{2}\.\d{2})\b
+    )
+    |(?P<time>
+        \b\d{1,2}:\d{2}(?::\d{2})?\b
+    )
+    |(?P<card>
+        (?:\b\d{4,6}[ ]?)?(?:[*•]+[ ]?)+(?P<last4>\d{4})(?!\d)
+    )
+    |(?P<amount>
+        (?<![\w.,])[-+]?(?:
+            \d{1,3}(?:[ \u00a0\u202f]\d{3})+(?:[.,]\d{1,2})?
+            |\d{1,3}(?:,\d{3})+(?:\.\d{1,2})?
+            |\d{1,3}(?:\.\d{3})+(?:,\d{1,2})?
+            |\d+(?:[.,]\d{1,2})?
+        )(?![\d.,]\d)
+    )
+    |(?P<currency>
+        \b(?:uzs|usd|rub|eur|сум|сўм|руб|so['ʻ‘’]?m)\b
+    )
+    )
+    """,
+    re.IGNORECASE | re.VERBOSE
+)
+
+_GROUP_SEPARATORS = ' \u00a0\u202f'
+
+
+def parse_amount(raw):
+    """
+    Переводит строку суммы в число с учётом разделителей
+
+    Последний разделитель, за которым идут 1-2 цифры, считается десятичным,
+    остальные - разделителями тысяч.
+
+    Args:
+        raw: str - сумма, например '1 250 000,00'
+
+    Returns:
+        float
+    """
+    value = raw
+    for separator in _GROUP_SEPARATORS:
+        value = value.replace(separator, '')
+
+    decimal_at = max(value.rfind('.'), value.rfind(','))
+    if decimal_at != -1 and len(value) - decimal_at - 1 in (1, 2):
+        integer = value[:decimal_at].replace('.', '').replace(',', '')
+        return float(f'{integer}.{value[decimal_at + 1:]}')
+
+    return float(value.replace('.', '').replace(',', ''))
+
+
+def _parse_date(raw):
+    if '-' in raw:
+        year, month, day = raw.split('-')
+    else:
+        day, month, year = re.split(r'[./]', raw)
+    year = int(year)
+    if year < 100:
+        year += 2000
+    return date(year, int(month), int(day))
+
+
+def _parse_time(raw):
+    parts = [int(part) for part in raw.split(':')]
+    return time(*parts)
+
+
+def tokenize(text):
+    """
+    Разбивает текст на типизированные токены за один проход
+
+    Args:
+        text: str - текст чека
+
+    Returns:
+        list - Token(kind, value, start, end, currency) в порядке следования
+    """
+    tokens = []
+    for match in _TOKEN_RE.finditer(text):
+        kind = match.lastgroup
+        raw = match.group(kind)
+        try:
+            if kind == 'date':
+                tokens.append(Token(DATE, _parse_date(raw), match.start(), match.end()))
+            elif kind == 'time':
+                tokens.append(Token(TIME, _parse_time(raw), match.start(), match.end()))
+            elif kind == 'card':
+                tokens.append(Token(CARD, match.group('last4'), match.start(), match.end()))
+            elif kind == 'amount':
+                tokens.append(Token(AMOUNT, parse_amount(raw), match.start(), match.end()))
+            elif kind == 'currency':
+                code = CURRENCY_CODES.get(re.sub(r"['ʻ‘’]", "'", raw.lower()), 'UZS')
+                tokens.append(Token(CURRENCY, code, match.start(), match.end()))
+        except ValueError:
+            # Невалидная дата/время (например, 31.02.2025) - не токен
+            continue
+
+    # Валюта сразу после суммы относится к ней
+    for index in range(len(tokens) - 1):
+        token, following = tokens[index], tokens[index + 1]
+        if (token.kind == AMOUNT and following.kind == CURRENCY
+                and not text[token.end:following.start].strip()):
+            tokens[index] = token._replace(currency=following.value)
+
+    return tokens
+
+
+def line_prefix(text, token):
+    """
+    Текст строки перед токеном в нижнем регистре (для поиска меток «Сумма:», «Карта:»)
+    """
+    line_start = text.rfind('\n', 0, token.start) + 1
+    return text[line_start:token.start].lower()
+
+
+def find_amount(tokens, text, currencies=None, labels=()):
+    """
+    Первая сумма с валютой; суммы со строкой-меткой из labels приоритетнее
+
+    Args:
+        tokens: list - токены (tokenize)
+        text: str - исходный текст
+        currencies: set - допустимые валюты (None = любая)
+        labels: tuple - метки строки, например ('сумма', 'amount')
+
+    Returns:
+        Token или None
+    """
+    candidates = [
+        token for token in tokens
+        if token.kind == AMOUNT and token.currency
+        and (currencies is None or token.currency in currencies)
+    ]
+    for token in candidates:
+        prefix = line_prefix(text, token)
+        if any(label in prefix for label in labels):
+            return token
+    return candidates[0] if candidates else None
+
+
+def find_card(tokens, text, labels=()):
+    """
+    Маска карты; маски со строкой-меткой из labels приоритетнее
+
+    Returns:
+        Token или None
+    """
+    cards = [token for token in tokens if token.kind == CARD]
+    for token in cards:
+        prefix = line_prefix(text, token)
+        if any(label in prefix for label in labels):
+            return token
+    return cards[0] if cards else None
+
+
+def find_datetime(tokens, text):
+    """
+    Первая пара дата + время (в любом порядке), разделённая только пробелами
+
+    Returns:
+        datetime.datetime или None
+    """
+    for index in range(len(tokens) - 1):
+        first, second = tokens[index], tokens[index + 1]
+        if text[first.end:second.start].strip():
+            continue
+        if first.kind == DATE and second.kind == TIME:
+            return datetime.combine(first.value, second.value)
+        if first.kind == TIME and second.kind == DATE:
+            return datetime.combine(second.value, first.value)
+    return None
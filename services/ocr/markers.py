@@ -0,0 +1,183 @@
+"""
+OCR Service: нечёткий поиск маркеров банков в OCR-тексте
+
+OCR портит маркеры: «UZIJM» вместо «UZUM», «тpанзакция» с латинской «p».
+Поиск устойчив к таким ошибкам:
+1. Свёртка: кириллица и латиница с одинаковым начертанием приводятся
+   к одной букве, «у»/«з» - к латинским «u»/«z» («Узум» = «Uzum»),
+   типичные OCR-склейки («ij» -> «u», «rn» -> «m») - к исходной
+2. Ограниченное расстояние Левенштейна: маркеры до 5 символов - только
+   точно (у коротких слов одна правка даёт настоящие слова: «uzun», «izum»),
+   1 правка - до 11 символов («Translation» не «transaction»), 2 - длиннее
+
+Индекс - словарь удалений (symmetric delete): для каждого маркера заранее
+построены все варианты с удалёнными до k символами. Для слова текста
+строятся его удаления и ищутся в словаре, поэтому время поиска линейно
+по длине текста и не зависит от числа маркеров и банков.
+"""
+
+import re
+
+
+# Кириллица, совпадающая по начертанию с латиницей, и OCR-путаница цифр/букв.
+# «у» и «з» сворачиваются в «u» и «z» (названия банков пишут и кириллицей),
+# их латинские/цифровые двойники «y» и «3» - туда же
+HOMOGLYPHS = str.maketrans({
+    'а': 'a', 'в': 'b', 'е': 'e', 'ё': 'e', 'з': 'z', 'к': 'k', 'м': 'm',
+    'н': 'h', 'о': 'o', 'р': 'p', 'с': 'c', 'т': 't', 'у': 'u', 'х': 'x',
+    'ь': 'b', 'і': 'i', 'ј': 'j', 'ѕ': 's',
+    'y': 'u', '3': 'z',
+    '0': 'o', '1': 'i', 'l': 'i', '|': 'i', '!': 'i',
+})
+
+# Склейки, которые OCR выдаёт вместо одной буквы
+OCR_DIGRAPHS = [
+    ('ij', 'u'),
+    ('ii', 'u'),
+    ('rn', 'm'),
+    ('vv', 'w'),
+]
+
+# Слова короче не ищутся нечётко: слишком много ложных совпадений
+MIN_FUZZY_LENGTH = 4
+
+# Маркеры не длиннее совпадают только точно (после свёртки)
+EXACT_MAX_LENGTH = 5
+
+# Маркеры не длиннее допускают 1 правку, длиннее - 2
+ONE_EDIT_MAX_LENGTH = 11
+
+# Размер кэша результатов по словам (слова в сообщениях ботов сильно повторяются)
+WORD_CACHE_SIZE = 65536
+
+_WORD_RE = re.compile(r'[\w|!]+')
+
+
+def fold(text):
+    """
+    Приводит текст к свёрнутой форме для сравнения (регистр, омоглифы, склейки)
+
+    Args:
+        text: str - исходный текст
+
+    Returns:
+        str
+    """
+    folded = text.lower()
+    for digraph, letter in OCR_DIGRAPHS:
+        folded = folded.replace(digraph, letter)
+    return folded.translate(HOMOGLYPHS)
+
+
+def max_distance(word):
+    """Допустимое число правок для слова данной длины"""
+    if len(word) <= EXACT_MAX_LENGTH:
+        return 0
+    return 1 if len(word) <= ONE_EDIT_MAX_LENGTH else 2
+
+
+def _deletions(word, distance):
+    variants = {word}
+    frontier = variants
+    for _ in range(distance):
+        frontier = {
+            variant[:index] + variant[index + 1:]
+            for variant in frontier
+            for index in range(len(variant))
+        }
+        variants |= frontier
+    return variants
+
+
+def _within_distance(first, second, limit):
+    """Расстояние Левенштейна не больше limit (с отсечением по диагонали)"""
+    if abs(len(first) - len(second)) > limit:
+        return False
+    previous = list(range(len(second) + 1))
+    for i, char_a in enumerate(first, 1):
+        current = [i] + [0] * len(second)
+        for j, char_b in enumerate(second, 1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b)
+            )
+        if min(current) > limit:
+            return False
+        previous = current
+    return previous[-1] <= limit
+
+
+class FuzzyMarkerIndex:
+    """
+    Индекс маркеров: метка (например, имя классификатора) -> слова-маркеры
+    """
+
+    def __init__(self):
+        self._exact = {}
+        self._deletions = {}
+        # Границы длины слов, которые вообще могут совпасть с маркером
+        self._min_length = None
+        self._max_length = 0
+        self._word_cache = {}
+
+    def add(self, label, marker):
+        """
+        Регистрирует маркер
+
+        Args:
+            label: str - метка, возвращаемая при совпадении
+            marker: str - слово-маркер (например, 'uzum', 'транзакция')
+        """
+        folded = fold(marker)
+        self._exact.setdefault(folded, set()).add(label)
+        if len(folded) < MIN_FUZZY_LENGTH or max_distance(folded) == 0:
+            return
+        distance = max_distance(folded)
+        lower = max(MIN_FUZZY_LENGTH, len(folded) - distance)
+        self._min_length = lower if self._min_length is None else min(self._min_length, lower)
+        self._max_length = max(self._max_length, len(folded) + distance)
+        for variant in _deletions(folded, max_distance(folded)):
+            self._deletions.setdefault(variant, set()).add((folded, label))
+        self._word_cache = {}
+
+    def find(self, text):
+        """
+        Ищет маркеры в тексте
+
+        Args:
+            text: str - OCR-текст
+
+        Returns:
+            dict - метка -> первое найденное слово текста
+        """
+        found = {}
+        for match in _WORD_RE.finditer(text):
+            for label in self._match_word(match.group()):
+                found.setdefault(label, match.group())
+        return found
+
+    def _match_word(self, raw):
+        """Метки маркеров, совпадающих со словом (с кэшем по слову)"""
+        labels = self._word_cache.get(raw)
+        if labels is not None:
+            return labels
+
+        word = fold(raw)
+        matched = set(self._exact.get(word, ()))
+        if (self._min_length is not None and self._min_length <= len(word) <= self._max_length
+                and not word.isdigit()):
+            for variant in _deletions(word, max_distance(word)):
+                for marker, label in self._deletions.get(variant, ()):
+                    if label not in matched and _within_distance(word, marker, max_distance(marker)):
+                        matched.add(label)
+
+        labels = tuple(matched)
+        if len(self._word_cache) >= WORD_CACHE_SIZE:
+            self._word_cache.clear()
+        self._word_cache[raw] = labels
+        return labels
+
+    def labels(self, text):
+        """Множество меток, маркеры которых есть в тексте"""
+        return set(self.find(text))
@@ -1,15 +1,104 @@
 """
 patch-017 §2: OCR Engine - распознавание текста с изображений
 
-Использует Tesseract OCR с настройками для банковских чеков
+Использует Tesseract OCR с настройками для банковских чеков.
+Режим multi-PSM параллельно запускает несколько page segmentation modes
+и выбирает лучший результат.
+
+Процесс Tesseract запускается здесь же (а не через image_to_string), чтобы
+его можно было убить: при отмене режима (победитель уже выбран) и по
+дедлайну бюджета.
 """
 
 import io
+import os
+import shlex
+import subprocess
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import pytesseract
+from pytesseract import pytesseract as tesseract_api
 from PIL import Image
 
 
-def extract_text(image_bytes, lang='rus+eng', config=''):
+# Режимы сегментации для multi-PSM:
+# 4 = одна колонка текста переменного размера, 6 = единый блок, 11 = разреженный текст
+DEFAULT_PSM_MODES = [4, 6, 11]
+
+# Бюджет времени multi-PSM и порог «достаточно хорошего» результата
+PSM_BUDGET_MS = int(os.getenv('OCR_PSM_BUDGET_MS', 8000))
+PSM_GOOD_ENOUGH = float(os.getenv('OCR_PSM_GOOD_ENOUGH', 85))
+
+# Минимальный таймаут вызова Tesseract: 0 означает отсутствие лимита
+MIN_CALL_TIMEOUT = 0.05
+
+# Как часто работающий вызов Tesseract проверяет отмену, сек
+CANCEL_POLL_SEC = 0.02
+
+
+class OcrCancelled(Exception):
+    """Распознавание отменено: другой режим уже дал достаточный результат"""
+
+
+def _call_timeout(timeout, deadline):
+    """Таймаут очередного вызова Tesseract с учётом общего дедлайна"""
+    if deadline is None:
+        return timeout
+    remaining = max(MIN_CALL_TIMEOUT, deadline - time.monotonic())
+    return min(timeout, remaining) if timeout else remaining
+
+
+def _run_tesseract(image, extension, lang, config, timeout=0, cancel_event=None):
+    """
+    Один вызов Tesseract; процесс убивается по таймауту или при cancel_event
+
+    Returns:
+        str - содержимое выходного файла (txt или tsv)
+
+    Raises:
+        OcrCancelled: cancel_event установлен до завершения процесса
+        RuntimeError: истёк таймаут
+        pytesseract.TesseractError: Tesseract завершился с ошибкой
+    """
+    if cancel_event is not None and cancel_event.is_set():
+        raise OcrCancelled('cancelled before start')
+
+    with tesseract_api.save(image) as (temp_name, input_filename):
+        cmd = [tesseract_api.tesseract_cmd, input_filename, temp_name, '-l', lang, *shlex.split(config)]
+        if extension == 'tsv':
+            cmd += ['-c', 'tessedit_create_tsv=1']
+        else:
+            cmd.append(extension)
+        try:
+            proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        except FileNotFoundError:
+            raise pytesseract.TesseractNotFoundError()
+
+        stop_at = time.monotonic() + timeout if timeout else None
+        try:
+            while True:
+                try:
+                    _, errors = proc.communicate(timeout=CANCEL_POLL_SEC)
+                    break
+                except subprocess.TimeoutExpired:
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise OcrCancelled('cancelled')
+                    if stop_at is not None and time.monotonic() >= stop_at:
+                        raise RuntimeError('Tesseract process timeout')
+        finally:
+            if proc.returncode is None:
+                proc.kill()
+                proc.communicate()
+
+        if proc.returncode:
+            raise pytesseract.TesseractError(proc.returncode, errors.decode('utf-8', 'ignore').strip())
+        with open(f'{temp_name}.{extension}', encoding='utf-8') as output:
+            return output.read()
+
+
+def extract_text(image_bytes, lang='rus+eng', config='', psm=6, timeout=0, cancel_event=None,
+                 deadline=None):
     """
     Извлекает текст из изображения используя Tesseract OCR
 
@@ -17,6 +106,10 @@ def extract_text(image_bytes, lang='rus+eng', config=''):
         image_bytes: bytes - изображение для распознавания
         lang: str - языки для распознавания (по умолчанию русский + английский)
         config: str - дополнительные параметры Tesseract
+        psm: int - page segmentation mode (по умолчанию 6)
+        timeout: float - лимит времени на каждый вызов Tesseract в секундах (0 = без лимита)
+        cancel_event: threading.Event - отмена: работающий процесс Tesseract убивается
+        deadline: float - time.monotonic(), после которого процесс Tesseract убивается
 
     Returns:
         dict - результаты OCR:
@@ -30,25 +123,48 @@ def extract_text(image_bytes, lang='rus+eng', config=''):
     # Базовая конфигурация Tesseract для банковских чеков
     # --psm 6 = Assume a single uniform block of text (подходит для чеков)
     # --oem 3 = Use both legacy and LSTM engines (лучшее качество)
-    default_config = '--psm 6 --oem 3'
+    default_config = f'--psm {psm} --oem 3'
     full_config = f"{default_config} {config}".strip()
 
     # Извлекаем текст
-    text = pytesseract.image_to_string(image, lang=lang, config=full_config)
+    text = _run_tesseract(
+        image, 'txt', lang, full_config, _call_timeout(timeout, deadline), cancel_event
+    )
 
     # Получаем детальные данные с координатами и уверенностью
-    data = pytesseract.image_to_data(image, lang=lang, config=full_config, output_type=pytesseract.Output.DICT)
+    data = tesseract_api.file_to_dict(
+        _run_tesseract(image, 'tsv', lang, full_config, _call_timeout(timeout, deadline), cancel_event),
+        '\t',
+        -1
+    )
 
     # Вычисляем среднюю уверенность
     confidences = [int(conf) for conf in data['conf'] if conf != '-1']
     avg_confidence = sum(confidences) / len(confidences) if confidences else 0
 
-    # Группируем по строкам
+    return {
+        'text': text.strip(),
+        'confidence': avg_confidence,
+        'lines': _group_lines(data)
+    }
+
+
+def _group_lines(data, scale=1.0):
+    """
+    Группирует слова image_to_data по строкам
+
+    Args:
+        data: dict - вывод Tesseract TSV (file_to_dict)
+        scale: float - множитель координат слов (пересчёт на другое разрешение)
+
+    Returns:
+        list - строки {text, confidence, words: [{text, confidence, left, top, width, height}]}
+    """
     lines = []
     current_line = []
     current_line_num = -1
 
-    for i in range(len(data['text'])):
+    for i in range(len(data.get('text', []))):
         if data['text'][i].strip() == '':
             continue
 
@@ -67,10 +183,10 @@ def extract_text(image_bytes, lang='rus+eng', config=''):
         current_line.append({
             'text': data['text'][i],
             'confidence': int(data['conf'][i]) if data['conf'][i] != '-1' else 0,
-            'left': data['left'][i],
-            'top': data['top'][i],
-            'width': data['width'][i],
-            'height': data['height'][i]
+            'left': round(data['left'][i] * scale),
+            'top': round(data['top'][i] * scale),
+            'width': round(data['width'][i] * scale),
+            'height': round(data['height'][i] * scale)
         })
 
     # Добавляем последнюю строку
@@ -81,12 +197,146 @@ def extract_text(image_bytes, lang='rus+eng', config=''):
             'words': current_line
         })
 
-    return {
-        'text': text.strip(),
-        'confidence': avg_confidence,
-        'lines': lines
+    return lines
+
+
+def extract_lines(image_bytes, lang='rus+eng', psm=6, scale=1.0, timeout=0):
+    """
+    Строки с координатами слов за один вызов Tesseract (только TSV, без текста)
+
+    Дешёвый проход для геометрии: например, чтобы не резать длинный
+    скриншот через строку текста (segmentation.py).
+
+    Args:
+        image_bytes: bytes - изображение
+        lang: str - языки для распознавания
+        psm: int - page segmentation mode
+        scale: float - множитель координат (изображение меньше того, к которому они относятся)
+        timeout: float - лимит времени вызова Tesseract в секундах (0 = без лимита)
+
+    Returns:
+        list - строки в формате extract_text()['lines']
+    """
+    image = Image.open(io.BytesIO(image_bytes))
+    data = tesseract_api.file_to_dict(
+        _run_tesseract(image, 'tsv', lang, f'--psm {psm} --oem 3', timeout),
+        '\t',
+        -1
+    )
+    return _group_lines(data, scale)
+
+
+def _run_psm(image_bytes, psm, lang, config, deadline, cancel_event, score_fn):
+    """Распознаёт изображение в одном режиме PSM и оценивает результат"""
+    start = time.perf_counter()
+    result = extract_text(
+        image_bytes,
+        lang=lang,
+        config=config,
+        psm=psm,
+        cancel_event=cancel_event,
+        deadline=deadline
+    )
+    score = score_fn(result) if score_fn else result['confidence']
+    return result, score, round((time.perf_counter() - start) * 1000, 1)
+
+
+def extract_text_multi_psm(image_bytes, psm_modes=None, lang='rus+eng', config='',
+                           score_fn=None, budget_ms=None, good_enough=None):
+    """
+    Параллельно распознаёт изображение в нескольких режимах PSM
+    и возвращает лучший результат
+
+    Режимы запускаются одновременно в собственном пуле потоков запроса:
+    проигравшие режимы не занимают потоки следующих запросов. Как только
+    результат набирает good_enough баллов (или истекает бюджет), остальные
+    отменяются: их работающие процессы Tesseract убиваются сразу, а не
+    дожигают CPU до дедлайна. Возвращается лучший из готовых результатов.
+
+    Args:
+        image_bytes: bytes - изображение для распознавания
+        psm_modes: list - режимы сегментации (по умолчанию [4, 6, 11])
+        lang: str - языки для распознавания
+        config: str - дополнительные параметры Tesseract
+        score_fn: callable - оценка результата OCR (0-100), по умолчанию confidence
+        budget_ms: int - бюджет времени в миллисекундах (по умолчанию OCR_PSM_BUDGET_MS)
+        good_enough: float - порог досрочной остановки (по умолчанию OCR_PSM_GOOD_ENOUGH)
+
+    Returns:
+        dict - результат extract_text лучшего режима, дополненный полями:
+            - psm: int - выбранный режим
+            - score: float - его оценка
+            - candidates: list - {psm, score, confidence, duration_ms} или {psm, error};
+              режимы, успевшие завершиться к моменту выбора, тоже с оценкой
+
+    Raises:
+        RuntimeError: если ни один режим не завершился успешно
+    """
+    psm_modes = psm_modes or DEFAULT_PSM_MODES
+    budget_ms = PSM_BUDGET_MS if budget_ms is None else budget_ms
+    good_enough = PSM_GOOD_ENOUGH if good_enough is None else good_enough
+
+    deadline = time.monotonic() + budget_ms / 1000
+    cancel_event = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=len(psm_modes), thread_name_prefix='ocr-psm')
+    futures = {
+        executor.submit(
+            _run_psm, image_bytes, psm, lang, config, deadline, cancel_event, score_fn
+        ): psm
+        for psm in psm_modes
     }
 
+    best = None
+    candidates = []
+    pending = set(futures)
+
+    def collect(done):
+        nonlocal best
+        for future in done:
+            psm = futures[future]
+            try:
+                result, score, duration_ms = future.result()
+            except Exception as e:
+                candidates.append({'psm': psm, 'error': str(e)})
+                continue
+
+            candidates.append({
+                'psm': psm,
+                'score': score,
+                'confidence': result['confidence'],
+                'duration_ms': duration_ms
+            })
+            if best is None or score > best['score']:
+                best = {**result, 'psm': psm, 'score': score}
+
+    try:
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            collect(done)
+
+            if best is not None and best['score'] >= good_enough:
+                break
+
+        # Режимы, завершившиеся одновременно с победителем, - полноценные результаты
+        finished = {future for future in pending if future.done()}
+        collect(finished)
+        for future in pending - finished:
+            candidates.append({'psm': futures[future], 'error': 'cancelled'})
+    finally:
+        # Проигравшие режимы больше не нужны: их процессы Tesseract убиваются
+        cancel_event.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    if best is None:
+        raise RuntimeError(f'No PSM mode finished within {budget_ms} ms: {candidates}')
+
+    best['candidates'] = candidates
+    return best
+
 
 def extract_text_simple(image_bytes):
     """
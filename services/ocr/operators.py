@@ -0,0 +1,313 @@
+"""
+OCR Service: справочник операторов в памяти
+
+Справочник operators (pattern, canonical_name, synonyms -> app_name, is_p2p)
+загружается один раз и периодически обновляется: из JSON-выгрузки
+(OCR_OPERATORS_FILE) или из backend API (GET /api/operators). Запросов к БД
+на каждый чек нет.
+
+Строка оператора из чека сопоставляется со справочником:
+1. Автомат Ахо-Корасик по всем названиям: самое длинное название,
+   входящее в строку (как Operator.findByPartialMatch в backend)
+2. Префикс: строка - начало названия (терминалы обрезают названия, «UPAY HUMO2HUMO P2P»)
+3. Нечётко: сходство по триграммам (OCR-ошибки в названии)
+
+Перед сопоставлением строки свёртываются (markers.fold): регистр,
+кириллица/латиница одинакового начертания, лишние пробелы.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+import urllib.request
+from collections import Counter, deque, namedtuple
+from datetime import datetime, timezone
+
+from markers import fold
+
+
+OPERATORS_URL = os.getenv('OCR_OPERATORS_URL', 'http://backend:3001/api/operators')
+OPERATORS_FILE = os.getenv('OCR_OPERATORS_FILE', '')
+OPERATORS_REFRESH_SEC = int(os.getenv('OCR_OPERATORS_REFRESH_SEC', 300))
+
+# Минимальная длина названия и строки для поиска по префиксу
+MIN_KEY_LENGTH = 3
+MIN_PREFIX_LENGTH = 8
+
+# Порог сходства по триграммам (коэффициент Дайса)
+FUZZY_THRESHOLD = 0.6
+
+OperatorMatch = namedtuple('OperatorMatch', ['app_name', 'is_p2p', 'canonical_name', 'method', 'score'])
+
+_SPACES_RE = re.compile(r'\s+')
+
+
+def normalize(value):
+    """Свёрнутая форма названия для сопоставления"""
+    return _SPACES_RE.sub(' ', fold(value)).strip()
+
+
+def _trigrams(value):
+    padded = f' {value} '
+    return {padded[index:index + 3] for index in range(len(padded) - 2)}
+
+
+class OperatorIndex:
+    """
+    Неизменяемый индекс справочника: при обновлении строится новый и подменяется целиком
+    """
+
+    def __init__(self, operators):
+        self.entries = []
+        self._goto = [{}]
+        self._fail = [0]
+        self._terminal = [None]
+        self._output = [None]
+        self._shortest_below = [None]
+        self._keys = []
+        self._trigram_index = {}
+
+        for operator in operators:
+            if not operator.get('app_name'):
+                continue
+            entry = OperatorMatch(
+                app_name=operator['app_name'],
+                is_p2p=bool(operator.get('is_p2p', True)),
+                canonical_name=operator.get('canonical_name') or operator.get('pattern'),
+                method=None,
+                score=None
+            )
+            self.entries.append(entry)
+            names = [operator.get('pattern'), operator.get('canonical_name')] + list(operator.get('synonyms') or [])
+            for name in names:
+                key = normalize(name or '')
+                if len(key) >= MIN_KEY_LENGTH:
+                    self._add_key(key, len(self.entries) - 1)
+
+        self._build_links()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _add_key(self, key, entry_index):
+        node = 0
+        for char in key:
+            following = self._goto[node].get(char)
+            if following is None:
+                following = len(self._goto)
+                self._goto[node][char] = following
+                self._goto.append({})
+                self._fail.append(0)
+                self._terminal.append(None)
+                self._output.append(None)
+                self._shortest_below.append(None)
+            node = following
+
+        # Название заканчивается в узле: (длина, номер записи); дубликаты - первая запись
+        if self._terminal[node] is None:
+            self._terminal[node] = (len(key), entry_index)
+            self._output[node] = self._terminal[node]
+
+        key_index = len(self._keys)
+        self._keys.append((key, entry_index, _trigrams(key)))
+        for trigram in self._keys[-1][2]:
+            self._trigram_index.setdefault(trigram, []).append(key_index)
+
+    def _build_links(self):
+        # Обход в ширину: суффиксные ссылки и самое длинное название, заканчивающееся в узле
+        order = []
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            order.append(node)
+            for char, child in self._goto[node].items():
+                state = self._fail[node]
+                while state and char not in self._goto[state]:
+                    state = self._fail[state]
+                self._fail[child] = self._goto[state].get(char, 0)
+                inherited = self._output[self._fail[child]]
+                if inherited and (self._output[child] is None or inherited[0] > self._output[child][0]):
+                    self._output[child] = inherited
+                queue.append(child)
+
+        # Обход снизу вверх: кратчайшее название в поддереве (для поиска по префиксу)
+        for node in reversed([0] + order):
+            best = self._terminal[node]
+            for child in self._goto[node].values():
+                below = self._shortest_below[child]
+                if below and (best is None or below[0] < best[0]):
+                    best = below
+            self._shortest_below[node] = best
+
+    def _match(self, entry_index, method, score):
+        return self.entries[entry_index]._replace(method=method, score=round(score, 3))
+
+    def resolve(self, operator):
+        """
+        Сопоставляет строку оператора со справочником
+
+        Args:
+            operator: str - оператор/продавец из чека
+
+        Returns:
+            OperatorMatch или None
+        """
+        text = normalize(operator or '')
+        if len(text) < MIN_KEY_LENGTH or not self.entries:
+            return None
+
+        # 1. Самое длинное название, входящее в строку
+        best = None
+        node = 0
+        for char in text:
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            found = self._output[node]
+            if found and (best is None or found[0] > best[0]):
+                best = found
+        if best:
+            return self._match(best[1], 'substring', best[0] / len(text))
+
+        # 2. Строка - начало названия
+        if len(text) >= MIN_PREFIX_LENGTH:
+            node = 0
+            for char in text:
+                node = self._goto[node].get(char)
+                if node is None:
+                    break
+            else:
+                below = self._shortest_below[node]
+                if below:
+                    return self._match(below[1], 'prefix', len(text) / below[0])
+
+        # 3. Сходство по триграммам
+        trigrams = _trigrams(text)
+        shared = Counter()
+        for trigram in trigrams:
+            shared.update(self._trigram_index.get(trigram, ()))
+        best_score = 0
+        best_entry = None
+        for key_index, count in shared.items():
+            key_trigrams = self._keys[key_index][2]
+            score = 2 * count / (len(trigrams) + len(key_trigrams))
+            if score > best_score:
+                best_score, best_entry = score, self._keys[key_index][1]
+        if best_entry is not None and best_score >= FUZZY_THRESHOLD:
+            return self._match(best_entry, 'fuzzy', best_score)
+
+        return None
+
+
+_index = OperatorIndex([])
+_state = {
+    'source': None,
+    'operators': 0,
+    'loaded_at': None,
+    'load_ms': None,
+    'error': None,
+}
+_state_lock = threading.Lock()
+
+
+def _rows(payload):
+    # backend отвечает {"success": true, "data": [...]}, выгрузка может быть просто списком
+    return payload.get('data', []) if isinstance(payload, dict) else payload
+
+
+def load_operators():
+    """
+    Загружает справочник из JSON-выгрузки или backend API
+
+    Returns:
+        tuple - (source: str, operators: list of dict)
+    """
+    if OPERATORS_FILE:
+        with open(OPERATORS_FILE, encoding='utf-8') as fp:
+            return OPERATORS_FILE, _rows(json.load(fp))
+
+    with urllib.request.urlopen(OPERATORS_URL, timeout=10) as response:
+        return OPERATORS_URL, _rows(json.loads(response.read().decode('utf-8')))
+
+
+def refresh_operators():
+    """
+    Перестраивает индекс справочника; при ошибке остаётся прежний индекс
+
+    Returns:
+        dict - состояние справочника (см. get_operator_stats)
+    """
+    global _index
+    start = time.perf_counter()
+    try:
+        source, operators = load_operators()
+        index = OperatorIndex(operators)
+        _index = index
+        with _state_lock:
+            _state.update(
+                source=source,
+                operators=len(index),
+                loaded_at=datetime.now(timezone.utc).isoformat(),
+                load_ms=round((time.perf_counter() - start) * 1000, 1),
+                error=None
+            )
+    except Exception as e:
+        with _state_lock:
+            _state['error'] = str(e)
+        print(f"⚠️ Operators refresh failed: {e}")
+    return get_operator_stats()
+
+
+def start_operator_refresh():
+    """
+    Загружает справочник и обновляет его в фоне каждые OPERATORS_REFRESH_SEC секунд
+
+    Returns:
+        threading.Thread - поток обновления
+    """
+    def loop():
+        while True:
+            refresh_operators()
+            time.sleep(OPERATORS_REFRESH_SEC)
+
+    thread = threading.Thread(target=loop, name='ocr-operators', daemon=True)
+    thread.start()
+    return thread
+
+
+def get_operator_stats():
+    """Состояние справочника операторов: источник, размер, время загрузки, ошибка"""
+    with _state_lock:
+        return dict(_state)
+
+
+def resolve_operator(operator):
+    """
+    Сопоставляет строку оператора с текущим справочником (см. OperatorIndex.resolve)
+    """
+    return _index.resolve(operator)
+
+
+def apply_operator(result):
+    """
+    Уточняет app_name и is_p2p разобранного чека по справочнику операторов
+
+    Args:
+        result: dict - результат classify_and_parse (изменяется на месте)
+
+    Returns:
+        dict - тот же результат; при совпадении в data добавляются
+               operator_canonical и operator_match
+    """
+    data = result['data']
+    match = resolve_operator(data.get('operator'))
+    if match:
+        if match.is_p2p != data.get('is_p2p'):
+            data['transaction_type'] = 'P2P перевод' if match.is_p2p else 'Оплата'
+        data['app_name'] = match.app_name
+        data['is_p2p'] = match.is_p2p
+        data['operator_canonical'] = match.canonical_name
+        data['operator_match'] = match.method
+    return result
@@ -0,0 +1,141 @@
+"""
+OCR Service: чеки и выписки в PDF
+
+Страницы обрабатываются по одной, параллельно в OCR_PDF_WORKERS потоках:
+- страница с текстовым слоем разбирается напрямую, без OCR
+- страница-скан растрируется в оттенках серого с разрешением OCR_PDF_DPI
+  и проходит тот же pipeline, что и изображения (предобработка, OCR, разбор)
+
+Память ограничена: одновременно в работе не больше OCR_PDF_WORKERS страниц,
+растровое изображение страницы живёт только внутри её задачи.
+
+Требует PyMuPDF (requirements.txt, ставится в образ OCR-сервиса); без него
+PDF не принимаются.
+"""
+
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import pymupdf
+except ImportError:
+    try:
+        import fitz as pymupdf
+    except ImportError:
+        pymupdf = None
+
+from preprocessing import preprocess_image
+from ocr_engine import extract_text
+from templates import parse_message
+
+
+PDF_DPI = int(os.getenv('OCR_PDF_DPI', 200))
+PDF_MAX_PAGES = int(os.getenv('OCR_PDF_MAX_PAGES', 50))
+PDF_WORKERS = int(os.getenv('OCR_PDF_WORKERS', 2))
+
+# Минимум символов текстового слоя, чтобы не распознавать страницу через OCR
+MIN_TEXT_LAYER_CHARS = 20
+
+_pdf_executor = ThreadPoolExecutor(max_workers=PDF_WORKERS, thread_name_prefix='ocr-pdf')
+
+
+class PdfError(ValueError):
+    """PDF не может быть обработан (нет PyMuPDF, повреждён, слишком много страниц)"""
+
+
+def is_pdf(data):
+    """Данные - PDF-документ (по сигнатуре)"""
+    return data[:1024].lstrip().startswith(b'%PDF')
+
+
+def _parse(text):
+    try:
+        return parse_message(text), None
+    except ValueError as e:
+        return None, str(e)
+
+
+def _process_page(document, document_lock, number, lang):
+    """Разбирает одну страницу: текстовый слой или растр + OCR"""
+    # MuPDF-документ не потокобезопасен: чтение страницы - под блокировкой
+    with document_lock:
+        page = document.load_page(number)
+        text = page.get_text().strip()
+        image_bytes = None
+        if len(text) < MIN_TEXT_LAYER_CHARS:
+            pixmap = page.get_pixmap(dpi=PDF_DPI, colorspace=pymupdf.csGRAY, alpha=False)
+            image_bytes = pixmap.tobytes('png')
+            del pixmap
+
+    result = {'page': number + 1}
+    if image_bytes is None:
+        result.update(source='text', text=text, ocr_confidence=None)
+    else:
+        processed_bytes, _ = preprocess_image(image_bytes)
+        del image_bytes
+        ocr_result = extract_text(processed_bytes, lang=lang)
+        result.update(source='ocr', text=ocr_result['text'], ocr_confidence=ocr_result['confidence'])
+
+    result['parsed_data'], result['error'] = _parse(result['text']) if result['text'] else (None, 'Empty page')
+    return result
+
+
+def process_pdf(pdf_bytes, lang='rus+eng', max_pages=None):
+    """
+    Разбирает все страницы PDF
+
+    Args:
+        pdf_bytes: bytes - PDF-документ
+        lang: str - языки Tesseract для страниц без текстового слоя
+        max_pages: int - лимит страниц (по умолчанию OCR_PDF_MAX_PAGES)
+
+    Returns:
+        dict:
+            - pages: int - число страниц
+            - receipts: list - {page, source: text|ocr, text, ocr_confidence, parsed_data}
+            - unparsed: list - {page, source, text, error}
+
+    Raises:
+        PdfError: PyMuPDF не установлен, PDF повреждён или страниц больше лимита
+    """
+    if pymupdf is None:
+        raise PdfError('PDF support is not installed (pip install pymupdf)')
+
+    max_pages = max_pages or PDF_MAX_PAGES
+    try:
+        document = pymupdf.open(stream=pdf_bytes, filetype='pdf')
+    except Exception as e:
+        raise PdfError(f'Invalid PDF: {e}')
+
+    try:
+        if document.needs_pass:
+            raise PdfError('PDF is password protected')
+        if document.page_count > max_pages:
+            raise PdfError(f'PDF has {document.page_count} pages, limit is {max_pages}')
+
+        document_lock = threading.Lock()
+        pages = []
+        in_flight = deque()
+        # Скользящее окно: новая страница ставится в работу, когда освобождается место
+        for number in range(document.page_count):
+            if len(in_flight) >= PDF_WORKERS:
+                pages.append(in_flight.popleft().result())
+            in_flight.append(_pdf_executor.submit(_process_page, document, document_lock, number, lang))
+        while in_flight:
+            pages.append(in_flight.popleft().result())
+
+        return {
+            'pages': document.page_count,
+            'receipts': [
+                {key: page[key] for key in ('page', 'source', 'text', 'ocr_confidence', 'parsed_data')}
+                for page in pages if page['parsed_data']
+            ],
+            'unparsed': [
+                {key: page[key] for key in ('page', 'source', 'text', 'error')}
+                for page in pages if not page['parsed_data']
+            ],
+        }
+    finally:
+        document.close()
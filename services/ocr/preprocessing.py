@@ -2,7 +2,10 @@
 patch-017 §2: Preprocessing pipeline для улучшения качества изображений перед OCR
 
 Этапы обработки:
-1. Загрузка изображения
+1. Загрузка изображения (проверка бюджета пикселей) и определение типа:
+   скриншот приложения или фото камеры. Скриншоты (в том числе длинные
+   прокручиваемые) идут по короткому пути: только grayscale, в исходном
+   разрешении. JPEG draft-декодирование - только для фото
 2. Resize (если слишком большое/маленькое)
 3. Deskew (выравнивание наклона)
 4. Sharpen (увеличение резкости)
@@ -11,20 +14,201 @@ patch-017 §2: Preprocessing pipeline для улучшения качества
 """
 
 import io
-from PIL import Image, ImageFilter, ImageEnhance
+import os
+import time
+from PIL import Image, ImageChops, ImageFilter, ImageEnhance
 
 
-def load_image(image_bytes):
+# Границы размера изображения для OCR (используются resize_if_needed и draft-декодированием)
+MIN_SIDE = 800
+MAX_SIDE = 2000
+
+# Максимальное число пикселей исходного изображения (защита от decompression bomb)
+MAX_IMAGE_PIXELS = int(os.getenv('OCR_MAX_IMAGE_PIXELS', 60_000_000))
+
+# Короткий путь для скриншотов приложений (Uzum, Click, Payme)
+SCREENSHOT_FAST_PATH = os.getenv('OCR_SCREENSHOT_FAST_PATH', 'true').lower() in ('1', 'true', 'yes')
+
+# Разрешения экранов популярных телефонов (ширина x высота, портрет)
+DEVICE_RESOLUTIONS = {
+    (720, 1280), (720, 1520), (720, 1600), (750, 1334), (828, 1792),
+    (1080, 1920), (1080, 2160), (1080, 2280), (1080, 2340), (1080, 2400),
+    (1080, 2408), (1080, 2412), (1125, 2436), (1170, 2532), (1179, 2556),
+    (1242, 2208), (1242, 2688), (1284, 2778), (1290, 2796), (1440, 2560),
+    (1440, 3040), (1440, 3088), (1440, 3200),
+}
+
+# Отношение сторон, начиная с которого изображение похоже на экран телефона
+# (фото камер - 4:3 и 3:2) и, начиная со второго, на прокручиваемый скриншот
+SCREENSHOT_MIN_ASPECT = 1.6
+LONG_SCREENSHOT_ASPECT = 2.5
+
+# Доля соседних пикселей одинаковой яркости, начиная с которой
+# считаем, что у изображения нет шума матрицы камеры
+SCREENSHOT_FLAT_RATIO = 0.6
+
+# Максимальное число цветов в пробе, при котором палитра считается «цифровой»
+SCREENSHOT_MAX_COLORS = 4096
+
+# Шаги по умолчанию для фото и для скриншотов
+PHOTO_STEPS = ['resize', 'sharpen', 'binarize', 'denoise']
+SCREENSHOT_STEPS = ['grayscale']
+
+# EXIF-теги производителя и модели камеры
+EXIF_MAKE = 0x010F
+EXIF_MODEL = 0x0110
+
+
+class ImageTooLargeError(ValueError):
+    """Изображение превышает допустимый бюджет пикселей"""
+
+
+def load_image(image_bytes, max_pixels=None):
     """
-    Загружает изображение из байтов
+    Открывает изображение из байтов и проверяет бюджет пикселей
+
+    PIL читает только заголовок файла, поэтому размер проверяется
+    до выделения памяти под пиксели.
 
     Args:
         image_bytes: bytes - содержимое файла изображения
+        max_pixels: int - максимальное число пикселей (по умолчанию MAX_IMAGE_PIXELS)
+
+    Returns:
+        PIL.Image - открытое (ещё не декодированное) изображение
+
+    Raises:
+        ImageTooLargeError: если width * height превышает бюджет
+    """
+    image = Image.open(io.BytesIO(image_bytes))
+
+    if max_pixels is None:
+        max_pixels = MAX_IMAGE_PIXELS
+    width, height = image.size
+    if max_pixels and width * height > max_pixels:
+        raise ImageTooLargeError(
+            f'Image has {width}x{height} pixels, limit is {max_pixels}'
+        )
+
+    return image
+
+
+def decode_image(image, max_side=None):
+    """
+    Декодирует пиксели изображения
+
+    Для JPEG с заданным max_side используется draft-режим: libjpeg сразу
+    декодирует в масштабе 1/2, 1/4 или 1/8, не опускаясь ниже max_side
+    по большей стороне. Для остальных форматов draft ничего не делает.
+
+    Args:
+        image: PIL.Image - открытое изображение (load_image)
+        max_side: int - целевой размер большей стороны (None = полный размер)
 
     Returns:
-        PIL.Image - загруженное изображение
+        PIL.Image - декодированное изображение
     """
-    return Image.open(io.BytesIO(image_bytes))
+    if max_side and image.format == 'JPEG':
+        width, height = image.size
+        scale = max_side / max(width, height)
+        if scale < 1:
+            image.draft(image.mode, (int(width * scale) + 1, int(height * scale) + 1))
+
+    image.load()
+    return image
+
+
+def _has_camera_exif(image):
+    exif = image.getexif()
+    return bool(exif.get(EXIF_MAKE) or exif.get(EXIF_MODEL))
+
+
+def is_screenshot_candidate(image):
+    """
+    Предварительная проверка по заголовку файла (до декодирования пикселей)
+
+    Кандидат - изображение без EXIF камеры, которое либо PNG/WebP/GIF,
+    либо вытянуто как экран телефона, либо совпадает с разрешением экрана.
+    Кандидаты декодируются в полном размере; остальные JPEG можно
+    декодировать в уменьшенном масштабе.
+
+    Args:
+        image: PIL.Image - открытое (ещё не декодированное) изображение
+
+    Returns:
+        bool - True если изображение может быть скриншотом
+    """
+    if _has_camera_exif(image):
+        return False
+    if image.format in ('PNG', 'WEBP', 'GIF'):
+        return True
+    width, height = image.size
+    if (min(width, height), max(width, height)) in DEVICE_RESOLUTIONS:
+        return True
+    return max(width, height) / max(1, min(width, height)) >= SCREENSHOT_MIN_ASPECT
+
+
+def detect_screenshot(image, original_size=None):
+    """
+    Дешёво определяет, является ли изображение скриншотом экрана
+
+    Признаки:
+    - EXIF с производителем/моделью камеры - сразу фото
+    - размер совпадает с разрешением экрана телефона
+    - вытянутость длинного прокручиваемого скриншота (LONG_SCREENSHOT_ASPECT)
+    - нет шума матрицы: большая доля соседних пикселей одинаковой яркости
+    - маленькая палитра (PNG-скриншоты)
+
+    Ограничения по размеру нет: прокручиваемые скриншоты истории бывают
+    1080x9000 и больше.
+
+    Скриншотом считается изображение без шума и хотя бы с одним
+    дополнительным признаком. Анализируется только центральный фрагмент
+    до 512x512, поэтому стоимость не зависит от размера изображения.
+
+    Args:
+        image: PIL.Image - декодированное изображение
+        original_size: tuple - размер из заголовка файла (до draft-декодирования)
+
+    Returns:
+        bool - True если это скриншот
+    """
+    if _has_camera_exif(image):
+        return False
+
+    width, height = original_size or image.size
+    device_resolution = (min(width, height), max(width, height)) in DEVICE_RESOLUTIONS
+    long_screenshot = max(width, height) / max(1, min(width, height)) >= LONG_SCREENSHOT_ASPECT
+
+    # Центральный фрагмент в исходном разрешении (шум не усредняется)
+    crop_w, crop_h = min(image.width, 512), min(image.height, 512)
+    left = (image.width - crop_w) // 2
+    top = (image.height - crop_h) // 2
+    sample = image.crop((left, top, left + crop_w, top + crop_h))
+
+    gray = sample.convert('L')
+    shifted = ImageChops.offset(gray, 1, 0)
+    diff_histogram = ImageChops.difference(gray, shifted).histogram()
+    flat_ratio = diff_histogram[0] / (gray.width * gray.height)
+    if flat_ratio < SCREENSHOT_FLAT_RATIO:
+        return False
+
+    small_palette = sample.convert('RGB').getcolors(maxcolors=SCREENSHOT_MAX_COLORS) is not None
+
+    return device_resolution or long_screenshot or small_palette
+
+
+def grayscale_image(image):
+    """
+    Переводит изображение в оттенки серого (единственный шаг для скриншотов)
+
+    Args:
+        image: PIL.Image
+
+    Returns:
+        PIL.Image - изображение в режиме L
+    """
+    return image.convert('L')
 
 
 def resize_if_needed(image, target_width=1200, target_height=1600):
@@ -44,16 +228,16 @@ def resize_if_needed(image, target_width=1200, target_height=1600):
 
     # Если изображение слишком маленькое (< 800px по меньшей стороне)
     min_side = min(width, height)
-    if min_side < 800:
-        scale = 800 / min_side
+    if min_side < MIN_SIDE:
+        scale = MIN_SIDE / min_side
         new_width = int(width * scale)
         new_height = int(height * scale)
         return image.resize((new_width, new_height), Image.Resampling.LANCZOS)
 
     # Если изображение слишком большое (> 2000px по большей стороне)
     max_side = max(width, height)
-    if max_side > 2000:
-        scale = 2000 / max_side
+    if max_side > MAX_SIDE:
+        scale = MAX_SIDE / max_side
         new_width = int(width * scale)
         new_height = int(height * scale)
         return image.resize((new_width, new_height), Image.Resampling.LANCZOS)
@@ -137,27 +321,54 @@ def preprocess_image(image_bytes, steps=None):
     """
     Полный pipeline обработки изображения
 
+    Если steps не переданы, изображение классифицируется: для скриншотов
+    применяется только grayscale, для фото - полная цепочка. Выбранный путь
+    ('screenshot' или 'photo') первым элементом попадает в steps_applied.
+
     Args:
         image_bytes: bytes - исходное изображение
-        steps: list - список этапов обработки (по умолчанию все)
-                     ['resize', 'deskew', 'sharpen', 'binarize', 'denoise']
+        steps: list - список этапов обработки (по умолчанию - по типу изображения)
+                     ['resize', 'deskew', 'sharpen', 'binarize', 'denoise', 'grayscale']
 
     Returns:
         bytes - обработанное изображение в формате PNG
-        dict - метаданные обработки (размеры, примененные шаги)
+        dict - метаданные обработки (размеры, время декодирования, примененные шаги)
+
+    Raises:
+        ImageTooLargeError: если изображение превышает бюджет пикселей
     """
-    if steps is None:
-        steps = ['resize', 'sharpen', 'binarize', 'denoise']
+    auto_steps = steps is None
+    if auto_steps:
+        steps = PHOTO_STEPS
 
-    # Загружаем изображение
+    # Загружаем изображение (сначала только заголовок, затем пиксели)
+    decode_start = time.perf_counter()
     image = load_image(image_bytes)
     original_size = image.size
+    classify = auto_steps and SCREENSHOT_FAST_PATH
+    candidate = classify and is_screenshot_candidate(image)
+
+    # Большие JPEG-фото сразу декодируем в уменьшенном масштабе;
+    # возможные скриншоты - только в исходном разрешении
+    draft = 'resize' in steps and not candidate
+    image = decode_image(image, max_side=MAX_SIDE if draft else None)
+    decode_ms = round((time.perf_counter() - decode_start) * 1000, 1)
 
     metadata = {
         'original_size': original_size,
+        'decoded_size': image.size,
+        'decode_ms': decode_ms,
         'steps_applied': []
     }
 
+    # Выбираем путь обработки по типу изображения
+    if classify:
+        if candidate and detect_screenshot(image, original_size):
+            steps = SCREENSHOT_STEPS
+            metadata['steps_applied'].append('screenshot')
+        else:
+            metadata['steps_applied'].append('photo')
+
     # Применяем шаги обработки
     if 'resize' in steps:
         image = resize_if_needed(image)
@@ -179,6 +390,10 @@ def preprocess_image(image_bytes, steps=None):
         image = denoise_image(image)
         metadata['steps_applied'].append('denoise')
 
+    if 'grayscale' in steps:
+        image = grayscale_image(image)
+        metadata['steps_applied'].append('grayscale')
+
     metadata['processed_size'] = image.size
 
     # Сохраняем в байты
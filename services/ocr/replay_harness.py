@@ -0,0 +1,412 @@
+"""
+OCR Service: replay-харнесс для классификаторов чеков
+
+Прогоняет classify_and_parse по размеченному корпусу текстов и считает:
+- precision / recall по каждому полю
+- долю срабатываний каждого классификатора
+- пропускную способность (разборов в секунду)
+
+Может сравнить две версии classifiers.py бок о бок. Работает офлайн,
+без БД и Tesseract. Базовая версия запускается в отдельном процессе со своим
+sys.path: classifiers.py импортирует соседние модули (lexer, markers),
+и они должны быть той же версии.
+
+Формат корпуса - JSONL, одна запись на строку:
+    {"id": "...", "text": "текст чека",
+     "expected": {"amount": 150000, "currency": "UZS",
+                  "datetime": "2025-01-15 14:30:00", "card_last4": "1234",
+                  "operator": "...", "is_p2p": false,
+                  "classifier": "UzumBankClassifier"}}
+
+Поля expected необязательны: оцениваются только присутствующие.
+Принимаются и ключи UI-payload из bot_messages.data (merchant, card).
+
+Экспорт корпуса из БД:
+    COPY (SELECT json_build_object('id', id, 'text', text, 'expected', data)
+          FROM bot_messages WHERE status = 'processed') TO STDOUT;
+    COPY (SELECT json_build_object('id', check_id, 'text', raw_text, 'expected',
+                 json_build_object('amount', amount, 'currency', currency,
+                                   'card_last4', card_last4, 'operator', operator,
+                                   'is_p2p', is_p2p,
+                                   'datetime', to_char(datetime, 'YYYY-MM-DD HH24:MI:SS')))
+          FROM checks WHERE raw_text IS NOT NULL) TO STDOUT;
+
+Запуск:
+    python replay_harness.py corpus.jsonl
+    python replay_harness.py corpus.jsonl --baseline-rev HEAD~1
+    python replay_harness.py corpus.jsonl --baseline /path/to/checkout/services/ocr/classifiers.py
+
+--baseline-rev создаёт временный git worktree с указанной ревизией;
+--baseline должен указывать на classifiers.py внутри полной копии сервиса.
+"""
+
+import argparse
+import importlib.util
+import inspect
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Оцениваемые поля и синонимы из bot_messages.data
+FIELDS = ['amount', 'currency', 'datetime', 'card_last4', 'operator', 'is_p2p']
+FIELD_ALIASES = {
+    'merchant': 'operator',
+    'card': 'card_last4',
+}
+
+UNPARSED = '(unparsed)'
+
+# Запуск харнесса в дочернем процессе без директории харнесса в sys.path:
+# sys.path[0] = '' - рабочая директория, т.е. директория оцениваемой версии
+_BOOTSTRAP = "import runpy, sys; sys.argv = sys.argv[1:]; runpy.run_path(sys.argv[0], run_name='__main__')"
+
+
+def load_corpus(path):
+    """
+    Загружает размеченный корпус из JSONL
+
+    Args:
+        path: str - путь к файлу
+
+    Returns:
+        list - записи {id, text, expected}
+    """
+    records = []
+    with open(path, encoding='utf-8') as fp:
+        for line_no, line in enumerate(fp, 1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if not item.get('text'):
+                continue
+            expected = {}
+            for key, value in (item.get('expected') or {}).items():
+                key = FIELD_ALIASES.get(key, key)
+                if value not in (None, ''):
+                    expected[key] = value
+            records.append({
+                'id': str(item.get('id', line_no)),
+                'text': item['text'],
+                'expected': expected,
+            })
+    return records
+
+
+def load_classifiers_module(path):
+    """
+    Загружает версию classifiers.py в текущий процесс
+
+    Соседние модули импортируются из директории файла. Для версий, отличных
+    от текущей, используйте evaluate_isolated: модули, уже импортированные
+    другими модулями процесса, остаются ссылками на текущие.
+
+    Args:
+        path: str - путь к classifiers.py
+
+    Returns:
+        module - загруженный модуль с classify_and_parse
+    """
+    path = os.path.abspath(path)
+    directory = os.path.dirname(path)
+    local_names = {name[:-3] for name in os.listdir(directory) if name.endswith('.py')}
+    stashed = {name: sys.modules.pop(name) for name in local_names if name in sys.modules}
+
+    sys.path.insert(0, directory)
+    try:
+        spec = importlib.util.spec_from_file_location(f'classifiers_{abs(hash(path))}', path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        sys.path.remove(directory)
+        for name in local_names:
+            sys.modules.pop(name, None)
+        sys.modules.update(stashed)
+
+    return module
+
+
+def evaluate_isolated(classifiers_path, corpus_path, repeat=1):
+    """
+    Прогоняет версию classifiers.py в отдельном процессе
+
+    Процесс запускается в директории classifiers_path, поэтому lexer, markers
+    и остальные соседние модули берутся оттуда же, а не из текущего дерева.
+
+    Args:
+        classifiers_path: str - путь к classifiers.py
+        corpus_path: str - корпус JSONL
+        repeat: int - число проходов для замера пропускной способности
+
+    Returns:
+        dict - отчёт evaluate (предсказания сериализованы через JSON)
+    """
+    classifiers_path = os.path.abspath(classifiers_path)
+    env = {key: value for key, value in os.environ.items() if key != 'PYTHONPATH'}
+    with tempfile.TemporaryDirectory(prefix='replay-') as tmp:
+        output = os.path.join(tmp, 'report.json')
+        subprocess.run(
+            [sys.executable, '-c', _BOOTSTRAP, os.path.abspath(__file__),
+             os.path.abspath(corpus_path), '--classifiers', classifiers_path,
+             '--repeat', str(repeat), '--output', output],
+            cwd=os.path.dirname(classifiers_path), env=env, check=True,
+        )
+        with open(output, encoding='utf-8') as fp:
+            return json.load(fp)
+
+
+@contextmanager
+def checkout_revision(rev):
+    """
+    Временный git worktree с ревизией rev
+
+    Yields:
+        str - директория сервиса OCR внутри worktree
+    """
+    root = subprocess.run(['git', 'rev-parse', '--show-toplevel'], cwd=HERE,
+                          capture_output=True, text=True, check=True).stdout.strip()
+    path = tempfile.mkdtemp(prefix='replay-worktree-')
+    subprocess.run(['git', 'worktree', 'add', '--detach', path, rev], cwd=root,
+                   capture_output=True, text=True, check=True)
+    try:
+        yield os.path.join(path, os.path.relpath(HERE, root))
+    finally:
+        subprocess.run(['git', 'worktree', 'remove', '--force', path], cwd=root, capture_output=True)
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _field_matches(field, expected, actual):
+    if field == 'amount':
+        try:
+            return abs(float(expected) - float(actual)) < 0.005
+        except (TypeError, ValueError):
+            return False
+    if field == 'is_p2p':
+        return bool(expected) == bool(actual)
+    return str(expected).strip().lower() == str(actual).strip().lower()
+
+
+def _parse(module, text, kwargs):
+    try:
+        return module.classify_and_parse(text, **kwargs)
+    except ValueError:
+        return None
+
+
+def _uncached_kwargs(module):
+    # Замер пропускной способности - без кэша результатов (если версия его поддерживает)
+    parameters = inspect.signature(module.classify_and_parse).parameters
+    return {'use_cache': False} if 'use_cache' in parameters else {}
+
+
+def evaluate(module, records, repeat=1):
+    """
+    Прогоняет классификаторы по корпусу
+
+    Args:
+        module: module - версия classifiers
+        records: list - корпус (load_corpus)
+        repeat: int - число проходов для замера пропускной способности
+
+    Returns:
+        dict - отчёт: fields, classifiers, classifier_accuracy, throughput, predictions
+    """
+    predictions = {}
+    kwargs = _uncached_kwargs(module)
+    start = time.perf_counter()
+    for _ in range(max(1, repeat)):
+        for record in records:
+            predictions[record['id']] = _parse(module, record['text'], kwargs)
+    elapsed = time.perf_counter() - start
+    parses = len(records) * max(1, repeat)
+
+    counts = {field: Counter() for field in FIELDS}
+    classifier_hits = Counter()
+    classifier_checked = 0
+    classifier_correct = 0
+
+    for record in records:
+        result = predictions[record['id']]
+        data = result['data'] if result else {}
+        classifier_hits[result['classifier'] if result else UNPARSED] += 1
+
+        expected_classifier = record['expected'].get('classifier')
+        if expected_classifier:
+            classifier_checked += 1
+            classifier_correct += int(bool(result) and result['classifier'] == expected_classifier)
+
+        for field in FIELDS:
+            expected = record['expected'].get(field)
+            if expected is None:
+                continue
+            actual = data.get(field)
+            has_actual = actual is not None if field == 'is_p2p' else actual not in (None, '')
+            if has_actual and _field_matches(field, expected, actual):
+                counts[field]['tp'] += 1
+            elif has_actual:
+                counts[field]['fp'] += 1
+                counts[field]['fn'] += 1
+            else:
+                counts[field]['fn'] += 1
+
+    fields = {}
+    for field, c in counts.items():
+        predicted = c['tp'] + c['fp']
+        labeled = c['tp'] + c['fn']
+        fields[field] = {
+            'precision': c['tp'] / predicted if predicted else None,
+            'recall': c['tp'] / labeled if labeled else None,
+            'labeled': labeled,
+        }
+
+    total = len(records) or 1
+    return {
+        'records': len(records),
+        'fields': fields,
+        'classifiers': {name: hits / total for name, hits in classifier_hits.most_common()},
+        'classifier_accuracy': classifier_correct / classifier_checked if classifier_checked else None,
+        'throughput': {
+            'parses': parses,
+            'seconds': elapsed,
+            'parses_per_sec': parses / elapsed if elapsed else None,
+        },
+        'predictions': predictions,
+    }
+
+
+def diff_predictions(baseline, candidate, records):
+    """
+    Записи, для которых две версии дали разный результат
+
+    Returns:
+        list - {id, baseline, candidate} с классификатором и полями
+    """
+    changes = []
+    for record in records:
+        before = baseline['predictions'][record['id']]
+        after = candidate['predictions'][record['id']]
+        summary_before = _summarize(before)
+        summary_after = _summarize(after)
+        if summary_before != summary_after:
+            changes.append({'id': record['id'], 'baseline': summary_before, 'candidate': summary_after})
+    return changes
+
+
+def _summarize(result):
+    if not result:
+        return None
+    summary = {field: result['data'].get(field) for field in FIELDS}
+    summary['classifier'] = result['classifier']
+    # Предсказания из дочернего процесса прошли через JSON - приводим так же
+    return json.loads(json.dumps(summary, ensure_ascii=False, default=str))
+
+
+def _fmt(value, pattern='{:.3f}'):
+    return '-' if value is None else pattern.format(value)
+
+
+def format_report(candidate, baseline=None, changes=None):
+    """
+    Текстовый отчёт; при наличии baseline - колонки «было / стало»
+    """
+    lines = [f"Records: {candidate['records']}", '']
+
+    header = f"{'field':<12} {'precision':>10} {'recall':>10}"
+    if baseline:
+        header += f" {'base prec':>10} {'base rec':>10}"
+    lines.append(header)
+    for field in FIELDS:
+        stats = candidate['fields'][field]
+        row = f"{field:<12} {_fmt(stats['precision']):>10} {_fmt(stats['recall']):>10}"
+        if baseline:
+            base = baseline['fields'][field]
+            row += f" {_fmt(base['precision']):>10} {_fmt(base['recall']):>10}"
+        lines.append(row)
+
+    lines.append('')
+    lines.append('Classifier hit rates:')
+    names = list(candidate['classifiers'])
+    if baseline:
+        names += [name for name in baseline['classifiers'] if name not in names]
+    for name in names:
+        row = f"  {name:<28} {_fmt(candidate['classifiers'].get(name, 0.0)):>8}"
+        if baseline:
+            row += f" (base {_fmt(baseline['classifiers'].get(name, 0.0))})"
+        lines.append(row)
+
+    lines.append('')
+    row = f"Classifier accuracy: {_fmt(candidate['classifier_accuracy'])}"
+    if baseline:
+        row += f" (base {_fmt(baseline['classifier_accuracy'])})"
+    lines.append(row)
+
+    row = f"Throughput: {_fmt(candidate['throughput']['parses_per_sec'], '{:.0f}')} parses/s"
+    if baseline:
+        row += f" (base {_fmt(baseline['throughput']['parses_per_sec'], '{:.0f}')})"
+    lines.append(row)
+
+    if changes is not None:
+        lines.append('')
+        lines.append(f'Changed predictions: {len(changes)}')
+        for change in changes[:20]:
+            lines.append(f"  {change['id']}: {change['baseline']} -> {change['candidate']}")
+
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay classifiers over a labeled receipt corpus')
+    parser.add_argument('corpus', help='JSONL corpus')
+    parser.add_argument('--classifiers', default=os.path.join(HERE, 'classifiers.py'),
+                        help='classifiers.py to evaluate (default: current)')
+    parser.add_argument('--baseline', help='classifiers.py (inside a full service copy) to compare against')
+    parser.add_argument('--baseline-rev', help='git revision to compare against (checked out to a worktree)')
+    parser.add_argument('--repeat', type=int, default=3, help='passes over the corpus for throughput')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    parser.add_argument('--output', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    records = load_corpus(args.corpus)
+    classifiers_path = os.path.abspath(args.classifiers)
+    if args.output or os.path.dirname(classifiers_path) == HERE:
+        candidate = evaluate(load_classifiers_module(classifiers_path), records, args.repeat)
+    else:
+        candidate = evaluate_isolated(classifiers_path, args.corpus, args.repeat)
+
+    if args.output:
+        # Дочерний процесс evaluate_isolated: полный отчёт в файл
+        with open(args.output, 'w', encoding='utf-8') as fp:
+            json.dump(candidate, fp, ensure_ascii=False, default=str)
+        return
+
+    baseline = None
+    changes = None
+    if args.baseline_rev:
+        with checkout_revision(args.baseline_rev) as directory:
+            baseline = evaluate_isolated(os.path.join(directory, 'classifiers.py'), args.corpus, args.repeat)
+    elif args.baseline:
+        baseline = evaluate_isolated(args.baseline, args.corpus, args.repeat)
+    if baseline:
+        changes = diff_predictions(baseline, candidate, records)
+
+    if args.json:
+        report = {key: value for key, value in candidate.items() if key != 'predictions'}
+        if baseline:
+            report['baseline'] = {key: value for key, value in baseline.items() if key != 'predictions'}
+            report['changes'] = changes
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print(format_report(candidate, baseline, changes))
+
+
+if __name__ == '__main__':
+    main()
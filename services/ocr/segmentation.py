@@ -0,0 +1,270 @@
+"""
+OCR Service: разбиение длинных скриншотов на отдельные чеки
+
+Пользователи присылают длинные скриншоты истории операций: на одном
+изображении десятки транзакций. Изображение режется на области по
+горизонтальным промежуткам без текста:
+1. Профиль строк: строка пикселей «пустая», если она однотонная
+   (фон карточки или разделитель любого цвета)
+2. Высота строки текста - медиана высот непустых полос, межстрочный
+   интервал - медиана промежутков; промежутки выше GAP_LINE_FACTOR строк
+   текста и GAP_SPACING_FACTOR межстрочных интервалов - границы областей
+3. Если профиль дал несколько областей, один проход Tesseract по
+   геометрии (ocr_engine.extract_lines) отбрасывает разрезы, проходящие
+   через строку текста
+
+Режется изображение в исходном разрешении. Если предобработка уменьшила
+фото, режется оригинал - с бюджетом пикселей SEGMENT_MAX_PIXELS и в
+grayscale; геометрия строк при этом берётся с обработанного изображения
+и масштабируется на оригинал.
+
+Области распознаются параллельно и разбираются по отдельности.
+Заголовки и «хвосты» карточек, которые не разобрались сами по себе,
+склеиваются с соседними областями (до SEGMENT_MAX_MERGE подряд).
+"""
+
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from statistics import median
+
+from PIL import Image
+
+from ocr_engine import extract_text
+from preprocessing import load_image, decode_image, grayscale_image, ImageTooLargeError
+from templates import parse_message
+
+
+# Минимальное отношение высоты к ширине, при котором изображение режется на области
+SEGMENT_MIN_ASPECT = float(os.getenv('OCR_SEGMENT_MIN_ASPECT', 2.5))
+
+# Промежуток-граница: не ниже MIN_GAP_PX пикселей, GAP_LINE_FACTOR высот строки текста
+# и GAP_SPACING_FACTOR межстрочных интервалов
+GAP_LINE_FACTOR = 1.5
+GAP_SPACING_FACTOR = 2.0
+MIN_GAP_PX = 8
+
+# Допустимый разброс яркости в «пустой» строке пикселей
+ROW_UNIFORM_TOLERANCE = 12
+
+# Ширина, до которой сжимается изображение для профиля строк (высота сохраняется)
+PROFILE_WIDTH = 256
+
+# Сколько соседних областей можно склеить в один чек
+SEGMENT_MAX_MERGE = 3
+
+# Бюджет пикселей оригинала, который режется вместо уменьшенного фото
+SEGMENT_MAX_PIXELS = int(os.getenv('OCR_SEGMENT_MAX_PIXELS', 30_000_000))
+
+# Лимит областей на одно изображение
+SEGMENT_MAX_REGIONS = int(os.getenv('OCR_SEGMENT_MAX_REGIONS', 100))
+
+# Пул потоков для распознавания областей (Tesseract работает в отдельных процессах)
+_segment_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('OCR_SEGMENT_WORKERS', 4)),
+    thread_name_prefix='ocr-segment'
+)
+
+
+def is_long_image(image):
+    """Изображение достаточно вытянуто по вертикали, чтобы резать его на области"""
+    width, height = image.size
+    return width > 0 and height / width >= SEGMENT_MIN_ASPECT
+
+
+def segment_source(image_bytes, processed_bytes, metadata=None):
+    """
+    Изображение, которое режется на области, и масштаб координат обработанного изображения к нему
+
+    Args:
+        image_bytes: bytes - исходное изображение
+        processed_bytes: bytes - изображение после предобработки
+        metadata: dict - метаданные preprocess_image (None - предобработки не было)
+
+    Returns:
+        tuple - (PIL.Image или None, если изображение не длинное; scale: float)
+    """
+    processed = Image.open(io.BytesIO(processed_bytes))
+    downscaled = (metadata is not None and
+                  tuple(metadata['processed_size']) != tuple(metadata['original_size']))
+    if downscaled:
+        try:
+            original = load_image(image_bytes, max_pixels=SEGMENT_MAX_PIXELS)
+        except ImageTooLargeError:
+            # Оригинал слишком велик - режем обработанное изображение
+            original = None
+        if original is not None and is_long_image(original):
+            scale = original.size[0] / processed.size[0]
+            return grayscale_image(decode_image(original)), scale
+
+    if not is_long_image(processed):
+        return None, 1.0
+    processed.load()
+    return processed, 1.0
+
+
+def _row_profile(image):
+    """Список флагов «строка пикселей содержит текст/графику»"""
+    gray = image.convert('L')
+    width, height = gray.size
+    if width > PROFILE_WIDTH:
+        gray = gray.resize((PROFILE_WIDTH, height), Image.BOX)
+        width = PROFILE_WIDTH
+
+    raw = gray.tobytes()
+    profile = []
+    for top in range(0, len(raw), width):
+        row = raw[top:top + width]
+        profile.append(max(row) - min(row) > ROW_UNIFORM_TOLERANCE)
+    return profile
+
+
+def _runs(profile, value):
+    """Полосы подряд идущих строк со значением value: список (начало, конец)"""
+    runs = []
+    start = None
+    for index, flag in enumerate(profile):
+        if flag == value and start is None:
+            start = index
+        elif flag != value and start is not None:
+            runs.append((start, index))
+            start = None
+    if start is not None:
+        runs.append((start, len(profile)))
+    return runs
+
+
+def _line_boxes(lines):
+    boxes = []
+    for line in lines or []:
+        words = line.get('words') or []
+        if words:
+            top = min(word['top'] for word in words)
+            bottom = max(word['top'] + word['height'] for word in words)
+            boxes.append((top, bottom))
+    return boxes
+
+
+def find_regions(image, lines=None):
+    """
+    Находит области отдельных транзакций на длинном изображении
+
+    Args:
+        image: PIL.Image - изображение (после предобработки)
+        lines: list - строки extract_text с координатами слов (optional)
+
+    Returns:
+        list - области (top, bottom) сверху вниз; одна область, если разрезать нечего
+    """
+    height = image.size[1]
+    profile = _row_profile(image)
+    ink = _runs(profile, True)
+    if not ink:
+        return [(0, height)]
+
+    gaps = [(top, bottom) for top, bottom in _runs(profile, False) if top > 0 and bottom < height]
+    if not gaps:
+        return [(0, height)]
+
+    line_height = median(bottom - top for top, bottom in ink)
+    spacing = median(bottom - top for top, bottom in gaps)
+    min_gap = max(MIN_GAP_PX, GAP_LINE_FACTOR * line_height, GAP_SPACING_FACTOR * spacing)
+    boxes = _line_boxes(lines)
+
+    cuts = []
+    for top, bottom in gaps:
+        if bottom - top < min_gap:
+            continue
+        cut = (top + bottom) // 2
+        if any(box_top < cut < box_bottom for box_top, box_bottom in boxes):
+            continue
+        cuts.append(cut)
+
+    padding = int(line_height // 2)
+    regions = []
+    edges = [0] + cuts + [height]
+    for start, end in zip(edges, edges[1:]):
+        content = [(top, bottom) for top, bottom in ink if top >= start and bottom <= end]
+        if content:
+            regions.append((max(0, content[0][0] - padding), min(height, content[-1][1] + padding)))
+
+    if len(regions) > SEGMENT_MAX_REGIONS:
+        return [(0, height)]
+    return regions or [(0, height)]
+
+
+def _ocr_region(image, region, lang):
+    crop = image.crop((0, region[0], image.size[0], region[1]))
+    output = io.BytesIO()
+    crop.save(output, format='PNG')
+    return extract_text(output.getvalue(), lang=lang)
+
+
+def _try_parse(text):
+    try:
+        return parse_message(text)
+    except ValueError:
+        return None
+
+
+def segment_receipts(image, lang='rus+eng', lines=None, get_lines=None):
+    """
+    Разбивает длинный скриншот на области, распознаёт и разбирает их параллельно
+
+    Args:
+        image: PIL.Image - изображение в исходном разрешении (segment_source)
+        lang: str - языки Tesseract
+        lines: list - строки extract_text того же изображения (optional):
+            разрезы через строки текста отбрасываются
+        get_lines: callable - возвращает такие строки; вызывается, только если
+            профиль нашёл несколько областей (optional)
+
+    Returns:
+        dict или None (изображение не длинное или в нём одна область):
+            - regions: int - число найденных областей
+            - receipts: list - {region: [top, bottom], text, ocr_confidence, parsed_data}
+            - unparsed: list - {region: [top, bottom], text} для областей без чека
+    """
+    if not is_long_image(image):
+        return None
+    regions = find_regions(image, lines)
+    if len(regions) < 2:
+        return None
+    if lines is None and get_lines is not None:
+        regions = find_regions(image, get_lines())
+        if len(regions) < 2:
+            return None
+
+    futures = [_segment_executor.submit(_ocr_region, image, region, lang) for region in regions]
+    results = [future.result() for future in futures]
+
+    receipts = []
+    unparsed = []
+    index = 0
+    while index < len(regions):
+        # Склеиваем область с соседними, пока чек не разберётся
+        parsed = None
+        for count in range(1, min(SEGMENT_MAX_MERGE, len(regions) - index) + 1):
+            chunk = results[index:index + count]
+            text = '\n'.join(result['text'] for result in chunk if result['text'])
+            parsed = _try_parse(text) if text else None
+            if parsed:
+                break
+
+        if parsed:
+            receipts.append({
+                'region': [regions[index][0], regions[index + count - 1][1]],
+                'text': text,
+                'ocr_confidence': sum(result['confidence'] for result in chunk) / len(chunk),
+                'parsed_data': parsed
+            })
+            index += count
+        else:
+            unparsed.append({'region': list(regions[index]), 'text': results[index]['text']})
+            index += 1
+
+    return {
+        'regions': len(regions),
+        'receipts': receipts,
+        'unparsed': unparsed
+    }
@@ -0,0 +1,434 @@
+"""
+OCR Service: шаблоны сообщений банковских ботов
+
+Сообщения @CardXabarBot, @NBUCard_bot и т.п. следуют нескольким фиксированным
+шаблонам, отличающимся только числами и названиями продавцов. Для каждого
+сообщения строится «форма»: токены лексера (суммы, даты, время, карты, валюты)
+и слова вне словаря заменяются слотами, а в конец добавляется сигнатура
+маркеров текста (банк, P2P). Форма - ключ словаря шаблонов. Маркеры ищутся
+по фрагментам текста между токенами, а не по каждому слову, поэтому продавец
+со словом-маркером («UPAY P2P, UZ») остаётся одним слотом, а сообщения с
+маркером и без него получают разные формы. Фрагменты (заголовки, метки полей,
+имена продавцов) повторяются, поэтому их разбор кэшируется.
+
+Для новой формы результат classify_and_parse разбирается по слотам и
+компилируется в позиционный экстрактор: поле -> номер слота. Дальше сообщения
+той же формы разбираются поиском в словаре и выборкой значений из слотов,
+без каскада классификаторов. Первые TEMPLATE_VERIFY_SAMPLES срабатываний
+шаблона сверяются с classify_and_parse без кэша (кэш сворачивает пробелы, его
+результат может быть построен по другому тексту); при расхождении шаблон
+отключается.
+
+Неизвестные формы и отключённые шаблоны разбираются classify_and_parse.
+Реестр ограничен TEMPLATE_MAX формами и вытесняет давно не встречавшиеся (LRU):
+одноразовые формы зашумлённого OCR-текста не занимают место шаблонов ботов.
+"""
+
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+from datetime import datetime
+
+from lexer import tokenize, AMOUNT, DATE, TIME, CARD
+from classifiers import classify_and_parse, registry_version, marker_labels
+from operators import apply_operator
+
+
+TEXT = 'TEXT'
+
+# Максимум шаблонов в памяти (сверх лимита вытесняются давно не встречавшиеся)
+TEMPLATE_MAX = int(os.getenv('OCR_TEMPLATE_MAX', '512'))
+
+# Размер кэша разбора фрагментов текста между токенами
+SEGMENT_CACHE_SIZE = int(os.getenv('OCR_TEMPLATE_SEGMENT_CACHE', '65536'))
+
+# Сколько срабатываний шаблона сверяется с classify_and_parse
+TEMPLATE_VERIFY_SAMPLES = int(os.getenv('OCR_TEMPLATE_VERIFY_SAMPLES', '3'))
+
+# Постоянные слова шаблонов: метки полей и типы операций (ru/uz/en, транслит SMS)
+VOCABULARY = {
+    'оплата', 'покупка', 'пополнение', 'списание', 'перевод', 'платеж', 'платёж',
+    'сумма', 'карта', 'карты', 'баланс', 'остаток', 'доступно', 'дата', 'время',
+    'продавец', 'получатель', 'отправитель', 'комиссия', 'операция', 'успешно',
+    'завершена', 'отмена', 'возврат', 'снятие', 'наличных',
+    "to'lov", 'tolov', "o'tkazma", 'otkazma', 'hisob', 'karta', 'summa', 'sana',
+    'merchant', 'amount', 'card', 'balance', 'date', 'time', 'payment', 'purchase',
+    'debit', 'credit', 'fee', 'status', 'from', 'to',
+    'spisanie', 'popolnenie', 'ot', 'na', 'dostupno',
+    'bank', 'банк', 'humo', 'humocard', 'uzcard', 'visa', 'mastercard', 'unionpay',
+}
+VOCABULARY.update(
+    word.strip().lower()
+    for word in os.getenv('OCR_TEMPLATE_VOCABULARY', '').split(',')
+    if word.strip()
+)
+
+_WORD_RE = re.compile(r"[\w'ʻ‘’]+")
+_SPACES_RE = re.compile(r'[^\S\n]+')
+
+# Символы, которые могут стоять между словами одного названия («ООО "Bek & Co"»)
+_RUN_JOINERS = set('  .,&-"\'«»')
+# Символы, которые остаются в конце названия («IVAN I.»)
+_RUN_TAIL = set('."\'»')
+
+
+class Template:
+    """
+    Скомпилированный позиционный экстрактор для одной формы сообщения
+    """
+
+    __slots__ = ('shape', 'classifier', 'constants', 'fields', 'datetime_slots',
+                 'currency_slot', 'verified', 'disabled', 'hits', 'sample')
+
+    def __init__(self, shape, classifier, constants, fields, datetime_slots, currency_slot, sample):
+        self.shape = shape
+        self.classifier = classifier
+        self.constants = constants
+        self.fields = fields
+        self.datetime_slots = datetime_slots
+        self.currency_slot = currency_slot
+        self.verified = 0
+        self.disabled = False
+        self.hits = 0
+        self.sample = sample
+
+    def extract(self, slots):
+        """
+        Собирает результат в формате classify_and_parse из значений слотов
+        """
+        data = dict(self.constants)
+        for field, index in self.fields.items():
+            data[field] = slots[index][1]
+        if self.currency_slot is not None:
+            data['currency'] = slots[self.currency_slot][2]
+        if self.datetime_slots:
+            date_index, time_index = self.datetime_slots
+            value = datetime.combine(slots[date_index][1], slots[time_index][1])
+            data['datetime'] = value.strftime("%Y-%m-%d %H:%M:%S")
+        return {
+            'classifier': self.classifier,
+            'data': data,
+            'confidence': data['confidence']
+        }
+
+
+def _mask_segment(segment):
+    """
+    Часть формы для текста между токенами: слова вне словаря заменяются слотами TEXT
+
+    Подряд идущие переменные слова одной строки образуют один слот.
+
+    Returns:
+        tuple - (часть формы: str, значения слотов TEXT: tuple)
+    """
+    parts = []
+    values = []
+    position = 0
+    run_start = run_end = None
+
+    def close_run():
+        nonlocal position
+        end = run_end
+        while end < len(segment) and segment[end] in _RUN_TAIL:
+            end += 1
+        parts.append(_SPACES_RE.sub(' ', segment[position:run_start]))
+        parts.append('{TEXT}')
+        values.append(segment[run_start:end].strip())
+        position = end
+
+    for match in _WORD_RE.finditer(segment):
+        if match.group().lower() in VOCABULARY:
+            if run_start is not None:
+                close_run()
+                run_start = None
+            continue
+        if run_start is not None and set(segment[run_end:match.start()]) <= _RUN_JOINERS:
+            run_end = match.end()
+            continue
+        if run_start is not None:
+            close_run()
+        run_start, run_end = match.start(), match.end()
+
+    if run_start is not None:
+        close_run()
+    parts.append(_SPACES_RE.sub(' ', segment[position:]))
+    return ''.join(parts), tuple(values)
+
+
+_segment_cache = {}
+_segment_version = None
+
+
+def _segment(segment):
+    """_mask_segment и маркеры фрагмента (с кэшем по тексту фрагмента)"""
+    global _segment_version
+    version = registry_version()
+    if version != _segment_version or len(_segment_cache) >= SEGMENT_CACHE_SIZE:
+        # Маркеры зависят от реестра классификаторов
+        _segment_cache.clear()
+        _segment_version = version
+    cached = _segment_cache.get(segment)
+    if cached is None:
+        cached = _mask_segment(segment) + (marker_labels(segment),)
+        _segment_cache[segment] = cached
+    return cached
+
+
+def fingerprint(text, tokens=None):
+    """
+    Форма сообщения и значения её слотов
+
+    Args:
+        text: str - текст сообщения
+        tokens: list - токены lexer.tokenize(text) (если None - строятся заново)
+
+    Returns:
+        tuple - (shape: str, slots: list of (kind, value, currency));
+        shape заканчивается метками маркеров (classifiers.marker_labels)
+    """
+    if tokens is None:
+        tokens = tokenize(text)
+
+    parts = []
+    slots = []
+    labels = set()
+    position = 0
+    for index in range(len(tokens) + 1):
+        token = tokens[index] if index < len(tokens) else None
+        shape, values, segment_labels = _segment(text[position:token.start if token else len(text)])
+        parts.append(shape)
+        slots.extend((TEXT, value, None) for value in values)
+        labels |= segment_labels
+        if token is not None:
+            parts.append('{' + token.kind + '}')
+            slots.append((token.kind, token.value, token.currency))
+            position = token.end
+
+    shape = '\n'.join(line.strip() for line in ''.join(parts).split('\n'))
+    return shape.strip() + '\n#' + ','.join(sorted(labels)), slots
+
+
+def _find_slot(slots, kind, value, currency=None, skip=()):
+    for index, (slot_kind, slot_value, slot_currency) in enumerate(slots):
+        if index in skip:
+            continue
+        if slot_kind == kind and slot_value == value and (currency is None or slot_currency == currency):
+            return index
+    return None
+
+
+def _find_datetime_slots(slots, value):
+    for index in range(len(slots) - 1):
+        pair = (slots[index], slots[index + 1])
+        kinds = (pair[0][0], pair[1][0])
+        if kinds == (DATE, TIME):
+            date_index, time_index = index, index + 1
+        elif kinds == (TIME, DATE):
+            date_index, time_index = index + 1, index
+        else:
+            continue
+        combined = datetime.combine(slots[date_index][1], slots[time_index][1])
+        if combined.strftime("%Y-%m-%d %H:%M:%S") == value:
+            return date_index, time_index
+    return None
+
+
+def compile_template(shape, slots, result, sample=None):
+    """
+    Компилирует экстрактор по результату classify_and_parse для сообщения данной формы
+
+    Каждое непустое поле (amount, currency, datetime, card_last4, operator,
+    balance) должно однозначно браться из слота; остальные поля считаются
+    постоянными для формы.
+
+    Returns:
+        Template или None, если поля не удалось сопоставить слотам
+        (или в сообщении несколько операций)
+    """
+    data = result['data']
+    if data.get('operations'):
+        return None
+    constants = dict(data)
+    fields = {}
+    datetime_slots = None
+    currency_slot = None
+
+    if data.get('amount') is not None:
+        index = _find_slot(slots, AMOUNT, data['amount'])
+        if index is None:
+            return None
+        fields['amount'] = index
+        if slots[index][2] and slots[index][2] == data.get('currency'):
+            currency_slot = index
+
+    if data.get('balance') is not None:
+        index = _find_slot(slots, AMOUNT, data['balance'], skip=set(fields.values()))
+        if index is None:
+            return None
+        fields['balance'] = index
+
+    if data.get('card_last4') is not None:
+        index = _find_slot(slots, CARD, data['card_last4'])
+        if index is None:
+            return None
+        fields['card_last4'] = index
+
+    if data.get('operator') is not None:
+        index = _find_slot(slots, TEXT, data['operator'])
+        if index is None:
+            return None
+        fields['operator'] = index
+
+    if data.get('datetime') is not None:
+        datetime_slots = _find_datetime_slots(slots, data['datetime'])
+        if datetime_slots is None:
+            return None
+
+    for field in fields:
+        constants.pop(field)
+    if currency_slot is not None:
+        constants.pop('currency', None)
+    if datetime_slots:
+        constants.pop('datetime', None)
+
+    return Template(shape, result['classifier'], constants, fields, datetime_slots, currency_slot, sample)
+
+
+class TemplateRegistry:
+    """
+    Словарь шаблонов: форма сообщения -> Template
+    """
+
+    def __init__(self, max_templates=TEMPLATE_MAX, verify_samples=TEMPLATE_VERIFY_SAMPLES):
+        self.max_templates = max_templates
+        self.verify_samples = verify_samples
+        self._templates = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = registry_version()
+        self._stats = Counter()
+
+    def _check_version(self):
+        # Классификаторы перезагружены - шаблоны построены по старым правилам
+        version = registry_version()
+        if version != self._version:
+            with self._lock:
+                self._templates.clear()
+                self._version = version
+
+    def parse(self, text):
+        """
+        Разбирает сообщение шаблоном, а для неизвестной формы - classify_and_parse
+
+        Args:
+            text: str - текст сообщения
+
+        Returns:
+            dict - результат в формате classify_and_parse
+
+        Raises:
+            ValueError: если формат сообщения не распознан
+        """
+        self._check_version()
+        shape, slots = fingerprint(text)
+        template = self._templates.get(shape)
+
+        if template is not None:
+            with self._lock:
+                if shape in self._templates:
+                    self._templates.move_to_end(shape)
+
+        if template is not None and not template.disabled:
+            result = template.extract(slots)
+            if template.verified >= self.verify_samples:
+                with self._lock:
+                    template.hits += 1
+                    self._stats['template_hits'] += 1
+                return result
+            return self._verify(template, text, result)
+
+        with self._lock:
+            self._stats['fallbacks'] += 1
+        if template is None:
+            # Шаблон компилируется по разбору именно этого текста
+            result = classify_and_parse(text, use_cache=False)
+            self._learn(shape, slots, result, text)
+            return result
+        return classify_and_parse(text)
+
+    def _verify(self, template, text, result):
+        expected = classify_and_parse(text, use_cache=False)
+        with self._lock:
+            if result == expected:
+                template.verified += 1
+                template.hits += 1
+                self._stats['template_hits'] += 1
+            else:
+                template.disabled = True
+                self._stats['disabled'] += 1
+                self._stats['fallbacks'] += 1
+        return expected
+
+    def _learn(self, shape, slots, result, text):
+        template = compile_template(shape, slots, result, sample=text)
+        with self._lock:
+            if shape in self._templates or self.max_templates <= 0:
+                return
+            while len(self._templates) >= self.max_templates:
+                self._templates.popitem(last=False)
+                self._stats['evicted'] += 1
+            if template is None:
+                # Форму запоминаем, чтобы не пытаться компилировать её повторно
+                template = Template(shape, result['classifier'], {}, {}, None, None, text)
+                template.disabled = True
+                self._stats['uncompilable'] += 1
+            else:
+                template.verified = 1
+                self._stats['learned'] += 1
+            self._templates[shape] = template
+
+    def coverage(self):
+        """
+        Покрытие шаблонами
+
+        Returns:
+            dict - templates, active, disabled, evicted, template_hits, fallbacks,
+                   coverage (доля разборов шаблоном), items (по шаблонам)
+        """
+        with self._lock:
+            templates = list(self._templates.values())
+            stats = dict(self._stats)
+        parses = stats.get('template_hits', 0) + stats.get('fallbacks', 0)
+        return {
+            'templates': len(templates),
+            'active': sum(1 for t in templates if not t.disabled),
+            'disabled': sum(1 for t in templates if t.disabled),
+            'learned': stats.get('learned', 0),
+            'uncompilable': stats.get('uncompilable', 0),
+            'evicted': stats.get('evicted', 0),
+            'template_hits': stats.get('template_hits', 0),
+            'fallbacks': stats.get('fallbacks', 0),
+            'coverage': round(stats.get('template_hits', 0) / parses, 4) if parses else None,
+            'items': [
+                {
+                    'shape': t.shape,
+                    'classifier': t.classifier,
+                    'hits': t.hits,
+                    'verified': t.verified >= self.verify_samples,
+                    'disabled': t.disabled,
+                }
+                for t in sorted(templates, key=lambda t: t.hits, reverse=True)
+            ],
+        }
+
+
+# Общий реестр сервиса
+template_registry = TemplateRegistry()
+
+
+def parse_message(text):
+    """
+    Разбор сообщения через общий реестр шаблонов (см. TemplateRegistry.parse);
+    app_name и is_p2p уточняются по справочнику операторов
+    """
+    return apply_operator(template_registry.parse(text))
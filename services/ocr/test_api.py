@@ -0,0 +1,109 @@
+import base64
+import io
+import unittest
+from unittest import mock
+
+from PIL import Image, ImageDraw
+
+import app as ocr_app
+import segmentation
+
+
+CARDXABAR = (
+    '💸 Оплата\n➖ 50 000.00 UZS\n📍 KORZINKA\n💳 HUMOCARD *6543\n'
+    '🕓 14:30 15.01.2025\n💰 1 000 000.00 UZS'
+)
+
+
+class ParseTextTest(unittest.TestCase):
+    def setUp(self):
+        self.client = ocr_app.app.test_client()
+
+    def test_bot_message_goes_through_template_registry(self):
+        before = ocr_app.template_registry.coverage()
+        response = self.client.post('/ocr/parse-text', json={'text': CARDXABAR})
+        after = ocr_app.template_registry.coverage()
+
+        self.assertEqual(response.status_code, 200)
+        parsed = response.get_json()['parsed_data']
+        self.assertEqual(parsed['classifier'], 'CardXabarClassifier')
+        self.assertEqual(parsed['data']['amount'], 50000.0)
+        self.assertEqual(
+            after['template_hits'] + after['fallbacks'],
+            before['template_hits'] + before['fallbacks'] + 1
+        )
+
+    def test_unknown_format(self):
+        response = self.client.post('/ocr/parse-text', json={'text': 'hello'})
+        self.assertEqual(response.status_code, 422)
+        self.assertFalse(response.get_json()['success'])
+
+    def test_missing_text(self):
+        self.assertEqual(self.client.post('/ocr/parse-text', json={}).status_code, 400)
+
+
+def _history_png(blocks=4, lines_per_block=4, width=200):
+    height = blocks * (lines_per_block * 30 + 80) + 40
+    image = Image.new('L', (width, height), 245)
+    draw = ImageDraw.Draw(image)
+    top = 40
+    for _ in range(blocks):
+        for _ in range(lines_per_block):
+            draw.text((10, top), 'Payment 150 000 UZS', fill=20)
+            top += 30
+        top += 80
+    output = io.BytesIO()
+    image.save(output, format='PNG')
+    return output.getvalue()
+
+
+class SegmentedProcessTest(unittest.TestCase):
+    RECEIPT = 'Оплата\n{amount} UZS\nКарта *1234\n15.01.2025 14:30'
+
+    def setUp(self):
+        self.client = ocr_app.app.test_client()
+
+    def process(self, image_bytes, lines):
+        counter = iter(range(10, 100, 10))
+
+        def fake_region_ocr(image, region, lang):
+            return {'text': self.RECEIPT.format(amount=f'{next(counter)} 000'), 'confidence': 90.0, 'lines': []}
+
+        spy = mock.Mock(wraps=segmentation.segment_receipts)
+        with mock.patch.object(ocr_app, 'extract_text') as whole_ocr, \
+                mock.patch.object(ocr_app, 'extract_lines', return_value=lines) as self.extract_lines, \
+                mock.patch.object(ocr_app, 'segment_receipts', spy), \
+                mock.patch.object(segmentation, '_ocr_region', fake_region_ocr):
+            response = self.client.post('/ocr/process', json={
+                'image': base64.b64encode(image_bytes).decode(),
+                'segment': True,
+                'multi_psm': False,
+            })
+        # Целиком изображение не распознаётся - только области
+        whole_ocr.assert_not_called()
+        return response, spy
+
+    def test_screenshot_is_segmented_at_full_resolution_with_line_geometry(self):
+        image_bytes = _history_png()
+        lines = [{'text': 'Payment', 'words': [{'top': 40, 'height': 12}]}]
+        response, spy = self.process(image_bytes, lines)
+
+        self.assertEqual(response.status_code, 200)
+        body = response.get_json()
+        self.assertEqual(body['status'], 'segmented')
+        self.assertEqual(len(body['receipts']), 4)
+
+        self.assertEqual(spy.call_args.args[0].size, (200, 840))
+        # Геометрия строк - один проход по тому же (не уменьшенному) изображению
+        self.extract_lines.assert_called_once()
+        self.assertEqual(self.extract_lines.call_args.kwargs['scale'], 1.0)
+
+    def test_line_crossing_a_gap_prevents_the_cut(self):
+        # Строка Tesseract через промежуток между первой и второй карточкой
+        lines = [{'text': 'tall', 'words': [{'top': 150, 'height': 60}]}]
+        response, _ = self.process(_history_png(), lines)
+        self.assertEqual(response.get_json()['regions'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
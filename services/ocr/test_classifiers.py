@@ -0,0 +1,117 @@
+import unittest
+
+import classifiers
+from classifiers import classify_and_parse
+
+
+class ClassifyAndParseTest(unittest.TestCase):
+    def test_uzum_receipt(self):
+        text = (
+            'UZUM Bank\nТранзакция успешно завершена\nПродавец: KORZINKA\n'
+            'Сумма: 150 000 UZS\nДата: 15.01.2025 14:30\nКарта: *1234'
+        )
+        result = classify_and_parse(text)
+        self.assertEqual(result['classifier'], 'UzumBankClassifier')
+        self.assertEqual(result['data']['amount'], 150000.0)
+        self.assertEqual(result['data']['datetime'], '2025-01-15 14:30:00')
+        self.assertEqual(result['data']['card_last4'], '1234')
+        self.assertEqual(result['data']['operator'], 'KORZINKA')
+
+    def test_cardxabar_notification(self):
+        text = (
+            '💸 Оплата\n➖ 50 000.00 UZS\n📍 MERCHANT\n💳 HUMOCARD *6543\n'
+            '🕓 14:30 15.01.2025\n💰 1 000 000.00 UZS'
+        )
+        result = classify_and_parse(text)
+        self.assertEqual(result['classifier'], 'CardXabarClassifier')
+        self.assertEqual(result['data']['amount'], 50000.0)
+        self.assertEqual(result['data']['balance'], 1000000.0)
+        self.assertEqual(result['data']['card_last4'], '6543')
+        self.assertEqual(result['data']['datetime'], '2025-01-15 14:30:00')
+        self.assertEqual(result['data']['transaction_type'], 'Оплата')
+        self.assertFalse(result['data']['is_income'])
+
+    def test_cardxabar_income_with_uzum_merchant(self):
+        text = (
+            '🎉 Пополнение\n➕ 7 500.00 UZS\n📍 UZUM MARKET\n💳 HUMOCARD *6543\n'
+            '🕓 14:30 15.01.2025\n💰 1 007 500.00 UZS'
+        )
+        result = classify_and_parse(text)
+        self.assertEqual(result['classifier'], 'CardXabarClassifier')
+        self.assertEqual(result['data']['operator'], 'UZUM MARKET')
+        self.assertTrue(result['data']['is_income'])
+
+    def test_cardxabar_unknown_header_is_not_parsed_as_notification(self):
+        text = '🛑 Отказ\n➖ 50 000.00 UZS\n💳 HUMOCARD *6543\n🕓 14:30 15.01.2025'
+        self.assertNotEqual(classify_and_parse(text)['classifier'], 'CardXabarClassifier')
+
+    def test_uzum_sms_operations(self):
+        text = (
+            'Spisanie, karta ***1234: 25000.00 UZS, UZUM MARKET. Dostupno: 100500.00 UZS\n'
+            'Popolnenie ot IVAN I. na 300000.00 UZS, karta ***1234. Dostupno: 400500.00 UZS'
+        )
+        result = classify_and_parse(text)
+        self.assertEqual(result['classifier'], 'UzumSmsClassifier')
+        debit, credit = result['data']['operations']
+        self.assertEqual((debit['amount'], debit['operator'], debit['is_income']), (25000.0, 'UZUM MARKET', False))
+        self.assertEqual((credit['amount'], credit['operator'], credit['is_income']), (300000.0, 'IVAN I', True))
+        self.assertEqual(result['data']['balance'], 100500.0)
+
+    def test_uzum_sms_otp_is_not_parsed(self):
+        with self.assertRaises(ValueError):
+            classify_and_parse('<#> Uzum bank Podtverdite operaciyu kodom 123456. Dostupno spisanie')
+
+
+class ParseCacheTest(unittest.TestCase):
+    TEXT = 'UZUM Bank\nСумма: 150 000 UZS\nДата: 15.01.2025 14:30\nКарта: *1234'
+
+    def setUp(self):
+        classifiers.reload_classifiers()
+
+    def test_normalized_text_hits_cache(self):
+        classify_and_parse(self.TEXT)
+        before = classifiers.cache_stats()
+        classify_and_parse('  UZUM   Bank\nСумма:  150 000 UZS \nДата: 15.01.2025 14:30\nКарта: *1234')
+        after = classifiers.cache_stats()
+        self.assertEqual(after['hits'], before['hits'] + 1)
+
+    def test_casing_is_not_folded(self):
+        text = '💸 Оплата\n➖ 50 000.00 UZS\n📍 {}\n💳 HUMOCARD *6543\n🕓 14:30 15.01.2025'
+        classify_and_parse(text.format('Korzinka Chilonzor'))
+        result = classify_and_parse(text.format('KORZINKA CHILONZOR'))
+        self.assertEqual(result['data']['operator'], 'KORZINKA CHILONZOR')
+
+    def test_cached_result_cannot_be_corrupted(self):
+        first = classify_and_parse(self.TEXT)
+        first['data']['amount'] = 0
+        self.assertEqual(classify_and_parse(self.TEXT)['data']['amount'], 150000.0)
+
+    def test_reload_invalidates_cache(self):
+        classify_and_parse(self.TEXT)
+        registered = list(classifiers.CLASSIFIERS)
+        classifiers.reload_classifiers([classifiers.GenericBankClassifier])
+        try:
+            self.assertEqual(classify_and_parse(self.TEXT)['classifier'], 'GenericBankClassifier')
+        finally:
+            classifiers.reload_classifiers(registered)
+
+    def test_reload_drops_markers_of_removed_classifiers(self):
+        registered = list(classifiers.CLASSIFIERS)
+        classifiers.reload_classifiers([classifiers.GenericBankClassifier])
+        try:
+            self.assertNotIn('UzumBankClassifier', classifiers.MARKER_INDEX.find('UZUM Bank'))
+        finally:
+            classifiers.reload_classifiers(registered)
+        self.assertIn('UzumBankClassifier', classifiers.MARKER_INDEX.find('UZUM Bank'))
+
+    def test_unparsed_text_is_cached_too(self):
+        hits = classifiers.cache_stats()['hits']
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                classify_and_parse('hello')
+        self.assertEqual(classifiers.cache_stats()['hits'], hits + 1)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+from datetime import datetime
+
+import lexer
+
+
+class TokenizeTest(unittest.TestCase):
+    def test_amount_separators(self):
+        cases = {
+            '1 250 000,00 UZS': 1250000.0,
+            '1,250,000.00 UZS': 1250000.0,
+            '1.250.000,00 UZS': 1250000.0,
+            '150 000 UZS': 150000.0,
+            '12,50 USD': 12.5,
+        }
+        for text, expected in cases.items():
+            with self.subTest(text=text):
+                amount = lexer.find_amount(lexer.tokenize(text), text)
+                self.assertEqual(amount.value, expected)
+
+    def test_currency_attached_to_amount(self):
+        tokens = lexer.tokenize('Сумма: 50 000 сум')
+        self.assertEqual([t.kind for t in tokens], [lexer.AMOUNT, lexer.CURRENCY])
+        self.assertEqual(tokens[0].currency, 'UZS')
+
+    def test_digits_inside_words_are_not_amounts(self):
+        tokens = lexer.tokenize('P2P перевод')
+        self.assertEqual(tokens, [])
+
+    def test_card_masks(self):
+        for text in ('Карта: *1234', 'HUMOCARD ****1234', '8600 12** **** 1234'):
+            with self.subTest(text=text):
+                card = lexer.find_card(lexer.tokenize(text), text)
+                self.assertEqual(card.value, '1234')
+
+    def test_invalid_date_is_dropped(self):
+        tokens = lexer.tokenize('31.02.2025')
+        self.assertNotIn(lexer.DATE, [t.kind for t in tokens])
+
+    def test_datetime_in_either_order(self):
+        expected = datetime(2025, 1, 15, 14, 30)
+        for text in ('15.01.2025 14:30', '14:30 15.01.2025'):
+            with self.subTest(text=text):
+                self.assertEqual(lexer.find_datetime(lexer.tokenize(text), text), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+
+from classifiers import UzumBankClassifier, classify_and_parse
+from markers import FuzzyMarkerIndex, fold
+
+
+class FuzzyMarkerIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = FuzzyMarkerIndex()
+        self.index.add('uzum', 'uzum')
+        self.index.add('uzum', 'транзакция')
+        self.index.add('nbu', 'milliy')
+
+    def test_homoglyphs_and_digraphs_fold_together(self):
+        self.assertEqual(fold('тpанзакция'), fold('транзакция'))
+        self.assertEqual(fold('UZIJM'), fold('uzum'))
+
+    def test_cyrillic_spelling_matches(self):
+        self.assertEqual(self.index.labels('УЗУМ банк'), {'uzum'})
+        self.assertEqual(self.index.labels('Оплата через Узум'), {'uzum'})
+
+    def test_short_markers_match_exactly(self):
+        for text in ('UZUN bank', 'izum', 'Ozum', 'usum'):
+            with self.subTest(text=text):
+                self.assertEqual(self.index.labels(text), set())
+
+    def test_bounded_edit_distance(self):
+        self.index.add('uzum', 'transaction')
+        self.assertEqual(self.index.labels('Translation'), set())
+        self.assertEqual(self.index.labels('Transactlon'), {'uzum'})
+        self.assertEqual(self.index.labels('транзакцмя'), {'uzum'})
+        self.assertEqual(self.index.labels('MILLLIY'), {'nbu'})
+        self.assertEqual(self.index.labels('UZ bank'), set())
+        self.assertEqual(self.index.labels('платёж принят'), set())
+
+    def test_several_banks_in_one_pass(self):
+        self.assertEqual(self.index.labels('Milliy -> UZIJM'), {'uzum', 'nbu'})
+
+
+class FuzzyIdentifyTest(unittest.TestCase):
+    def test_ocr_damaged_uzum_receipt(self):
+        text = (
+            'UZIJM Bank\ntpанзакция успешно завершена\nПродавец: KORZINKA\n'
+            'Сумма: 150 000 UZS\nДата: 15.01.2025 14:30\nКарта: *1234'
+        )
+        self.assertTrue(UzumBankClassifier.identify(text))
+        self.assertEqual(classify_and_parse(text)['classifier'], 'UzumBankClassifier')
+
+    def test_generic_text_is_not_uzum(self):
+        self.assertFalse(UzumBankClassifier.identify('💸 Оплата\n📍 KORZINKA\n💳 HUMOCARD *6543'))
+
+    def test_lookalike_words_are_not_uzum(self):
+        self.assertFalse(UzumBankClassifier.identify('Translation fee\nUZUN YOL\nOzum'))
+
+    def test_cyrillic_uzum(self):
+        self.assertTrue(UzumBankClassifier.identify('УЗУМ Банк\nОплата'))
+
+
+if __name__ == '__main__':
+    unittest.main()
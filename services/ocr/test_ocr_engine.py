@@ -0,0 +1,113 @@
+import os
+import stat
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from PIL import Image
+
+import ocr_engine
+
+
+def _fake_extract_text(delays, confidences):
+    def fake(image_bytes, lang='rus+eng', config='', psm=6, timeout=0, cancel_event=None, deadline=None):
+        time.sleep(delays[psm])
+        return {'text': f'psm {psm}', 'confidence': confidences[psm], 'lines': []}
+    return fake
+
+
+class MultiPsmTest(unittest.TestCase):
+    def test_best_score_wins(self):
+        fake = _fake_extract_text({4: 0.01, 6: 0.02, 11: 0.03}, {4: 40, 6: 70, 11: 55})
+        with mock.patch.object(ocr_engine, 'extract_text', fake):
+            result = ocr_engine.extract_text_multi_psm(b'', good_enough=101)
+        self.assertEqual(result['psm'], 6)
+        self.assertEqual(len(result['candidates']), 3)
+
+    def test_good_enough_result_stops_waiting(self):
+        fake = _fake_extract_text({4: 0.01, 6: 1.0, 11: 1.0}, {4: 90, 6: 95, 11: 95})
+        with mock.patch.object(ocr_engine, 'extract_text', fake):
+            start = time.monotonic()
+            result = ocr_engine.extract_text_multi_psm(b'', good_enough=85)
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(result['psm'], 4)
+
+    def test_budget_returns_best_finished_result(self):
+        fake = _fake_extract_text({4: 0.01, 6: 1.0, 11: 1.0}, {4: 30, 6: 95, 11: 95})
+        with mock.patch.object(ocr_engine, 'extract_text', fake):
+            result = ocr_engine.extract_text_multi_psm(b'', budget_ms=200, good_enough=85)
+        self.assertEqual(result['psm'], 4)
+        errors = [c['error'] for c in result['candidates'] if 'error' in c]
+        self.assertEqual(errors, ['cancelled', 'cancelled'])
+
+    def test_finished_losers_are_reported_as_results(self):
+        fake = _fake_extract_text({4: 0.05, 6: 0.0, 11: 1.0}, {4: 90, 6: 60, 11: 95})
+        with mock.patch.object(ocr_engine, 'extract_text', fake):
+            result = ocr_engine.extract_text_multi_psm(b'', good_enough=85)
+        self.assertEqual(result['psm'], 4)
+        by_psm = {c['psm']: c for c in result['candidates']}
+        self.assertEqual(by_psm[6]['score'], 60)
+        self.assertEqual(by_psm[11]['error'], 'cancelled')
+
+    def test_losers_do_not_block_next_request(self):
+        fake = _fake_extract_text({4: 0.01, 6: 1.0, 11: 1.0}, {4: 90, 6: 95, 11: 95})
+        with mock.patch.object(ocr_engine, 'extract_text', fake):
+            ocr_engine.extract_text_multi_psm(b'', good_enough=85)
+            start = time.monotonic()
+            result = ocr_engine.extract_text_multi_psm(b'', good_enough=85)
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(result['psm'], 4)
+
+    def test_tesseract_calls_are_bounded_by_deadline(self):
+        self.assertEqual(ocr_engine._call_timeout(5, None), 5)
+        self.assertLessEqual(ocr_engine._call_timeout(0, time.monotonic() + 2), 2)
+        self.assertEqual(ocr_engine._call_timeout(0, time.monotonic() - 1), ocr_engine.MIN_CALL_TIMEOUT)
+
+
+class RunTesseractTest(unittest.TestCase):
+    def setUp(self):
+        # Вместо Tesseract - скрипт, который пишет pid и висит
+        self.directory = tempfile.TemporaryDirectory()
+        self.pid_file = os.path.join(self.directory.name, 'pid')
+        script = os.path.join(self.directory.name, 'tesseract')
+        with open(script, 'w') as handle:
+            handle.write(f'#!/bin/sh\necho $$ > {self.pid_file}\nexec sleep 30\n')
+        os.chmod(script, os.stat(script).st_mode | stat.S_IEXEC)
+        patcher = mock.patch.object(ocr_engine.tesseract_api, 'tesseract_cmd', script)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.directory.cleanup)
+        self.image = Image.new('L', (10, 10), 255)
+
+    def _assert_killed(self):
+        with open(self.pid_file) as handle:
+            pid = int(handle.read())
+        with self.assertRaises(ProcessLookupError):
+            os.kill(pid, 0)
+
+    def test_output_file_is_returned(self):
+        script = ocr_engine.tesseract_api.tesseract_cmd
+        with open(script, 'w') as handle:
+            handle.write('#!/bin/sh\necho "psm ok" > "$2.txt"\n')
+        text = ocr_engine._run_tesseract(self.image, 'txt', 'eng', '--psm 6')
+        self.assertEqual(text.strip(), 'psm ok')
+
+    def test_cancel_kills_running_process(self):
+        cancel_event = threading.Event()
+        threading.Timer(0.1, cancel_event.set).start()
+        start = time.monotonic()
+        with self.assertRaises(ocr_engine.OcrCancelled):
+            ocr_engine._run_tesseract(self.image, 'txt', 'eng', '--psm 6', cancel_event=cancel_event)
+        self.assertLess(time.monotonic() - start, 1)
+        self._assert_killed()
+
+    def test_timeout_kills_running_process(self):
+        with self.assertRaises(RuntimeError):
+            ocr_engine._run_tesseract(self.image, 'tsv', 'eng', '--psm 6', timeout=0.1)
+        self._assert_killed()
+
+
+if __name__ == '__main__':
+    unittest.main()
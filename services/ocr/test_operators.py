@@ -0,0 +1,65 @@
+import unittest
+from unittest import mock
+
+import operators
+
+
+OPERATORS = [
+    {'pattern': 'UPAY P2P, UZ', 'app_name': 'Humans', 'is_p2p': True},
+    {'pattern': 'UPAY HUMO2HUMO P2P>T', 'app_name': 'Humans', 'is_p2p': True},
+    {'pattern': 'TENGE 24 P2P UZCARD HUMO, UZ', 'app_name': 'Tenge24', 'is_p2p': True},
+    {'pattern': 'TENGE 24 P2P', 'app_name': 'Tenge24 (short)', 'is_p2p': True},
+    {'pattern': 'KORZINKA', 'canonical_name': 'Korzinka', 'app_name': 'Korzinka',
+     'is_p2p': False, 'synonyms': ['KORZINKA.UZ', 'Корзинка']},
+]
+
+
+class OperatorIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = operators.OperatorIndex(OPERATORS)
+
+    def test_longest_name_inside_string_wins(self):
+        match = self.index.resolve('Оплата: TENGE 24 P2P UZCARD HUMO, UZ>TASHKENT')
+        self.assertEqual(match.app_name, 'Tenge24')
+        self.assertEqual(match.method, 'substring')
+
+    def test_synonyms_and_homoglyphs(self):
+        self.assertEqual(self.index.resolve('korzinka.uz').canonical_name, 'Korzinka')
+        # Кириллические «Р» и «А» вместо латинских
+        self.assertEqual(self.index.resolve('UРАY P2P, UZ').app_name, 'Humans')
+
+    def test_truncated_string_matches_by_prefix(self):
+        match = self.index.resolve('UPAY HUMO2HUMO')
+        self.assertEqual(match.canonical_name, 'UPAY HUMO2HUMO P2P>T')
+        self.assertEqual(match.method, 'prefix')
+
+    def test_ocr_errors_match_fuzzily(self):
+        match = self.index.resolve('TENGF 24 P2P UZCARO HUMO')
+        self.assertEqual(match.app_name, 'Tenge24')
+        self.assertEqual(match.method, 'fuzzy')
+
+    def test_unknown_operator(self):
+        self.assertIsNone(self.index.resolve('MAKRO SUPERMARKET'))
+
+
+class ApplyOperatorTest(unittest.TestCase):
+    def test_overrides_app_name_and_p2p(self):
+        result = {'data': {'operator': 'KORZINKA', 'app_name': 'Unknown', 'is_p2p': True,
+                           'transaction_type': 'P2P перевод'}}
+        with mock.patch.object(operators, '_index', operators.OperatorIndex(OPERATORS)):
+            operators.apply_operator(result)
+        self.assertEqual(result['data']['app_name'], 'Korzinka')
+        self.assertFalse(result['data']['is_p2p'])
+        self.assertEqual(result['data']['transaction_type'], 'Оплата')
+
+    def test_failed_refresh_keeps_previous_index(self):
+        index = operators.OperatorIndex(OPERATORS)
+        with mock.patch.object(operators, '_index', index), \
+                mock.patch.object(operators, 'load_operators', side_effect=OSError('backend down')):
+            stats = operators.refresh_operators()
+            self.assertIs(operators._index, index)
+        self.assertEqual(stats['error'], 'backend down')
+
+
+if __name__ == '__main__':
+    unittest.main()
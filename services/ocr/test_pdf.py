@@ -0,0 +1,58 @@
+import unittest
+from unittest import mock
+
+import pdf
+
+
+RECEIPT_LINES = [
+    'UZUM Bank',
+    'Merchant: KORZINKA',
+    'Amount: 150 000 UZS',
+    'Date: 15.01.2025 14:30',
+    'Card: *1234',
+]
+
+
+def _pdf_bytes(pages):
+    document = pdf.pymupdf.open()
+    for lines in pages:
+        page = document.new_page()
+        for index, line in enumerate(lines):
+            page.insert_text((72, 72 + index * 20), line, fontsize=12)
+    data = document.tobytes()
+    document.close()
+    return data
+
+
+@unittest.skipIf(pdf.pymupdf is None, 'PyMuPDF is not installed')
+class ProcessPdfTest(unittest.TestCase):
+    def test_text_layer_skips_ocr(self):
+        data = _pdf_bytes([RECEIPT_LINES, RECEIPT_LINES])
+        with mock.patch.object(pdf, 'extract_text') as extract_text:
+            result = pdf.process_pdf(data)
+        extract_text.assert_not_called()
+        self.assertEqual(result['pages'], 2)
+        self.assertEqual([r['page'] for r in result['receipts']], [1, 2])
+        self.assertEqual(result['receipts'][0]['source'], 'text')
+        self.assertEqual(result['receipts'][0]['parsed_data']['data']['amount'], 150000.0)
+
+    def test_scanned_page_goes_through_ocr(self):
+        data = _pdf_bytes([RECEIPT_LINES, []])
+        fake = {'text': '\n'.join(RECEIPT_LINES), 'confidence': 90.0, 'lines': []}
+        with mock.patch.object(pdf, 'extract_text', return_value=fake) as extract_text:
+            result = pdf.process_pdf(data)
+        self.assertEqual(extract_text.call_count, 1)
+        sources = {r['page']: r['source'] for r in result['receipts']}
+        self.assertEqual(sources, {1: 'text', 2: 'ocr'})
+
+    def test_page_limit(self):
+        with self.assertRaises(pdf.PdfError):
+            pdf.process_pdf(_pdf_bytes([RECEIPT_LINES] * 3), max_pages=2)
+
+    def test_detects_pdf_signature(self):
+        self.assertTrue(pdf.is_pdf(_pdf_bytes([RECEIPT_LINES])))
+        self.assertFalse(pdf.is_pdf(b'\x89PNG\r\n'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import io
+import unittest
+
+from PIL import Image, ImageDraw
+
+import preprocessing
+
+
+def _jpeg_bytes(size, color=(200, 100, 50)):
+    output = io.BytesIO()
+    Image.new('RGB', size, color).save(output, format='JPEG')
+    return output.getvalue()
+
+
+def _screenshot_bytes(size=(1080, 2400)):
+    image = Image.new('RGB', size, (245, 245, 245))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, size[0], 90), fill=(120, 40, 200))
+    for top in range(120, size[1] - 60, 60):
+        draw.text((80, top), 'Payment 150 000 UZS 12.01.2025 *1234', fill=(20, 20, 20))
+    output = io.BytesIO()
+    image.save(output, format='PNG')
+    return output.getvalue()
+
+
+def _jpeg_screenshot_bytes(size=(1440, 3200)):
+    output = io.BytesIO()
+    Image.open(io.BytesIO(_screenshot_bytes(size))).convert('RGB').save(output, format='JPEG', quality=95)
+    return output.getvalue()
+
+
+def _camera_jpeg_bytes(size=(1080, 2400)):
+    image = Image.open(io.BytesIO(_screenshot_bytes(size))).convert('RGB')
+    exif = Image.Exif()
+    exif[preprocessing.EXIF_MAKE] = 'Samsung'
+    output = io.BytesIO()
+    image.save(output, format='JPEG', exif=exif.tobytes())
+    return output.getvalue()
+
+
+def _photo_bytes(size=(1200, 1600)):
+    noise = Image.effect_noise(size, 40).convert('RGB')
+    output = io.BytesIO()
+    noise.save(output, format='JPEG', quality=90)
+    return output.getvalue()
+
+
+class PreprocessingDecodeTest(unittest.TestCase):
+    def test_large_jpeg_is_decoded_at_reduced_scale(self):
+        _, metadata = preprocessing.preprocess_image(_jpeg_bytes((6000, 4000)))
+        self.assertEqual(metadata['original_size'], (6000, 4000))
+        self.assertEqual(metadata['decoded_size'], (3000, 2000))
+        self.assertEqual(metadata['processed_size'], (2000, 1333))
+        self.assertIn('decode_ms', metadata)
+
+    def test_no_draft_without_resize_step(self):
+        _, metadata = preprocessing.preprocess_image(_jpeg_bytes((3000, 1000)), steps=['sharpen'])
+        self.assertEqual(metadata['decoded_size'], (3000, 1000))
+
+    def test_pixel_budget_rejects_before_decoding(self):
+        with self.assertRaises(preprocessing.ImageTooLargeError):
+            preprocessing.load_image(_jpeg_bytes((1000, 1000)), max_pixels=999_999)
+
+
+class ScreenshotFastPathTest(unittest.TestCase):
+    def test_screenshot_gets_grayscale_only(self):
+        _, metadata = preprocessing.preprocess_image(_screenshot_bytes())
+        self.assertEqual(metadata['steps_applied'], ['screenshot', 'grayscale'])
+
+    def test_photo_keeps_full_chain(self):
+        _, metadata = preprocessing.preprocess_image(_photo_bytes())
+        self.assertEqual(metadata['steps_applied'], ['photo'] + preprocessing.PHOTO_STEPS)
+
+    def test_long_scrolling_screenshot_keeps_full_resolution(self):
+        _, metadata = preprocessing.preprocess_image(_screenshot_bytes((1080, 9000)))
+        self.assertEqual(metadata['steps_applied'], ['screenshot', 'grayscale'])
+        self.assertEqual(metadata['processed_size'], (1080, 9000))
+
+    def test_jpeg_screenshot_is_not_draft_decoded(self):
+        _, metadata = preprocessing.preprocess_image(_jpeg_screenshot_bytes())
+        self.assertEqual(metadata['steps_applied'], ['screenshot', 'grayscale'])
+        self.assertEqual(metadata['decoded_size'], (1440, 3200))
+        self.assertEqual(metadata['processed_size'], (1440, 3200))
+
+    def test_camera_exif_means_photo(self):
+        _, metadata = preprocessing.preprocess_image(_camera_jpeg_bytes())
+        self.assertEqual(metadata['steps_applied'][0], 'photo')
+
+    def test_explicit_steps_skip_classification(self):
+        _, metadata = preprocessing.preprocess_image(_screenshot_bytes(), steps=['sharpen'])
+        self.assertEqual(metadata['steps_applied'], ['sharpen'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+
+import lexer
+import replay_harness
+
+
+CLASSIFIERS = '''
+from lexer import find_amount
+
+
+def classify_and_parse(text):
+    if 'receipt' not in text:
+        raise ValueError('unknown format')
+    return {{'classifier': '{name}', 'data': {{'amount': find_amount(text), 'currency': 'UZS'}}}}
+'''
+
+LEXER = '''
+def find_amount(text):
+    return {amount}
+'''
+
+CORPUS = [
+    {'id': 'a', 'text': 'receipt one', 'expected': {'amount': 200, 'currency': 'UZS'}},
+    {'id': 'b', 'text': 'receipt two', 'expected': {'amount': 200}},
+    {'id': 'c', 'text': 'chatter', 'expected': {}},
+]
+
+
+class ReplayHarnessTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = tmp.name
+        self.old = self._version('old', name='OldClassifier', amount=100)
+        self.new = self._version('new', name='NewClassifier', amount=200)
+        self.corpus = os.path.join(self.root, 'corpus.jsonl')
+        with open(self.corpus, 'w', encoding='utf-8') as fp:
+            fp.write('\n'.join(json.dumps(record) for record in CORPUS))
+
+    def _version(self, directory, name, amount):
+        path = os.path.join(self.root, directory)
+        os.makedirs(path)
+        with open(os.path.join(path, 'classifiers.py'), 'w') as fp:
+            fp.write(CLASSIFIERS.format(name=name))
+        with open(os.path.join(path, 'lexer.py'), 'w') as fp:
+            fp.write(LEXER.format(amount=amount))
+        return os.path.join(path, 'classifiers.py')
+
+    def test_versions_use_their_own_modules(self):
+        records = replay_harness.load_corpus(self.corpus)
+        baseline = replay_harness.evaluate_isolated(self.old, self.corpus)
+        candidate = replay_harness.evaluate_isolated(self.new, self.corpus)
+
+        self.assertEqual(baseline['fields']['amount']['recall'], 0.0)
+        self.assertEqual(candidate['fields']['amount']['recall'], 1.0)
+        self.assertEqual(candidate['classifiers'], {'NewClassifier': 2 / 3, '(unparsed)': 1 / 3})
+
+        changes = replay_harness.diff_predictions(baseline, candidate, records)
+        self.assertEqual([change['id'] for change in changes], ['a', 'b'])
+        self.assertEqual(changes[0]['baseline']['amount'], 100)
+        self.assertEqual(changes[0]['candidate']['classifier'], 'NewClassifier')
+        # Текущий lexer процесса не подменён
+        self.assertTrue(hasattr(lexer, 'tokenize'))
+
+    def test_cli_compares_against_baseline(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            replay_harness.main([self.corpus, '--classifiers', self.new, '--baseline', self.old,
+                                 '--repeat', '1', '--json'])
+        report = json.loads(output.getvalue())
+        self.assertEqual(report['baseline']['classifiers']['OldClassifier'], 2 / 3)
+        self.assertEqual(len(report['changes']), 2)
+
+    def test_current_classifiers_run_in_process(self):
+        module = replay_harness.load_classifiers_module(os.path.join(replay_harness.HERE, 'classifiers.py'))
+        report = replay_harness.evaluate(module, [{'id': '1', 'text': 'hello', 'expected': {}}])
+        self.assertEqual(report['classifiers'], {'(unparsed)': 1.0})
+
+
+if __name__ == '__main__':
+    unittest.main()
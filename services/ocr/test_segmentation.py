@@ -0,0 +1,105 @@
+import io
+import unittest
+from unittest import mock
+
+from PIL import Image, ImageDraw
+
+import segmentation
+
+
+def _history_image(blocks=3, lines_per_block=4, width=600):
+    height = blocks * (lines_per_block * 30 + 80) + 40
+    image = Image.new('L', (width, height), 245)
+    draw = ImageDraw.Draw(image)
+    top = 40
+    for _ in range(blocks):
+        for _ in range(lines_per_block):
+            draw.text((40, top), 'Payment 150 000 UZS *1234', fill=20)
+            top += 30
+        top += 80
+    return image
+
+
+def _png(image):
+    output = io.BytesIO()
+    image.save(output, format='PNG')
+    return output.getvalue()
+
+
+class FindRegionsTest(unittest.TestCase):
+    def test_splits_on_tall_gaps_only(self):
+        regions = segmentation.find_regions(_history_image(blocks=3))
+        self.assertEqual(len(regions), 3)
+        self.assertTrue(all(top < bottom for top, bottom in regions))
+
+    def test_line_boxes_veto_cuts(self):
+        image = _history_image(blocks=2)
+        regions = segmentation.find_regions(image)
+        gap_middle = (regions[0][1] + regions[1][0]) // 2
+        lines = [{'words': [{'top': gap_middle - 5, 'height': 10}]}]
+        self.assertEqual(len(segmentation.find_regions(image, lines)), 1)
+
+
+class SegmentReceiptsTest(unittest.TestCase):
+    RECEIPT = 'Оплата\n{amount} UZS\nКарта *1234\n15.01.2025 14:30'
+
+    def test_regions_are_parsed_and_headers_merged(self):
+        image = _history_image(blocks=4, width=200)
+        regions = segmentation.find_regions(image)
+        texts = {
+            regions[0][0]: self.RECEIPT.format(amount='50 000'),
+            regions[1][0]: 'Оплата\n75 000 UZS',
+            regions[2][0]: 'Карта *1234\n15.01.2025 14:30',
+            regions[3][0]: 'Реклама',
+        }
+
+        def fake_ocr(image, region, lang):
+            return {'text': texts[region[0]], 'confidence': 90.0, 'lines': []}
+
+        with mock.patch.object(segmentation, '_ocr_region', fake_ocr):
+            result = segmentation.segment_receipts(image)
+
+        self.assertEqual(result['regions'], 4)
+        amounts = [r['parsed_data']['data']['amount'] for r in result['receipts']]
+        self.assertEqual(amounts, [50000.0, 75000.0])
+        self.assertEqual([u['text'] for u in result['unparsed']], ['Реклама'])
+
+    def test_regular_image_is_not_segmented(self):
+        self.assertIsNone(segmentation.segment_receipts(Image.new('L', (1080, 1920), 255)))
+
+    def test_line_geometry_is_requested_only_for_several_regions(self):
+        get_lines = mock.Mock(return_value=[])
+        blank = Image.new('L', (200, 1000), 255)
+        self.assertIsNone(segmentation.segment_receipts(blank, get_lines=get_lines))
+        get_lines.assert_not_called()
+
+
+class SegmentSourceTest(unittest.TestCase):
+    def test_processed_screenshot_is_used_as_is(self):
+        image = _history_image(width=200)
+        metadata = {'original_size': image.size, 'processed_size': image.size}
+        source, scale = segmentation.segment_source(b'', _png(image), metadata)
+        self.assertEqual(source.size, image.size)
+        self.assertEqual(scale, 1.0)
+
+    def test_downscaled_photo_is_cut_from_grayscale_original(self):
+        original = _history_image(blocks=5, width=300).convert('RGB')
+        processed = original.resize((150, original.size[1] // 2))
+        metadata = {'original_size': original.size, 'processed_size': processed.size}
+        source, scale = segmentation.segment_source(_png(original), _png(processed), metadata)
+        self.assertEqual(source.size, original.size)
+        self.assertEqual(source.mode, 'L')
+        self.assertEqual(scale, 2.0)
+
+    def test_original_over_pixel_budget_falls_back_to_processed(self):
+        original = _history_image(blocks=5, width=300)
+        processed = original.resize((150, original.size[1] // 2))
+        metadata = {'original_size': original.size, 'processed_size': processed.size}
+        with mock.patch.object(segmentation, 'SEGMENT_MAX_PIXELS', 1000):
+            source, scale = segmentation.segment_source(_png(original), _png(processed), metadata)
+        self.assertEqual(source.size, processed.size)
+        self.assertEqual(scale, 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
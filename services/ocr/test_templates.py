@@ -0,0 +1,110 @@
+import unittest
+
+import classifiers
+from templates import TemplateRegistry, fingerprint
+
+
+CARDXABAR = (
+    '💸 Оплата\n➖ {amount} UZS\n📍 {merchant}\n💳 HUMOCARD *{card}\n'
+    '🕓 14:30 15.01.2025\n💰 1 000 000.00 UZS'
+)
+UZUM = (
+    'UZUM Bank\nПеревод\nПолучатель: {name}\nСумма: {amount} UZS\n'
+    'Дата: 16.01.2025 09:05\nКарта: *{card}'
+)
+
+
+class FingerprintTest(unittest.TestCase):
+    def test_same_shape_for_different_values(self):
+        first, _ = fingerprint(CARDXABAR.format(amount='50 000.00', merchant='KORZINKA', card='6543'))
+        second, slots = fingerprint(CARDXABAR.format(amount='7 500.00', merchant='OOO "Bek & Co"', card='1111'))
+        self.assertEqual(first, second)
+        self.assertIn(('TEXT', 'OOO "Bek & Co"', None), slots)
+
+    def test_vocabulary_words_stay_in_shape(self):
+        shape, _ = fingerprint(UZUM.format(name='IVAN I.', amount='100,00', card='7777'))
+        self.assertIn('Получатель: {TEXT}', shape)
+        self.assertIn('\n#', shape)
+        self.assertIn('uzum', shape.rsplit('\n#', 1)[1])
+
+    def test_marker_word_in_merchant_stays_one_slot(self):
+        shape, slots = fingerprint(CARDXABAR.format(amount='50 000.00', merchant='UPAY P2P, UZ', card='6543'))
+        self.assertIn('📍 {TEXT}', shape)
+        self.assertIn(('TEXT', 'UPAY P2P, UZ', None), slots)
+
+
+class TemplateRegistryTest(unittest.TestCase):
+    def setUp(self):
+        classifiers.reload_classifiers()
+        self.registry = TemplateRegistry(verify_samples=2)
+
+    def test_template_matches_classify_and_parse(self):
+        messages = [
+            UZUM.format(name=name, amount=amount, card=card)
+            for name, amount, card in [('IVAN I.', '1 250 000,00', '7777'),
+                                       ('PETR P.', '300 000,00', '7771'),
+                                       ('ANNA K.', '15 000,00', '1234'),
+                                       ('OLGA S.', '99,50', '4321')]
+        ]
+        for text in messages:
+            self.assertEqual(self.registry.parse(text), classifiers.classify_and_parse(text))
+
+        coverage = self.registry.coverage()
+        self.assertEqual(coverage['templates'], 1)
+        self.assertEqual(coverage['fallbacks'], 1)
+        self.assertEqual(coverage['template_hits'], 3)
+
+    def test_classifier_markers_are_not_masked(self):
+        plain, _ = fingerprint(CARDXABAR.format(amount='50 000.00', merchant='KORZINKA', card='6543'))
+        uzum, _ = fingerprint(CARDXABAR.format(amount='50 000.00', merchant='UZUM MARKET', card='6543'))
+        self.assertNotEqual(plain, uzum)
+
+    def test_merchant_with_marker_word_compiles_and_verifies(self):
+        messages = [
+            CARDXABAR.format(amount=amount, merchant='UPAY P2P, UZ', card=card)
+            for amount, card in [('50 000.00', '6543'), ('7 500.00', '1111'), ('12 000.00', '2222')]
+        ]
+        for text in messages:
+            self.assertEqual(self.registry.parse(text), classifiers.classify_and_parse(text, use_cache=False))
+
+        coverage = self.registry.coverage()
+        self.assertEqual(coverage['disabled'], 0)
+        self.assertEqual(coverage['uncompilable'], 0)
+
+    def test_bot_notifications_use_template_with_balance(self):
+        messages = [
+            CARDXABAR.format(amount=amount, merchant=merchant, card=card)
+            for amount, merchant, card in [('50 000.00', 'KORZINKA', '6543'),
+                                           ('7 500.00', 'MAKRO', '1111'),
+                                           ('120 000.00', 'HAVAS', '2222'),
+                                           ('9 990.00', 'EVOS', '3333')]
+        ]
+        for text in messages:
+            result = self.registry.parse(text)
+            self.assertEqual(result, classifiers.classify_and_parse(text))
+            self.assertEqual(result['classifier'], 'CardXabarClassifier')
+        self.assertEqual(self.registry.coverage()['template_hits'], 3)
+
+    def test_least_recently_used_shape_is_evicted(self):
+        registry = TemplateRegistry(max_templates=2, verify_samples=0)
+        bot = CARDXABAR.format(amount='50 000.00', merchant='KORZINKA', card='6543')
+        registry.parse(bot)
+        for noise in ('Сумма: 10 000 UZS\nКарта *1234\n15.01.2025 14:30\nшум',
+                      'Сумма: 10 000 UZS\nКарта *1234\n15.01.2025 14:30\nшум\nещё'):
+            registry.parse(bot)
+            registry.parse(noise)
+
+        coverage = registry.coverage()
+        self.assertEqual(coverage['templates'], 2)
+        self.assertEqual(coverage['evicted'], 1)
+        shapes = [item['classifier'] for item in coverage['items']]
+        self.assertIn('CardXabarClassifier', shapes)
+
+    def test_unknown_shape_falls_back(self):
+        with self.assertRaises(ValueError):
+            self.registry.parse('hello')
+        self.assertEqual(self.registry.coverage()['fallbacks'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import threading
+import unittest
+from unittest import mock
+
+from PIL import ImageFont
+
+import warmup
+
+
+CANARY_TEXT = '\n'.join(warmup.CANARY_LINES)
+
+
+def _ocr(text):
+    return mock.Mock(return_value={'text': text, 'confidence': 90.0, 'lines': []})
+
+
+class WarmupTest(unittest.TestCase):
+    def setUp(self):
+        self._saved = dict(warmup._state)
+        self.addCleanup(warmup._state.update, self._saved)
+        warmup._state.update(ready=False, status='pending', tesseract_version=None,
+                             languages=None, error=None, attempts=0, next_retry_at=None)
+        patches = [
+            mock.patch.object(warmup.pytesseract, 'get_tesseract_version', return_value='5.3.0'),
+            mock.patch.object(warmup.pytesseract, 'get_languages', return_value=['eng', 'rus']),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_successful_warmup_is_ready(self):
+        with mock.patch.object(warmup, 'extract_text', _ocr(CANARY_TEXT)):
+            state = warmup.run_warmup()
+        self.assertTrue(state['ready'])
+        self.assertEqual(state['status'], 'ready')
+        self.assertEqual(state['attempts'], 1)
+
+    def test_failed_canary_still_reports_tesseract(self):
+        with mock.patch.object(warmup, 'extract_text', _ocr('garbage')):
+            state = warmup.run_warmup()
+        self.assertFalse(state['ready'])
+        self.assertEqual(state['status'], 'failed')
+        self.assertIn('Canary OCR mismatch', state['error'])
+        self.assertEqual(state['tesseract_version'], '5.3.0')
+        self.assertEqual(state['languages'], ['eng', 'rus'])
+
+    def test_failed_warmup_is_retried_until_ready(self):
+        ocr = mock.Mock(side_effect=[
+            {'text': 'garbage', 'confidence': 10.0, 'lines': []},
+            {'text': CANARY_TEXT, 'confidence': 90.0, 'lines': []},
+        ])
+        with mock.patch.object(warmup, 'extract_text', ocr), \
+                mock.patch.object(warmup, 'WARMUP_RETRY_BASE_S', 0):
+            state = warmup.warmup_until_ready()
+        self.assertTrue(state['ready'])
+        self.assertEqual(state['attempts'], 2)
+        self.assertIsNone(state['next_retry_at'])
+
+    def test_stop_event_ends_retries(self):
+        stop = threading.Event()
+        stop.set()
+        with mock.patch.object(warmup, 'extract_text', _ocr('garbage')):
+            state = warmup.warmup_until_ready(stop_event=stop)
+        self.assertFalse(state['ready'])
+        self.assertEqual(state['attempts'], 1)
+        self.assertIsNotNone(state['next_retry_at'])
+
+    def test_canary_uses_truetype_font(self):
+        with mock.patch.object(warmup, 'CANARY_FONT_PATHS', [warmup.CANARY_FONT_PATHS[-1]]):
+            if not any(warmup.os.path.exists(path) for path in warmup.CANARY_FONT_PATHS):
+                self.skipTest('DejaVu Sans is not installed')
+            self.assertIsInstance(warmup.load_canary_font(), ImageFont.FreeTypeFont)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,213 @@
+"""
+OCR Service: прогрев и проверка готовности
+
+При старте сервиса:
+1. Проверяет наличие Tesseract и нужных traineddata
+2. Прогревает модели: распознаёт встроенный образец чека (canary)
+   через тот же pipeline, что и реальные запросы
+3. Сверяет результат canary с ожидаемыми значениями
+
+Пока прогрев не завершился успешно, /ready отвечает 503. Неудачный прогрев
+повторяется с экспоненциальной задержкой (OCR_WARMUP_RETRY_BASE_S ..
+OCR_WARMUP_RETRY_MAX_S), пока не пройдёт: от /ready зависит старт worker.
+"""
+
+import io
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+import pytesseract
+from PIL import Image, ImageDraw, ImageFont
+
+from preprocessing import preprocess_image
+from ocr_engine import extract_text
+from classifiers import classify_and_parse
+
+
+TESSERACT_LANG = os.getenv('TESSERACT_LANG', 'rus+eng')
+
+# Повтор неудачного прогрева: задержка удваивается от BASE до MAX секунд
+WARMUP_RETRY_BASE_S = float(os.getenv('OCR_WARMUP_RETRY_BASE_S', 2))
+WARMUP_RETRY_MAX_S = float(os.getenv('OCR_WARMUP_RETRY_MAX_S', 60))
+
+# TTF-шрифт canary (fonts-dejavu-core в Dockerfile); растровый шрифт PIL
+# по умолчанию слишком мелкий, Tesseract его не читает
+CANARY_FONT_PATHS = [
+    os.getenv('OCR_CANARY_FONT', ''),
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+]
+CANARY_FONT_SIZE = 32
+
+# Образец чека для canary-распознавания
+CANARY_LINES = [
+    'UZUM BANK',
+    'Transaction completed',
+    'Merchant: KORZINKA',
+    'Amount: 150000 UZS',
+    'Date: 15.01.2025 14:30',
+    'Card: *1234',
+]
+
+# Значения, которые canary обязан распознать
+CANARY_EXPECTED = ['150000', '1234', '15.01.2025']
+
+_state = {
+    'ready': False,
+    'status': 'pending',
+    'tesseract_version': None,
+    'languages': None,
+    'canary_ms': None,
+    'canary_confidence': None,
+    'warmed_at': None,
+    'error': None,
+    'attempts': 0,
+    'next_retry_at': None,
+}
+_state_lock = threading.Lock()
+
+
+def load_canary_font():
+    """
+    TTF-шрифт для canary: OCR_CANARY_FONT, DejaVu Sans или встроенный шрифт PIL
+
+    Returns:
+        PIL.ImageFont
+    """
+    for path in CANARY_FONT_PATHS:
+        if path and os.path.exists(path):
+            return ImageFont.truetype(path, CANARY_FONT_SIZE)
+    try:
+        return ImageFont.load_default(size=CANARY_FONT_SIZE)
+    except TypeError:
+        # Pillow < 10.1: только растровый шрифт фиксированного размера
+        print("⚠️ OCR warmup: TTF font not found, canary uses PIL bitmap font")
+        return ImageFont.load_default()
+
+
+def render_canary_image():
+    """
+    Рисует образец чека для canary-распознавания
+
+    Returns:
+        bytes - изображение в формате PNG
+    """
+    font = load_canary_font()
+    image = Image.new('RGB', (900, 60 * len(CANARY_LINES) + 60), 'white')
+    draw = ImageDraw.Draw(image)
+    for index, line in enumerate(CANARY_LINES):
+        draw.text((40, 30 + index * 60), line, fill='black', font=font)
+
+    output = io.BytesIO()
+    image.save(output, format='PNG')
+    return output.getvalue()
+
+
+def _update_state(**fields):
+    with _state_lock:
+        _state.update(fields)
+
+
+def get_readiness():
+    """
+    Текущее состояние готовности сервиса
+
+    Returns:
+        dict - копия состояния прогрева
+    """
+    with _state_lock:
+        return dict(_state)
+
+
+def run_warmup():
+    """
+    Одна попытка прогрева; обновляет состояние готовности
+
+    Версия Tesseract и список языков записываются в состояние сразу,
+    даже если canary затем не пройдёт.
+
+    Returns:
+        dict - итоговое состояние (см. get_readiness)
+    """
+    with _state_lock:
+        _state.update(status='warming', error=None, next_retry_at=None)
+        _state['attempts'] += 1
+    try:
+        version = str(pytesseract.get_tesseract_version())
+        _update_state(tesseract_version=version)
+
+        languages = pytesseract.get_languages(config='')
+        _update_state(languages=languages)
+        missing = [lang for lang in TESSERACT_LANG.split('+') if lang not in languages]
+        if missing:
+            raise RuntimeError(f'Missing Tesseract languages: {", ".join(missing)}')
+
+        start = time.perf_counter()
+        processed_bytes, _ = preprocess_image(render_canary_image())
+        ocr_result = extract_text(processed_bytes, lang=TESSERACT_LANG)
+        canary_ms = round((time.perf_counter() - start) * 1000, 1)
+
+        # Классификаторы тоже прогреваем (компиляция регулярных выражений)
+        try:
+            classify_and_parse(ocr_result['text'])
+        except ValueError:
+            pass
+
+        normalized = ocr_result['text'].replace(' ', '')
+        unrecognized = [value for value in CANARY_EXPECTED if value not in normalized]
+        if unrecognized:
+            raise RuntimeError(f'Canary OCR mismatch, not found: {", ".join(unrecognized)}')
+
+        _update_state(
+            ready=True,
+            status='ready',
+            canary_ms=canary_ms,
+            canary_confidence=ocr_result['confidence'],
+            warmed_at=datetime.now(timezone.utc).isoformat(),
+        )
+    except Exception as e:
+        _update_state(ready=False, status='failed', error=str(e))
+        print(f"❌ OCR warmup failed: {e}")
+
+    return get_readiness()
+
+
+def warmup_until_ready(stop_event=None, max_attempts=None):
+    """
+    Повторяет прогрев с экспоненциальной задержкой, пока он не пройдёт
+
+    Args:
+        stop_event: threading.Event - прерывает ожидание следующей попытки
+        max_attempts: int - лимит попыток (None = без лимита)
+
+    Returns:
+        dict - итоговое состояние (см. get_readiness)
+    """
+    stop_event = stop_event or threading.Event()
+    delay = WARMUP_RETRY_BASE_S
+    attempt = 0
+    while True:
+        attempt += 1
+        state = run_warmup()
+        if state['ready'] or (max_attempts and attempt >= max_attempts):
+            return state
+
+        retry_at = datetime.now(timezone.utc).timestamp() + delay
+        _update_state(next_retry_at=datetime.fromtimestamp(retry_at, timezone.utc).isoformat())
+        print(f"🔁 OCR warmup retry in {delay:.0f}s (attempt {attempt})")
+        if stop_event.wait(delay):
+            return get_readiness()
+        delay = min(delay * 2, WARMUP_RETRY_MAX_S)
+
+
+def start_warmup():
+    """
+    Запускает прогрев (с повторами) в фоновом потоке, чтобы /health отвечал сразу
+
+    Returns:
+        threading.Thread - поток прогрева
+    """
+    thread = threading.Thread(target=warmup_until_ready, name='ocr-warmup', daemon=True)
+    thread.start()
+    return thread
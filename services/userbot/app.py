@@ -1,5 +1,5 @@
 """
-patch-017 §4: Userbot Service Flask App
+patch-017 §4: Userbot Service HTTP API
 
 API для управления Telethon userbot:
 - POST /login - логин по номеру телефона
@@ -7,121 +7,138 @@ API для управления Telethon userbot:
 - POST /stop - остановка
 - GET /status - текущий статус
 - GET /health - healthcheck
+- POST /load-history - запуск загрузки истории в фоне (202), GET /load-history - её состояние
+
+aiohttp.web на том же event loop, что и Telethon: обработчики - корутины,
+запросы не занимают потоки и не ждут друг друга. У каждого вызова userbot
+свой таймаут (USERBOT_API_TIMEOUT и др.) - по истечении ответ 504, а
+корутина отменяется. Обрыв соединения клиентом тоже отменяет обработчик,
+поэтому долгая загрузка истории идёт фоновой задачей, не привязанной к запросу.
 """
 
 import asyncio
-import json
+import logging
 import os
-import threading
-import time
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-import config
-from userbot import userbot_manager
-
-
-app = Flask(__name__)
-CORS(app)
-
-# region agent log helper
-DEBUG_LOG_PATH = r'c:\Users\Дмитрий\Desktop\parcer\parcer\.cursor\debug.log'
-DEBUG_SESSION_ID = 'debug-session'
-DEBUG_RUN_ID = 'pre-fix'
-
-
-def _agent_log(hypothesis_id: str, location: str, message: str, data=None):
-    payload = {
-        'sessionId': DEBUG_SESSION_ID,
-        'runId': DEBUG_RUN_ID,
-        'hypothesisId': hypothesis_id,
-        'location': location,
-        'message': message,
-        'data': data or {},
-        'timestamp': int(time.time() * 1000),
-    }
-    try:
-        with open(DEBUG_LOG_PATH, 'a', encoding='utf-8') as fp:
-            fp.write(json.dumps(payload, ensure_ascii=False) + '\n')
-    except Exception:
-        # Логирование не должно влиять на работу API
-        pass
+import traceback
+from typing import Optional
 
-# endregion
+from aiohttp import web
 
-# Глобальный event loop для asyncio
-loop = None
-userbot_thread = None
+import services.userbot.config as config
+from services.userbot.userbot import userbot_manager
+from services.userbot.tracing import tracer
 
+# Таймауты вызовов userbot, сек
+API_TIMEOUT = float(os.getenv('USERBOT_API_TIMEOUT', '30'))
+LOGIN_TIMEOUT = float(os.getenv('USERBOT_LOGIN_TIMEOUT', '60'))
+HISTORY_TIMEOUT = float(os.getenv('USERBOT_HISTORY_TIMEOUT', '1800'))
 
-def run_userbot_loop():
-    """
-    Запуск event loop в отдельном потоке
-    """
-    global loop
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    loop.run_forever()
+# Фоновые загрузки истории по bot_id (см. load_history)
+HISTORY_TASKS = web.AppKey('history_tasks', dict)
 
+logger = logging.getLogger('userbot.api')
 
-# Запускаем event loop в фоновом потоке при старте приложения
-userbot_thread = threading.Thread(target=run_userbot_loop, daemon=True)
-userbot_thread.start()
 
-def run_async(coro):
-    """
-    Хелпер для запуска async функций из sync контекста Flask
-    """
-    # Ждем пока loop создастся (до 5 секунд)
-    timeout = 5
-    start = time.time()
-    while loop is None and (time.time() - start) < timeout:
-        time.sleep(0.1)
-
-    wait_ms = int((time.time() - start) * 1000)
-
-    if loop is None:
-        # region agent log
-        _agent_log(
-            'H1',
-            'userbot/app.py:run_async',
-            'loop_not_initialized',
-            {
-                'wait_ms': wait_ms,
-                'coro': str(coro),
-            },
+async def _read_json(request: web.Request) -> dict:
+    """Тело запроса как dict ({} если тела нет)"""
+    if not request.body_exists:
+        return {}
+    try:
+        data = await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(
+            text='{"success": false, "error": "Некорректный JSON"}',
+            content_type='application/json'
         )
-        # endregion
-        raise RuntimeError("Event loop not initialized")
-
-    # region agent log
-    _agent_log(
-        'H1',
-        'userbot/app.py:run_async',
-        'loop_ready',
-        {
-            'wait_ms': wait_ms,
-            'coro': str(coro),
-        },
+    return data if isinstance(data, dict) else {}
+
+
+@web.middleware
+async def cors_middleware(request: web.Request, handler):
+    """CORS для всех origin"""
+    if request.method == 'OPTIONS':
+        response = web.Response()
+    else:
+        response = await handler(request)
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Access-Control-Allow-Headers'] = request.headers.get(
+        'Access-Control-Request-Headers', 'Content-Type'
     )
-    # endregion
+    response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
+    return response
+
+
+@web.middleware
+async def error_middleware(request: web.Request, handler):
+    """Таймаут вызова userbot -> 504, необработанная ошибка -> 500"""
+    try:
+        return await handler(request)
+    except web.HTTPException:
+        raise
+    except asyncio.TimeoutError:
+        tracer.trace('api_timeout', method=request.method, path=request.path)
+        logger.warning("%s %s: таймаут", request.method, request.path)
+        return web.json_response({
+            'success': False,
+            'error': 'Таймаут запроса к userbot'
+        }, status=504)
+    except Exception as e:
+        logger.exception("%s %s: ошибка", request.method, request.path)
+        return web.json_response({
+            'success': False,
+            'error': str(e)
+        }, status=500)
 
-    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+def _start_monitoring(app: web.Application):
+    """Запускает run_until_disconnected фоновой задачей (не более одной)"""
+    task: Optional[asyncio.Task] = app.get('monitor_task')
+    if task is not None and not task.done():
+        return
+    app['monitor_task'] = asyncio.create_task(
+        userbot_manager.run_until_disconnected(),
+        name='userbot-monitor'
+    )
 
 
-@app.route('/health', methods=['GET'])
-def health():
+async def health(request: web.Request):
     """
     Healthcheck endpoint
     """
-    return jsonify({
+    return web.json_response({
         'status': 'healthy',
         'service': 'userbot',
-        'version': '1.0.0'
+        'version': '1.0.0',
+        'pipeline': userbot_manager.pipeline.stats(),
+        'write_buffer': userbot_manager.write_buffer.stats(),
+        'entity_cache': userbot_manager.entity_cache.stats(),
+        'forwarder': userbot_manager.forwarder.stats(),
+        'outbox': userbot_manager.outbox.stats(),
+        'message_store': userbot_manager.message_store.stats(),
+        'history': userbot_manager.history_progress,
+        'tracing': tracer.stats()
     })
 
 
-@app.route('/status', methods=['GET'])
-def get_status():
+async def debug_trace(request: web.Request):
+    """
+    Последние события трассировки
+
+    Query params:
+        limit: int - сколько событий (по умолчанию 100, максимум 1000)
+        event: str - только события с этим именем
+    """
+    try:
+        limit = min(max(int(request.query.get('limit', 100)), 0), 1000)
+    except ValueError:
+        return web.json_response({'error': 'limit must be an integer'}, status=400)
+    return web.json_response({
+        'events': tracer.recent(limit, request.query.get('event')),
+        'stats': tracer.stats()
+    })
+
+
+async def get_status(request: web.Request):
     """
     Получить текущий статус userbot
 
@@ -138,19 +155,20 @@ def get_status():
     }
     """
     try:
-        status = run_async(userbot_manager.get_status())
-        return jsonify(status)
+        status = await asyncio.wait_for(userbot_manager.get_status(), API_TIMEOUT)
+        return web.json_response(status)
 
+    except asyncio.TimeoutError:
+        raise
     except Exception as e:
-        return jsonify({
+        return web.json_response({
             'running': False,
             'authorized': False,
             'error': str(e)
-        }), 500
+        }, status=500)
 
 
-@app.route('/login', methods=['POST'])
-def login():
+async def login(request: web.Request):
     """
     Логин userbot через номер телефона
 
@@ -168,36 +186,27 @@ def login():
         "user": {...} (если authorized)
     }
     """
-    try:
-        data = request.json
+    data = await _read_json(request)
 
-        phone_number = data.get('phone_number')
-        code = data.get('code')
-        password = data.get('password')
+    phone_number = data.get('phone_number')
+    code = data.get('code')
+    password = data.get('password')
 
-        if not phone_number:
-            return jsonify({
-                'success': False,
-                'error': 'Требуется phone_number'
-            }), 400
+    if not phone_number:
+        return web.json_response({
+            'success': False,
+            'error': 'Требуется phone_number'
+        }, status=400)
 
-        result = run_async(userbot_manager.login(phone_number, code, password))
+    result = await asyncio.wait_for(userbot_manager.login(phone_number, code, password), LOGIN_TIMEOUT)
 
-        if result.get('success'):
-            return jsonify(result), 200
-        else:
-            status_code = 200 if result.get('status') in ['code_sent', 'password_required'] else 400
-            return jsonify(result), status_code
+    if result.get('success'):
+        return web.json_response(result)
+    status_code = 200 if result.get('status') in ['code_sent', 'password_required'] else 400
+    return web.json_response(result, status=status_code)
 
-    except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
 
-
-@app.route('/start', methods=['POST'])
-def start_userbot():
+async def start_userbot(request: web.Request):
     """
     Запуск userbot мониторинга
 
@@ -208,29 +217,16 @@ def start_userbot():
         "user": {...}
     }
     """
-    try:
-        result = run_async(userbot_manager.start())
+    result = await asyncio.wait_for(userbot_manager.start(), LOGIN_TIMEOUT)
 
-        if result.get('success'):
-            # Запускаем userbot в фоновом режиме
-            asyncio.run_coroutine_threadsafe(
-                userbot_manager.run_until_disconnected(),
-                loop
-            )
-
-            return jsonify(result), 200
-        else:
-            return jsonify(result), 400
+    if not result.get('success'):
+        return web.json_response(result, status=400)
 
-    except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+    _start_monitoring(request.app)
+    return web.json_response(result)
 
 
-@app.route('/stop', methods=['POST'])
-def stop_userbot():
+async def stop_userbot(request: web.Request):
     """
     Остановка userbot
 
@@ -240,19 +236,11 @@ def stop_userbot():
         "message": "Userbot остановлен"
     }
     """
-    try:
-        result = run_async(userbot_manager.stop())
-        return jsonify(result), 200
-
-    except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+    result = await asyncio.wait_for(userbot_manager.stop(), API_TIMEOUT)
+    return web.json_response(result)
 
 
-@app.route('/logout', methods=['POST'])
-def logout():
+async def logout(request: web.Request):
     """
     Выход из аккаунта (удаление session)
 
@@ -262,132 +250,128 @@ def logout():
         "message": "Session удалена"
     }
     """
-    try:
-        # Останавливаем userbot
-        run_async(userbot_manager.stop())
+    # Останавливаем userbot
+    await asyncio.wait_for(userbot_manager.stop(), API_TIMEOUT)
+
+    # Удаляем session файл
+    session_file = f"{userbot_manager.session_path}.session"
+    if os.path.exists(session_file):
+        os.remove(session_file)
+    # access_hash в кэше сущностей принадлежит старому аккаунту
+    userbot_manager.entity_cache.clear()
+
+    return web.json_response({
+        'success': True,
+        'message': 'Session удалена. Требуется новый логин.'
+    })
 
-        # Удаляем session файл
-        import os
-        session_file = f"{userbot_manager.session_path}.session"
-        if os.path.exists(session_file):
-            os.remove(session_file)
 
-        return jsonify({
-            'success': True,
-            'message': 'Session удалена. Требуется новый логин.'
-        }), 200
+async def message_text(request: web.Request):
+    """Получить текст сообщения по chat_id/message_id"""
+    data = await _read_json(request)
+    chat_id = data.get('chat_id') or data.get('chatId')
+    message_id = data.get('message_id') or data.get('messageId')
 
-    except Exception as e:
-        return jsonify({
+    if not chat_id or not message_id:
+        return web.json_response({
             'success': False,
-        'error': str(e)
-    }), 500
-
+            'error': 'chat_id и message_id обязательны'
+        }, status=400)
 
-@app.route('/message-text', methods=['POST'])
-def message_text():
-    """Получить текст сообщения по chat_id/message_id"""
     try:
-        data = request.json or {}
-        chat_id = data.get('chat_id') or data.get('chatId')
-        message_id = data.get('message_id') or data.get('messageId')
+        text = await asyncio.wait_for(userbot_manager.fetch_message_text(chat_id, message_id), API_TIMEOUT)
+    except ValueError as e:
+        return web.json_response({
+            'success': False,
+            'error': str(e)
+        }, status=404)
 
-        if not chat_id or not message_id:
-            return jsonify({
-                'success': False,
-                'error': 'chat_id и message_id обязательны'
-            }), 400
+    return web.json_response({
+        'success': True,
+        'text': text
+    })
 
-        text = run_async(userbot_manager.fetch_message_text(chat_id, message_id))
 
-        return jsonify({
-            'success': True,
-            'text': text
-        }), 200
+async def fetch_messages(request: web.Request):
+    chat_id = request.query.get('chat_id') or request.query.get('chatId')
+    before = request.query.get('before_message_id') or request.query.get('beforeMessageId')
 
-    except ValueError as e:
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 404
-    except Exception as e:
-        return jsonify({
+    if not chat_id:
+        return web.json_response({
             'success': False,
-            'error': str(e)
-        }), 500
-
+            'error': 'chat_id is required'
+        }, status=400)
 
-@app.route('/messages', methods=['GET'])
-def fetch_messages():
     try:
-        chat_id = request.args.get('chat_id') or request.args.get('chatId')
-        limit = int(request.args.get('limit', 50))
-        before = request.args.get('before_message_id') or request.args.get('beforeMessageId')
-
-        if not chat_id:
-            return jsonify({
-                'success': False,
-                'error': 'chat_id is required'
-            }), 400
-
-        messages = run_async(
-            userbot_manager.get_messages(chat_id, limit=limit, before_message_id=before)
+        limit = int(request.query.get('limit', 50))
+        messages = await asyncio.wait_for(
+            userbot_manager.get_messages(chat_id, limit=limit, before_message_id=before),
+            API_TIMEOUT
         )
-
-        next_cursor = messages[-1]['message_id'] if messages else None
-
-        return jsonify({
-            'success': True,
-            'messages': messages,
-            'nextCursor': next_cursor
-        }), 200
     except ValueError as exc:
-        return jsonify({
-            'success': False,
-            'error': str(exc)
-        }), 400
-    except Exception as exc:
-        return jsonify({
+        return web.json_response({
             'success': False,
             'error': str(exc)
-        }), 500
+        }, status=400)
 
+    next_cursor = messages[-1]['message_id'] if messages else None
 
-@app.route('/chat-meta', methods=['POST'])
-def chat_meta():
-    try:
-        data = request.json or {}
-        chat_id = data.get('chat_id') or data.get('chatId')
+    return web.json_response({
+        'success': True,
+        'messages': messages,
+        'nextCursor': next_cursor
+    })
 
-        if not chat_id:
-            return jsonify({
-                'success': False,
-                'error': 'chat_id обязателен'
-            }), 400
 
-        meta = run_async(userbot_manager.get_chat_meta(chat_id))
+async def chat_meta(request: web.Request):
+    data = await _read_json(request)
+    chat_id = data.get('chat_id') or data.get('chatId')
 
-        return jsonify({
-            'success': True,
-            'meta': meta
-        }), 200
+    if not chat_id:
+        return web.json_response({
+            'success': False,
+            'error': 'chat_id обязателен'
+        }, status=400)
 
+    try:
+        meta = await asyncio.wait_for(userbot_manager.get_chat_meta(chat_id), API_TIMEOUT)
     except ValueError as e:
-        return jsonify({
+        return web.json_response({
             'success': False,
             'error': str(e)
-        }), 404
-    except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+        }, status=404)
+
+    return web.json_response({
+        'success': True,
+        'meta': meta
+    })
+
+
+async def _run_history(bot_id, bot_username, days) -> dict:
+    """Загрузка истории с общим ограничением HISTORY_TIMEOUT"""
+    return await asyncio.wait_for(
+        userbot_manager.load_bot_history(
+            bot_id=bot_id,
+            bot_username=bot_username,
+            days=days
+        ),
+        HISTORY_TIMEOUT
+    )
 
 
-@app.route('/load-history', methods=['POST'])
-def load_history():
+def _log_history_failure(task: asyncio.Task):
+    """Ошибка фоновой загрузки попадает в лог, даже если состояние никто не запросит"""
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Загрузка истории (%s) завершилась ошибкой: %r", task.get_name(), task.exception())
+
+
+async def load_history(request: web.Request):
     """
-    Загрузить историю сообщений от бота
+    Запустить загрузку истории сообщений от бота
+
+    Загрузка идёт фоновой задачей (до USERBOT_HISTORY_TIMEOUT секунд) и не
+    прерывается, если клиент закрыл соединение; повторный запрос для того же
+    бота, пока она идёт, присоединяется к ней. Результат - GET /load-history.
 
     Request body:
     {
@@ -396,92 +380,168 @@ def load_history():
         "days": 30  (optional, None = вся история)
     }
 
-    Response:
+    Response (202):
     {
         "success": true,
-        "loaded": 150,  # Всего загружено из Telegram
-        "saved": 120,   # Сохранено в БД (новых)
-        "skipped": 30,  # Пропущено (дубликаты)
-        "errors": 0     # Ошибок
+        "state": "running",
+        "progress": {...}  # см. history_loader.py, null до начала загрузки
     }
     """
-    try:
-        data = request.json
-
-        bot_id = data.get('bot_id')
-        bot_username = data.get('bot_username')
-        days = data.get('days')  # None = вся история
-
-        if not bot_id or not bot_username:
-            return jsonify({
-                'success': False,
-                'error': 'Требуется bot_id и bot_username'
-            }), 400
-
-        # Вызвать загрузку истории через userbot_manager
-        result = run_async(
-            userbot_manager.load_bot_history(
-                bot_id=bot_id,
-                bot_username=bot_username,
-                days=days
-            )
-        )
+    data = await _read_json(request)
 
-        if 'error_message' in result:
-            return jsonify({
-                'success': False,
-                'error': result['error_message'],
-                **result
-            }), 500
+    bot_id = data.get('bot_id')
+    bot_username = data.get('bot_username')
+    days = data.get('days')  # None = вся история
 
-        return jsonify({
-            'success': True,
-            **result
-        }), 200
+    if not bot_id or not bot_username:
+        return web.json_response({
+            'success': False,
+            'error': 'Требуется bot_id и bot_username'
+        }, status=400)
 
-    except Exception as e:
-        return jsonify({
+    key = str(bot_id)
+    tasks = request.app[HISTORY_TASKS]
+    task = tasks.get(key)
+    if task is None or task.done():
+        task = asyncio.create_task(_run_history(bot_id, bot_username, days), name=f'history-{key}')
+        task.add_done_callback(_log_history_failure)
+        tasks[key] = task
+
+    return web.json_response({
+        'success': True,
+        'state': 'running',
+        'progress': userbot_manager.history_progress.get(key)
+    }, status=202)
+
+
+async def history_status(request: web.Request):
+    """
+    Состояние загрузки истории
+
+    Query params:
+        bot_id: int - id бота
+
+    Response:
+    {
+        "success": true,
+        "state": "running" | "done" | "failed",
+        "progress": {...},
+        "loaded": 150, "saved": 120, "skipped": 30, "errors": 0  # когда state = done
+    }
+    """
+    key = request.query.get('bot_id')
+    task = request.app[HISTORY_TASKS].get(key) if key else None
+    if task is None:
+        return web.json_response({
             'success': False,
-            'error': str(e)
-        }), 500
+            'error': 'Загрузка истории для бота не запускалась'
+        }, status=404)
+
+    progress = userbot_manager.history_progress.get(key)
+    if not task.done():
+        return web.json_response({'success': True, 'state': 'running', 'progress': progress})
+
+    if task.cancelled():
+        result = {'error_message': 'Загрузка истории отменена'}
+    elif isinstance(task.exception(), asyncio.TimeoutError):
+        result = {'error_message': 'Таймаут загрузки истории'}
+    elif task.exception() is not None:
+        result = {'error_message': str(task.exception())}
+    else:
+        result = task.result()
+
+    if 'error_message' in result:
+        return web.json_response({
+            'success': False,
+            'state': 'failed',
+            'error': result['error_message'],
+            'progress': progress,
+            **result
+        })
 
+    return web.json_response({
+        'success': True,
+        'state': 'done',
+        'progress': progress,
+        **result
+    })
 
-if __name__ == '__main__':
-    print("🚀 Userbot Service starting...")
-    print(f"📡 Будет мониторить ботов с ID: {config.MONITOR_BOT_IDS}")
-    print(f"🎯 Будет пересылать в бот: {config.OUR_BOT_ID}")
-    print(f"🌐 API доступен на http://{config.FLASK_HOST}:{config.FLASK_PORT}")
 
-    # Инициализируем userbot
-    run_async(userbot_manager.initialize())
+async def on_startup(app: web.Application):
+    """Инициализация userbot и автозапуск, если session уже авторизована"""
+    await userbot_manager.initialize()
 
-    # Пытаемся автоматически запустить userbot если уже авторизован
     try:
         print("🔍 Проверка авторизации для автозапуска...")
-        status = run_async(userbot_manager.get_status())
+        status = await userbot_manager.get_status()
         print(f"📊 Статус: {status}")
 
         if status.get('authorized'):
             print("✅ Userbot уже авторизован, запускаем мониторинг...")
-            run_async(userbot_manager.start())
+            await userbot_manager.start()
 
             # Запускаем в фоновом режиме
             print("🚀 Запуск run_until_disconnected в фоне...")
-            asyncio.run_coroutine_threadsafe(
-                userbot_manager.run_until_disconnected(),
-                loop
-            )
+            _start_monitoring(app)
             print("✅ Userbot запущен и мониторит каналы!")
         else:
             print("⚠️ Userbot не авторизован. Требуется вызвать POST /login и POST /start")
     except Exception as e:
-        import traceback
         print(f"❌ Автозапуск не удался: {e}")
         print(f"🔍 Traceback:\n{traceback.format_exc()}")
 
-    # Запускаем Flask
-    app.run(
+
+async def on_cleanup(app: web.Application):
+    """Остановка userbot при завершении сервера"""
+    history_tasks = list(app[HISTORY_TASKS].values())
+    for task in history_tasks:
+        task.cancel()
+    await asyncio.gather(*history_tasks, return_exceptions=True)
+    await userbot_manager.stop()
+    task = app.get('monitor_task')
+    if task is not None:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+def create_app(autostart: bool = True) -> web.Application:
+    """
+    Собирает приложение aiohttp
+
+    Args:
+        autostart: bool - инициализировать userbot при старте сервера
+    """
+    app = web.Application(middlewares=[cors_middleware, error_middleware])
+    app[HISTORY_TASKS] = {}
+    app.router.add_get('/health', health)
+    app.router.add_get('/debug/trace', debug_trace)
+    app.router.add_get('/status', get_status)
+    app.router.add_post('/login', login)
+    app.router.add_post('/start', start_userbot)
+    app.router.add_post('/stop', stop_userbot)
+    app.router.add_post('/logout', logout)
+    app.router.add_post('/message-text', message_text)
+    app.router.add_get('/messages', fetch_messages)
+    app.router.add_post('/chat-meta', chat_meta)
+    app.router.add_post('/load-history', load_history)
+    app.router.add_get('/load-history', history_status)
+    if autostart:
+        app.on_startup.append(on_startup)
+        app.on_cleanup.append(on_cleanup)
+    return app
+
+
+if __name__ == '__main__':
+    print("🚀 Userbot Service starting...")
+    print(f"📡 Будет мониторить ботов с ID: {config.MONITOR_BOT_IDS}")
+    print(f"🎯 Будет пересылать в бот: {config.OUR_BOT_ID}")
+    print(f"🌐 API доступен на http://{config.FLASK_HOST}:{config.FLASK_PORT}")
+
+    # handler_cancellation: обрыв соединения отменяет обработчик и вызов userbot
+    web.run_app(
+        create_app(),
         host=config.FLASK_HOST,
         port=config.FLASK_PORT,
-        debug=config.FLASK_DEBUG
+        handler_cancellation=True,
+        print=None
     )
@@ -31,7 +31,7 @@ BACKEND_URL = os.getenv('BACKEND_URL', 'http://backend:3001')
 SESSION_DIR = '/app/sessions'
 SESSION_NAME = 'userbot_session'
 
-# Flask settings
+# HTTP API settings (имена FLASK_* сохранены для совместимости)
 FLASK_HOST = '0.0.0.0'
 FLASK_PORT = 5001
 FLASK_DEBUG = os.getenv('FLASK_ENV', 'production') == 'development'
@@ -0,0 +1,203 @@
+"""
+Userbot: кэш сущностей Telegram (InputPeer, метаданные чатов, свой профиль)
+
+Два уровня:
+1. LRU в памяти с TTL на запись
+2. JSON-файл в SESSION_DIR - кэш переживает перезапуск контейнера
+
+Неудачные разрешения (сущность не найдена) кэшируются коротко
+(USERBOT_ENTITY_NEGATIVE_TTL), чтобы UI не повторял заведомо
+безуспешные запросы get_entity.
+
+access_hash действителен только для аккаунта, который его получил:
+при выходе из аккаунта кэш очищается (clear).
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from telethon.tl.types import InputPeerChannel, InputPeerChat, InputPeerSelf, InputPeerUser
+
+ENTITY_CACHE_SIZE = int(os.getenv('USERBOT_ENTITY_CACHE_SIZE', '2048'))
+ENTITY_TTL = int(os.getenv('USERBOT_ENTITY_TTL', str(24 * 3600)))
+ENTITY_NEGATIVE_TTL = int(os.getenv('USERBOT_ENTITY_NEGATIVE_TTL', '60'))
+
+# Задержка записи файла после изменения (изменения пачкой - одна запись)
+SAVE_DELAY_SEC = 2.0
+
+logger = logging.getLogger('userbot.entity_cache')
+
+
+class CachedLookupError(ValueError):
+    """Сущность не найдена (закэшированный отрицательный результат)"""
+
+
+def peer_to_dict(peer) -> Optional[dict]:
+    """InputPeer -> сериализуемый dict; None для типов, которые не кэшируются"""
+    if isinstance(peer, InputPeerUser):
+        return {'type': 'user', 'id': peer.user_id, 'access_hash': peer.access_hash}
+    if isinstance(peer, InputPeerChannel):
+        return {'type': 'channel', 'id': peer.channel_id, 'access_hash': peer.access_hash}
+    if isinstance(peer, InputPeerChat):
+        return {'type': 'chat', 'id': peer.chat_id}
+    if isinstance(peer, InputPeerSelf):
+        return {'type': 'self'}
+    return None
+
+
+def peer_from_dict(value: dict):
+    """Обратное к peer_to_dict"""
+    kind = value['type']
+    if kind == 'user':
+        return InputPeerUser(value['id'], value['access_hash'])
+    if kind == 'channel':
+        return InputPeerChannel(value['id'], value['access_hash'])
+    if kind == 'chat':
+        return InputPeerChat(value['id'])
+    return InputPeerSelf()
+
+
+class EntityCache:
+    """
+    LRU-кэш с TTL и сохранением в JSON-файл
+
+    Значения - сериализуемые в JSON dict/list/str/числа.
+
+    Args:
+        path: str - путь к файлу кэша (None - только память)
+        max_size: int - максимум записей
+        ttl: int - время жизни записи по умолчанию, сек
+        negative_ttl: int - время жизни отрицательной записи, сек
+    """
+
+    def __init__(self, path: Optional[str] = None, max_size: int = ENTITY_CACHE_SIZE,
+                 ttl: int = ENTITY_TTL, negative_ttl: int = ENTITY_NEGATIVE_TTL):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # key -> (expires_at: float (unix time), value, error: str | None)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._save_task: Optional[asyncio.Task] = None
+        self._stats = {'hits': 0, 'misses': 0, 'negative_hits': 0}
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as fp:
+                rows = json.load(fp)
+        except Exception as e:
+            logger.warning("Кэш сущностей не прочитан (%s): %s", self.path, e)
+            return
+        now = time.time()
+        for key, expires_at, value, error in rows:
+            if expires_at > now:
+                self._entries[key] = (expires_at, value, error)
+        logger.info("Кэш сущностей загружен: %s записей", len(self._entries))
+
+    def get(self, key):
+        """
+        Значение из кэша
+
+        Returns:
+            значение или None (нет записи / истекла)
+
+        Raises:
+            CachedLookupError: закэширован отрицательный результат
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            expires_at, value, error = entry
+            if error is not None:
+                self._stats['negative_hits'] += 1
+                raise CachedLookupError(error)
+            self._stats['hits'] += 1
+            return value
+
+    def set(self, key, value, ttl: Optional[int] = None):
+        """Сохраняет значение на ttl секунд (по умолчанию self.ttl)"""
+        self._put(key, (time.time() + (ttl or self.ttl), value, None))
+
+    def set_negative(self, key, error: str):
+        """Запоминает неудачу разрешения на negative_ttl секунд"""
+        self._put(key, (time.time() + self.negative_ttl, None, str(error)))
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+        self._schedule_save()
+
+    def clear(self):
+        """Очищает кэш и удаляет файл (смена аккаунта)"""
+        with self._lock:
+            self._entries.clear()
+        if self.path and os.path.exists(self.path):
+            try:
+                os.remove(self.path)
+            except OSError as e:
+                logger.warning("Файл кэша сущностей не удалён: %s", e)
+
+    def _put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        self._schedule_save()
+
+    def _schedule_save(self):
+        if not self.path:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.save()
+            return
+        if self._save_task is None or self._save_task.done():
+            self._save_task = loop.create_task(self._delayed_save())
+
+    async def _delayed_save(self):
+        await asyncio.sleep(SAVE_DELAY_SEC)
+        await asyncio.get_running_loop().run_in_executor(None, self.save)
+
+    def save(self):
+        """Записывает кэш в файл (атомарно, через временный файл)"""
+        if not self.path:
+            return
+        now = time.time()
+        with self._lock:
+            # Отрицательные записи короткие - на диск не пишутся
+            rows = [
+                [key, expires_at, value, None]
+                for key, (expires_at, value, error) in self._entries.items()
+                if error is None and expires_at > now
+            ]
+        tmp_path = f'{self.path}.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as fp:
+                json.dump(rows, fp, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.warning("Кэш сущностей не сохранён (%s): %s", self.path, e)
+
+    def stats(self) -> dict:
+        with self._lock:
+            result = dict(self._stats)
+            result['size'] = len(self._entries)
+        return result
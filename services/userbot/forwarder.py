@@ -0,0 +1,411 @@
+"""
+Userbot: пересылка сообщений банковских ботов в наш бот (OUR_BOT_ID)
+
+- Склейка: сообщения одного бота, пришедшие в пределах
+  USERBOT_FORWARD_WINDOW_MS, уходят одним forward_messages (до 100 id)
+- Token bucket: не больше USERBOT_FORWARD_RATE запросов в секунду
+  (всплеск до USERBOT_FORWARD_BURST) - ниже лимитов Telegram для аккаунта
+- FloodWait: короткий (до USERBOT_FORWARD_MAX_WAIT_SEC) - bucket ждёт указанное
+  Telegram время и пересылка повторяется; длинный - пачка и всё, что придёт
+  до его конца, сразу уходит в userbot_forward_queue с повтором после него,
+  так что очередь в памяти не стоит и не сдерживает приём сообщений
+- Таблица userbot_forward_queue - устойчивая очередь повторов с
+  экспоненциальной задержкой; туда же уходят ошибки и несделанное при остановке.
+  Строки не удаляются при выборке: им продлевается next_attempt_at на время
+  аренды (USERBOT_FORWARD_LEASE_SEC), удаляются они после успешной отправки -
+  упавший процесс не теряет пересылки (возможен повтор уже отправленного)
+
+Если сообщение нельзя переслать (удалено, закрыт доступ), отправляется его текст;
+отправленное так помечается и при повторе пачки не отправляется второй раз.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, List, Optional
+
+from telethon.errors import FloodWaitError, MessageIdInvalidError
+
+FORWARD_RATE = float(os.getenv('USERBOT_FORWARD_RATE', '1'))
+FORWARD_BURST = int(os.getenv('USERBOT_FORWARD_BURST', '5'))
+FORWARD_WINDOW_MS = int(os.getenv('USERBOT_FORWARD_WINDOW_MS', '300'))
+FORWARD_MAX_WAIT_SEC = int(os.getenv('USERBOT_FORWARD_MAX_WAIT_SEC', '60'))
+FORWARD_QUEUE_SIZE = int(os.getenv('USERBOT_FORWARD_QUEUE_SIZE', '5000'))
+FORWARD_RETRY_INTERVAL_SEC = float(os.getenv('USERBOT_FORWARD_RETRY_INTERVAL_SEC', '15'))
+FORWARD_MAX_ATTEMPTS = int(os.getenv('USERBOT_FORWARD_MAX_ATTEMPTS', '10'))
+FORWARD_DRAIN_SEC = float(os.getenv('USERBOT_FORWARD_DRAIN_SEC', '5'))
+FORWARD_LEASE_SEC = int(os.getenv('USERBOT_FORWARD_LEASE_SEC', '600'))
+
+# Лимит Telegram на число сообщений в одном forward_messages
+MAX_BATCH = 100
+
+# Задержка повтора: RETRY_BASE_SEC * 2^attempts, не больше RETRY_MAX_SEC
+RETRY_BASE_SEC = 10
+RETRY_MAX_SEC = 3600
+
+LATENCY_WINDOW = 512
+
+PERSIST_SQL = """INSERT INTO userbot_forward_queue (chat_id, message_id, text, attempts, next_attempt_at, last_error)
+    VALUES ($1, $2, $3, $4, $5, $6)
+    ON CONFLICT (chat_id, message_id) DO UPDATE
+    SET attempts = EXCLUDED.attempts,
+        next_attempt_at = EXCLUDED.next_attempt_at,
+        last_error = EXCLUDED.last_error,
+        updated_at = NOW()"""
+
+CLAIM_SQL = """UPDATE userbot_forward_queue
+    SET next_attempt_at = NOW() + make_interval(secs => $2),
+        updated_at = NOW()
+    WHERE id IN (
+        SELECT id FROM userbot_forward_queue
+        WHERE next_attempt_at IS NOT NULL AND next_attempt_at <= NOW()
+        ORDER BY next_attempt_at
+        LIMIT $1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING chat_id, message_id, text, attempts, created_at"""
+
+DONE_SQL = """DELETE FROM userbot_forward_queue
+    WHERE (chat_id, message_id) IN (SELECT * FROM unnest($1::text[], $2::text[]))"""
+
+BACKLOG_SQL = "SELECT COUNT(*) FROM userbot_forward_queue WHERE next_attempt_at IS NOT NULL"
+
+logger = logging.getLogger('userbot.forwarder')
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты запросов; pause() блокирует его целиком (короткий FloodWait)
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+
+class Forwarder:
+    """
+    Пересылка в наш бот с ограничением частоты и устойчивыми повторами
+
+    Args:
+        get_client: функция, возвращающая TelegramClient
+        resolve_peer: корутина chat_id -> InputPeer (кэшируемый resolve_entity)
+        target: id нашего бота
+        get_pool: корутина, возвращающая asyncpg.Pool (для очереди повторов)
+    """
+
+    def __init__(self, get_client: Callable, resolve_peer: Callable[[object], Awaitable], target,
+                 get_pool: Optional[Callable[[], Awaitable]] = None, rate: float = FORWARD_RATE,
+                 burst: int = FORWARD_BURST, window_ms: int = FORWARD_WINDOW_MS,
+                 max_wait: int = FORWARD_MAX_WAIT_SEC, queue_size: int = FORWARD_QUEUE_SIZE,
+                 retry_interval: float = FORWARD_RETRY_INTERVAL_SEC, lease: int = FORWARD_LEASE_SEC):
+        self.get_client = get_client
+        self.resolve_peer = resolve_peer
+        self.target = target
+        self.get_pool = get_pool
+        self.bucket = TokenBucket(rate, burst)
+        self.window = window_ms / 1000
+        self.max_wait = max_wait
+        self.retry_interval = retry_interval
+        self.lease = lease
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+        self._runner: Optional[asyncio.Task] = None
+        self._retrier: Optional[asyncio.Task] = None
+        self._latency = deque(maxlen=LATENCY_WINDOW)
+        self._in_flight = 0
+        self._durable_backlog = None
+        # Длинный FloodWait: до этого момента (monotonic) пересылки сразу откладываются в БД
+        self._flooded_until = 0.0
+        # Строки userbot_forward_queue, взятые в работу (ключ - (chat_id, message_id))
+        self._leased = set()
+        self._stats = {
+            'forwarded': 0,
+            'requests': 0,
+            'fallback_sends': 0,
+            'flood_waits': 0,
+            'flood_wait_seconds': 0,
+            'deferred': 0,
+            'errors': 0,
+            'persisted': 0,
+            'retried': 0,
+            'dead': 0,
+        }
+
+    def start(self):
+        """Запускает отправку и периодический разбор очереди повторов (идемпотентно)"""
+        if self._runner is None or self._runner.done():
+            self._runner = asyncio.create_task(self._run(), name='userbot-forwarder')
+        if self.get_pool and (self._retrier is None or self._retrier.done()):
+            self._retrier = asyncio.create_task(self._retry_loop(), name='userbot-forward-retry')
+
+    async def submit(self, chat_id, message_id, text, attempts=0, enqueued_at=None, queued=False):
+        """
+        Ставит сообщение на пересылку; ждёт, если очередь заполнена
+
+        Args:
+            queued: bool - сообщение взято из userbot_forward_queue (строку удалить после отправки)
+        """
+        if self._runner is None or self._runner.done():
+            self.start()
+        await self.queue.put({
+            'chat_id': str(chat_id),
+            'message_id': str(message_id),
+            'text': text,
+            'attempts': attempts,
+            'enqueued_at': enqueued_at or time.time(),
+            'queued': queued,
+            'delivered': False,
+        })
+
+    async def close(self, drain_timeout: float = FORWARD_DRAIN_SEC):
+        """
+        Дообрабатывает очередь (не дольше drain_timeout), остаток сохраняет в БД
+        """
+        if self._retrier is not None:
+            self._retrier.cancel()
+            await asyncio.gather(self._retrier, return_exceptions=True)
+            self._retrier = None
+        if self._runner is not None and not self._runner.done():
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout=drain_timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Пересылка не успела за %sс, остаток (%s) сохраняется в БД",
+                               drain_timeout, self.queue.qsize())
+            self._runner.cancel()
+            await asyncio.gather(self._runner, return_exceptions=True)
+        self._runner = None
+
+        leftover = []
+        while not self.queue.empty():
+            leftover.append(self.queue.get_nowait())
+            self.queue.task_done()
+        if leftover:
+            await self._persist(leftover, 'shutdown', delay=0, failed=False)
+
+    async def _run(self):
+        while True:
+            first = await self.queue.get()
+            batch = [first]
+            # Окно склейки: собираем всё, что придёт за window секунд
+            deadline = time.monotonic() + self.window
+            while len(batch) < MAX_BATCH * 4:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout=remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            groups = {}
+            for item in batch:
+                groups.setdefault(item['chat_id'], []).append(item)
+            chunks = deque(
+                (chat_id, items[start:start + MAX_BATCH])
+                for chat_id, items in groups.items()
+                for start in range(0, len(items), MAX_BATCH)
+            )
+            try:
+                while chunks:
+                    await self._send(*chunks[0])
+                    chunks.popleft()
+            except asyncio.CancelledError:
+                # Остановка посреди отправки: неотправленное сохраняется для повтора
+                await self._persist([item for _, items in chunks for item in items], 'shutdown', delay=0, failed=False)
+                raise
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def _send(self, chat_id, items: List[dict]):
+        """Одна пачка сообщений одного бота: forward_messages с учётом FloodWait"""
+        self._in_flight = len(items)
+        try:
+            while True:
+                flooded = self._flooded_until - time.monotonic()
+                if flooded > 0 and self.get_pool:
+                    # Идёт длинный FloodWait: не ждём его, откладываем в БД до его конца
+                    self._stats['deferred'] += len(items)
+                    await self._persist(items, 'FloodWait', delay=flooded, failed=False)
+                    return
+                await self.bucket.acquire()
+                try:
+                    self._stats['requests'] += 1
+                    await self._forward(chat_id, items)
+                    break
+                except FloodWaitError as flood:
+                    self._stats['flood_waits'] += 1
+                    self._stats['flood_wait_seconds'] += flood.seconds
+                    if flood.seconds > self.max_wait and self.get_pool:
+                        logger.warning("FloodWait %sс при пересылке, %s сообщений отложено",
+                                       flood.seconds, len(items))
+                        self._flooded_until = time.monotonic() + flood.seconds + 1
+                        await self._persist(items, f'FloodWait {flood.seconds}s', delay=flood.seconds + 1)
+                        return
+                    self.bucket.pause(flood.seconds + 1)
+                    logger.info("FloodWait %sс при пересылке, ждём", flood.seconds)
+                except Exception as forward_error:
+                    self._stats['errors'] += 1
+                    logger.error("Ошибка пересылки (%s сообщений): %s", len(items), forward_error)
+                    await self._persist(items, str(forward_error))
+                    return
+
+            now = time.time()
+            self._stats['forwarded'] += len(items)
+            for item in items:
+                item['delivered'] = True
+                self._latency.append(now - item['enqueued_at'])
+        finally:
+            await self._release(items)
+            self._in_flight = 0
+
+    async def _forward(self, chat_id, items: List[dict]):
+        client = self.get_client()
+        peer = await self.resolve_peer(chat_id)
+        pending = [item for item in items if not item['delivered']]
+        if not pending:
+            return
+        try:
+            await client.forward_messages(self.target, [int(item['message_id']) for item in pending],
+                                          from_peer=peer)
+        except MessageIdInvalidError:
+            # Переслать нельзя (удалено/закрыто) - отправляем текст, как раньше.
+            # Отправленное помечается: повтор пачки после FloodWait/ошибки его пропустит
+            for item in pending:
+                if item['text']:
+                    await self.bucket.acquire()
+                    await client.send_message(self.target, item['text'])
+                    self._stats['fallback_sends'] += 1
+                item['delivered'] = True
+
+    async def _release(self, items: List[dict]):
+        """Удаляет из userbot_forward_queue доставленные строки и снимает с них аренду"""
+        done = [item for item in items if item['queued'] and item['delivered']]
+        for item in items:
+            if item['queued']:
+                self._leased.discard((item['chat_id'], item['message_id']))
+        if not done or not self.get_pool:
+            return
+        try:
+            pool = await self.get_pool()
+            async with pool.acquire() as conn:
+                await conn.execute(DONE_SQL, [item['chat_id'] for item in done],
+                                   [item['message_id'] for item in done])
+        except Exception as db_error:
+            # Строки вернутся после аренды - пересылка повторится
+            logger.error("Не удалось удалить %s пересылок из очереди повторов: %s", len(done), db_error)
+
+    async def _persist(self, items: List[dict], error: str, delay: Optional[float] = None,
+                       failed: bool = True):
+        """
+        Сохраняет сообщения в userbot_forward_queue с задержкой повтора
+
+        Args:
+            delay: float - задержка повтора, сек (по умолчанию - экспоненциальная по числу попыток)
+            failed: bool - считать ли это неудачной попыткой (остановка - не считается)
+        """
+        if not self.get_pool:
+            logger.error("Очередь повторов не настроена, %s пересылок потеряно: %s", len(items), error)
+            return
+        rows = []
+        for item in items:
+            if item['delivered']:
+                # Текст уже отправлен (MessageIdInvalid) - повторять нечего
+                continue
+            attempts = item['attempts'] + (1 if failed else 0)
+            if attempts > FORWARD_MAX_ATTEMPTS:
+                next_attempt_at = None
+                self._stats['dead'] += 1
+            else:
+                wait = delay if delay is not None else min(RETRY_BASE_SEC * 2 ** (attempts - 1), RETRY_MAX_SEC)
+                next_attempt_at = datetime.now(timezone.utc) + timedelta(seconds=wait)
+            rows.append((item['chat_id'], item['message_id'], item['text'], attempts, next_attempt_at, error))
+        if not rows:
+            return
+        try:
+            pool = await self.get_pool()
+            async with pool.acquire() as conn:
+                await conn.executemany(PERSIST_SQL, rows)
+            self._stats['persisted'] += len(rows)
+        except Exception as db_error:
+            logger.error("Не удалось сохранить %s пересылок в очередь повторов: %s", len(rows), db_error)
+
+    async def _retry_loop(self):
+        while True:
+            await asyncio.sleep(self.retry_interval)
+            try:
+                await self.retry_due()
+            except asyncio.CancelledError:
+                raise
+            except Exception as retry_error:
+                logger.warning("Очередь повторов пересылки недоступна: %s", retry_error)
+
+    async def retry_due(self, limit: int = MAX_BATCH) -> int:
+        """
+        Забирает из userbot_forward_queue сообщения, срок повтора которых наступил
+
+        Returns:
+            int - сколько сообщений поставлено в очередь
+        """
+        pool = await self.get_pool()
+        # Ёмкость очереди в памяти: забираем не больше, чем поместится;
+        # во время длинного FloodWait не забираем вовсе
+        free = self.queue.maxsize - self.queue.qsize() if self.queue.maxsize else limit
+        if time.monotonic() < self._flooded_until:
+            free = 0
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(CLAIM_SQL, max(0, min(limit, free)), self.lease) if free > 0 else []
+            self._durable_backlog = await conn.fetchval(BACKLOG_SQL)
+        submitted = 0
+        for row in rows:
+            key = (row['chat_id'], row['message_id'])
+            if key in self._leased:
+                # Аренда истекла, пока строка ждала в памяти: она уже в очереди
+                continue
+            self._leased.add(key)
+            await self.submit(row['chat_id'], row['message_id'], row['text'], attempts=row['attempts'],
+                              enqueued_at=row['created_at'].timestamp(), queued=True)
+            submitted += 1
+        self._stats['retried'] += submitted
+        return submitted
+
+    def stats(self) -> dict:
+        latency = sorted(self._latency)
+        result = dict(self._stats)
+        result.update(
+            backlog=self.queue.qsize(),
+            in_flight=self._in_flight,
+            durable_backlog=self._durable_backlog,
+            latency_ms={
+                'avg': round(sum(latency) / len(latency) * 1000, 1),
+                'p95': round(latency[min(len(latency) - 1, int(len(latency) * 0.95))] * 1000, 1),
+                'max': round(latency[-1] * 1000, 1),
+            } if latency else None,
+        )
+        return result
@@ -4,6 +4,7 @@ History Loader for Telegram Userbot
 """
 
 from telethon import TelegramClient
+from telethon.errors import FloodWaitError
 from telethon.tl.types import PeerChannel, PeerChat, PeerUser
 from datetime import datetime, timedelta, timezone
 import asyncio
@@ -12,6 +13,11 @@ import os
 import logging
 from typing import List, Dict, Optional
 
+from services.userbot.forwarder import TokenBucket
+from services.userbot.message_store import (
+    Range, add_range, covering_range, load_ranges, lower_bound, merge_ranges
+)
+
 LOG_LEVEL = os.getenv('USERBOT_LOG_LEVEL', 'INFO').upper()
 logging.basicConfig(
     level=LOG_LEVEL,
@@ -19,12 +25,68 @@ logging.basicConfig(
 )
 logger = logging.getLogger('userbot.history_loader')
 
+# Потоковая загрузка: размер страницы записи и сколько страниц ждут в очереди
+HISTORY_PAGE_SIZE = int(os.getenv('USERBOT_HISTORY_PAGE_SIZE', '500'))
+HISTORY_QUEUE_PAGES = int(os.getenv('USERBOT_HISTORY_QUEUE_PAGES', '4'))
+
+# Загрузка нескольких ботов: одновременно, стартов попыток в секунду, повторов после FloodWait
+HISTORY_BOTS_CONCURRENCY = int(os.getenv('USERBOT_HISTORY_CONCURRENCY', '3'))
+HISTORY_BOTS_RATE = float(os.getenv('USERBOT_HISTORY_RATE', '1'))
+HISTORY_FLOOD_RETRIES = int(os.getenv('USERBOT_HISTORY_FLOOD_RETRIES', '3'))
+
+# Страница пишется COPY во временную таблицу (своя у каждого соединения,
+# очищается при COMMIT) и одним INSERT ... SELECT в bot_messages
+STAGING_TABLE = 'bot_messages_history_staging'
+STAGING_COLUMNS = ['bot_id', 'telegram_message_id', 'chat_id', 'message_id', 'timestamp', 'text']
+
+CREATE_STAGING_SQL = f"""CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} (
+    bot_id TEXT,
+    telegram_message_id TEXT,
+    chat_id TEXT,
+    message_id TEXT,
+    timestamp TIMESTAMPTZ,
+    text TEXT
+) ON COMMIT DELETE ROWS"""
+
+INSERT_FROM_STAGING_SQL = f"""INSERT INTO bot_messages
+    (bot_id, telegram_message_id, chat_id, message_id, timestamp, text, status, process_attempts)
+    SELECT bot_id, telegram_message_id, chat_id, message_id, timestamp, text, 'new', 0
+    FROM {STAGING_TABLE}
+    ON CONFLICT (chat_id, message_id) DO NOTHING
+    RETURNING 1"""
+
+OLDEST_DATE_SQL = """SELECT timestamp FROM bot_messages
+    WHERE chat_id = $1 AND message_num >= $2
+    ORDER BY message_num
+    LIMIT 1"""
+
+INSERT_ROW_SQL = """INSERT INTO bot_messages
+    (bot_id, telegram_message_id, chat_id, message_id, timestamp, text, status, process_attempts)
+    VALUES ($1, $2, $3, $4, $5, $6, 'new', 0)
+    ON CONFLICT (chat_id, message_id) DO NOTHING
+    RETURNING 1"""
+
+
+def _merge_results(total: Optional[Dict], result: Dict) -> Dict:
+    """Сложить результат очередной попытки с предыдущими (ошибка FloodWait прошлой попытки не считается)"""
+    if total is None:
+        return dict(result)
+    merged = dict(result)
+    for key in ('loaded', 'saved', 'skipped', 'errors'):
+        merged[key] = total[key] + result[key]
+    if 'flood_wait' in total:
+        merged['errors'] -= 1
+    return merged
+
 
 class HistoryLoader:
     """Загрузчик истории сообщений от ботов"""
 
-    def __init__(self, client: TelegramClient, db_pool: Optional[asyncpg.Pool] = None):
+    def __init__(self, client: TelegramClient, db_pool: Optional[asyncpg.Pool] = None,
+                 progress: Optional[Dict] = None):
         self.client = client
+        # Прогресс загрузок по bot_id (общий dict владельца - виден в /health)
+        self.progress = progress if progress is not None else {}
         self.db_pool = db_pool
         self._own_pool = db_pool is None
         self.db_timeout = float(os.getenv('USERBOT_DB_TIMEOUT_SECONDS', '5'))
@@ -55,101 +117,336 @@ class HistoryLoader:
     ) -> Dict:
         """
         Загрузить историю сообщений от бота
+
+        Инкрементально: состояние синхронизации - полные диапазоны id в
+        bot_message_ranges (общие с /messages). Сначала запрашиваются только
+        сообщения новее верхнего диапазона (min_id), затем пропуски вниз до
+        границы days или начала чата. Уже сохранённое повторно не скачивается.
+
+        Потоково: iter_messages складывает страницы по HISTORY_PAGE_SIZE в
+        ограниченную очередь (HISTORY_QUEUE_PAGES), параллельный писатель
+        сохраняет их в БД и после каждой страницы расширяет диапазон -
+        это контрольная точка: прерванная загрузка продолжится с неё.
         """
-        messages_data = []
+        chat_id = str(bot_id)
         cutoff_date = datetime.now(timezone.utc) - timedelta(days=days) if days else None
+        progress = {
+            'bot_id': chat_id,
+            'bot_username': bot_username,
+            'state': 'running',
+            'loaded': 0,
+            'saved': 0,
+            'skipped': 0,
+            'errors': 0,
+            'pages_written': 0,
+            'segments': 0,
+            'checkpoint_id': None,
+            'oldest_date': None,
+            'started_at': datetime.now(timezone.utc).isoformat(),
+            'finished_at': None,
+        }
+        self.progress[chat_id] = progress
+
+        pages: asyncio.Queue = asyncio.Queue(maxsize=HISTORY_QUEUE_PAGES)
+        writer = asyncio.create_task(self._write_pages(chat_id, pages, progress), name=f'history-writer-{bot_id}')
+        error_message = None
+        flood_wait = None
 
         try:
             logger.info("Загрузка истории от %s (bot_id=%s)...", bot_username, bot_id)
             bot_entity = await self._resolve_entity(bot_id, bot_username)
+            ranges = await self._load_ranges(chat_id)
+
+            cursor = None
+            remaining = limit
+            while remaining is None or remaining > 0:
+                if cursor is not None:
+                    if cursor < 1:
+                        break
+                    covered = covering_range(ranges, cursor)
+                    if covered:
+                        low, _, reaches_start = covered
+                        if reaches_start or await self._older_than(chat_id, low, cutoff_date):
+                            break
+                        cursor = low - 1
+                        continue
+
+                floor = lower_bound(ranges, cursor)
+                segment = await self._fetch_segment(bot_entity, pages, progress, cursor, floor,
+                                                    remaining, cutoff_date)
+                progress['segments'] += 1
+                if segment['range']:
+                    ranges = merge_ranges(ranges + [segment['range']])
+                if remaining is not None:
+                    remaining -= segment['seen']
+                if not segment['complete'] or floor == 0:
+                    break
+                cursor = floor
+
+            logger.info("Загружено %s сообщений от %s", progress['loaded'], bot_username)
+
+        except asyncio.CancelledError:
+            self._cancel_writer(writer, progress)
+            raise
+        except FloodWaitError as e:
+            # Дольше flood_sleep_threshold клиента - решает вызывающий (load_all_bots_history)
+            logger.warning("История %s: FloodWait %s сек", bot_username, e.seconds)
+            error_message = str(e)
+            flood_wait = e.seconds
+        except Exception as e:
+            logger.error("Ошибка загрузки истории от %s: %s", bot_username, e)
+            error_message = str(e)
 
-            message_count = 0
+        try:
+            await pages.put(None)
+            await writer
+        except asyncio.CancelledError:
+            self._cancel_writer(writer, progress)
+            raise
+
+        progress['state'] = 'failed' if error_message else 'done'
+        progress['finished_at'] = datetime.now(timezone.utc).isoformat()
+
+        result = {
+            'loaded': progress['loaded'],
+            'saved': progress['saved'],
+            'skipped': progress['skipped'],
+            'errors': progress['errors'],
+            'sync': await self._sync_state(chat_id)
+        }
+        if error_message:
+            result['errors'] += 1
+            result['error_message'] = error_message
+        if flood_wait is not None:
+            result['flood_wait'] = flood_wait
+        return result
+
+    async def _fetch_segment(self, entity, pages: asyncio.Queue, progress: Dict, cursor: Optional[int],
+                             floor: int, limit: Optional[int], cutoff_date: Optional[datetime]) -> Dict:
+        """
+        Выборка одного пропуска: id от cursor (None - с самого нового) вниз до floor
+
+        Каждая страница уходит писателю вместе с диапазоном, который станет
+        полным после её записи. Неполная страница отправляется и при ошибке.
+
+        Returns:
+            {seen: int, complete: bool, range: (low, high, reaches_start) | None}
+        """
+        top = cursor
+        lowest = None
+        seen = 0
+        stopped = False
+        page = []
+
+        try:
             async for message in self.client.iter_messages(
-                bot_entity,
+                entity,
                 limit=limit,
+                offset_id=cursor + 1 if cursor is not None else 0,
+                min_id=floor,
                 reverse=False
             ):
                 if cutoff_date and message.date < cutoff_date:
-                    logger.info("Достигнута граница %s дней, остановка загрузки", days)
+                    logger.info("Достигнута граница %s, остановка загрузки", cutoff_date.date())
+                    stopped = True
                     break
 
+                if top is None:
+                    top = message.id
+                lowest = message.id
+                seen += 1
+
                 if message.text:
-                    messages_data.append({
-                        'bot_id': bot_id,
+                    page.append({
+                        'bot_id': progress['bot_id'],
                         'telegram_message_id': str(message.id),
                         'text': message.text,
                         'timestamp': message.date or datetime.now(timezone.utc)
                     })
-                    message_count += 1
-                    if message_count % 50 == 0:
-                        logger.info("Загружено %s сообщений", message_count)
-
-            logger.info("Загружено %s сообщений от %s", len(messages_data), bot_username)
-            result = await self._save_messages_to_db(messages_data)
+                    progress['loaded'] += 1
+                    if len(page) >= HISTORY_PAGE_SIZE:
+                        progress['oldest_date'] = page[-1]['timestamp'].isoformat()
+                        # Очередь полна - ждём писателя (память не растёт)
+                        await pages.put((page, (lowest, top, False)))
+                        page = []
+        except Exception:
+            # Всё от top до lowest уже просмотрено - эта часть тоже контрольная точка
+            if page:
+                progress['oldest_date'] = page[-1]['timestamp'].isoformat()
+            await pages.put((page, (lowest, top, False) if lowest is not None else None))
+            raise
+
+        complete = not stopped and (limit is None or seen < limit)
+        segment_range = None
+        if complete and top is not None:
+            segment_range = (floor + 1, top, floor == 0)
+        elif lowest is not None:
+            segment_range = (lowest, top, False)
+
+        if page:
+            progress['oldest_date'] = page[-1]['timestamp'].isoformat()
+        await pages.put((page, segment_range))
+        return {'seen': seen, 'complete': complete, 'range': segment_range}
+
+    @staticmethod
+    def _cancel_writer(writer: asyncio.Task, progress: Dict):
+        writer.cancel()
+        progress['state'] = 'cancelled'
+        progress['finished_at'] = datetime.now(timezone.utc).isoformat()
+
+    async def _write_pages(self, chat_id: str, pages: asyncio.Queue, progress: Dict):
+        """
+        Писатель: сохраняет страницы из очереди, пока не придёт None
 
-            return {
-                'loaded': len(messages_data),
-                'saved': result['saved'],
-                'skipped': result['skipped'],
-                'errors': result['errors']
-            }
+        После записанной страницы её диапазон отмечается полным. Если в
+        выборке были ошибки записи, её диапазоны больше не отмечаются -
+        следующая загрузка запросит этот участок снова.
+        """
+        failed_tops = set()
+        while True:
+            item = await pages.get()
+            if item is None:
+                return
+            page, checkpoint = item
+
+            result = {'saved': 0, 'skipped': 0, 'errors': 0}
+            if page:
+                try:
+                    result = await self._save_messages_to_db(page)
+                except Exception as e:
+                    logger.error("Ошибка записи страницы истории (%s сообщений): %s", len(page), e)
+                    result = {'saved': 0, 'skipped': 0, 'errors': len(page)}
+                progress['saved'] += result['saved']
+                progress['skipped'] += result['skipped']
+                progress['errors'] += result['errors']
+                progress['pages_written'] += 1
+
+            if checkpoint:
+                top = checkpoint[1]
+                if result['errors']:
+                    failed_tops.add(top)
+                if top not in failed_tops:
+                    try:
+                        await self._save_range(chat_id, checkpoint)
+                        progress['checkpoint_id'] = checkpoint[0]
+                    except Exception as e:
+                        failed_tops.add(top)
+                        logger.warning("История %s: контрольная точка не сохранена: %s", chat_id, e)
+
+            if page:
+                logger.info(
+                    "История %s: получено %s, сохранено %s, пропущено %s (очередь %s/%s)",
+                    progress['bot_username'], progress['loaded'], progress['saved'],
+                    progress['skipped'], pages.qsize(), pages.maxsize
+                )
+
+    async def _load_ranges(self, chat_id: str) -> List[Range]:
+        await self._ensure_db_pool()
+        async with self.db_pool.acquire() as conn:
+            return await load_ranges(conn, chat_id)
 
+    async def _save_range(self, chat_id: str, new_range: Range):
+        await self._ensure_db_pool()
+        async with self.db_pool.acquire() as conn:
+            async with conn.transaction():
+                await add_range(conn, chat_id, new_range)
+
+    async def _older_than(self, chat_id: str, low_id: int, cutoff_date: Optional[datetime]) -> bool:
+        """Самое старое сохранённое сообщение диапазона старше границы days"""
+        if not cutoff_date:
+            return False
+        await self._ensure_db_pool()
+        async with self.db_pool.acquire() as conn:
+            date = await conn.fetchval(OLDEST_DATE_SQL, chat_id, low_id)
+        if date is None:
+            return False
+        if date.tzinfo is None:
+            date = date.replace(tzinfo=timezone.utc)
+        return date < cutoff_date
+
+    async def _sync_state(self, chat_id: str) -> Dict:
+        """Верхний непрерывный диапазон: high_id, low_id, reaches_start"""
+        try:
+            ranges = await self._load_ranges(chat_id)
         except Exception as e:
-            logger.error("Ошибка загрузки истории от %s: %s", bot_username, e)
-            return {
-                'loaded': 0,
-                'saved': 0,
-                'skipped': 0,
-                'errors': 1,
-                'error_message': str(e)
-            }
+            logger.warning("История %s: не удалось прочитать состояние синхронизации: %s", chat_id, e)
+            ranges = []
+        if not ranges:
+            return {'high_id': None, 'low_id': None, 'reaches_start': False}
+        low, high, reaches_start = ranges[0]
+        return {'high_id': high, 'low_id': low, 'reaches_start': reaches_start}
 
     async def _save_messages_to_db(self, messages: List[Dict]) -> Dict:
         """
-        Сохранить сообщения в БД батчами (asyncpg)
+        Сохранить страницу сообщений в БД: COPY во временную таблицу и один
+        INSERT ... SELECT ... ON CONFLICT DO NOTHING RETURNING
+
+        Если пакетная запись не удалась (например, одна строка с плохими
+        данными), страница сохраняется построчно - ошибка остаётся у строки.
+
+        Returns:
+            {saved: int, skipped: int, errors: int}
         """
+        if not messages:
+            return {'saved': 0, 'skipped': 0, 'errors': 0}
+
         await self._ensure_db_pool()
 
+        records = [
+            (
+                str(msg['bot_id']),
+                str(msg['telegram_message_id']),
+                str(msg['bot_id']),
+                str(msg['telegram_message_id']),
+                msg['timestamp'],
+                msg['text'],
+            )
+            for msg in messages
+        ]
+
+        try:
+            async with self.db_pool.acquire() as conn:
+                async with conn.transaction():
+                    await conn.execute(CREATE_STAGING_SQL)
+                    await conn.copy_records_to_table(STAGING_TABLE, records=records, columns=STAGING_COLUMNS)
+                    inserted = await conn.fetch(INSERT_FROM_STAGING_SQL)
+        except Exception as e:
+            logger.warning("COPY страницы (%s сообщений) не удался, запись построчно: %s", len(records), e)
+            return await self._save_rows_individually(records)
+
+        saved = len(inserted)
+        skipped = len(records) - saved
+        logger.info("Сохранено: %s новых, %s пропущено", saved, skipped)
+        return {
+            'saved': saved,
+            'skipped': skipped,
+            'errors': 0
+        }
+
+    async def _save_rows_individually(self, records: List[tuple]) -> Dict:
+        """Построчная запись (запасной путь для _save_messages_to_db)"""
         saved = 0
         skipped = 0
         errors = 0
-        BATCH_SIZE = 100
-        sql = """INSERT INTO bot_messages
-                 (bot_id, telegram_message_id, chat_id, message_id, timestamp, text, status, process_attempts)
-                 VALUES ($1, $2, $3, $4, $5, $6, 'new', 0)
-                 ON CONFLICT (chat_id, message_id) DO NOTHING
-                 RETURNING 1"""
 
         try:
-            for i in range(0, len(messages), BATCH_SIZE):
-                batch = messages[i:i + BATCH_SIZE]
-                async with self.db_pool.acquire() as conn:
-                    for msg in batch:
-                        try:
-                            row = await conn.fetchrow(
-                                sql,
-                                str(msg['bot_id']),
-                                str(msg['telegram_message_id']),
-                                str(msg['bot_id']),
-                                str(msg['telegram_message_id']),
-                                msg['timestamp'],
-                                msg['text']
-                            )
-                            if row:
-                                saved += 1
-                            else:
-                                skipped += 1
-                        except Exception as e:
-                            logger.warning("Ошибка сохранения сообщения: %s", e)
-                            errors += 1
-                if i + BATCH_SIZE < len(messages):
-                    await asyncio.sleep(0.05)
+            async with self.db_pool.acquire() as conn:
+                for record in records:
+                    try:
+                        row = await conn.fetchrow(INSERT_ROW_SQL, *record)
+                        if row:
+                            saved += 1
+                        else:
+                            skipped += 1
+                    except Exception as e:
+                        logger.warning("Ошибка сохранения сообщения: %s", e)
+                        errors += 1
 
             logger.info("Сохранено: %s новых, %s пропущено, %s ошибок", saved, skipped, errors)
 
         except Exception as e:
             logger.error("Ошибка при сохранении батча: %s", e)
-            errors += len(messages) - saved - skipped
+            errors += len(records) - saved - skipped
 
         return {
             'saved': saved,
@@ -193,33 +490,55 @@ class HistoryLoader:
     async def load_all_bots_history(
         self,
         bots: List[Dict],
-        days: Optional[int] = 30
+        days: Optional[int] = 30,
+        concurrency: int = HISTORY_BOTS_CONCURRENCY
     ) -> Dict:
         """
         Загрузить историю от всех ботов
-        """
-        results = {}
-        total_loaded = 0
-        total_saved = 0
-
-        for bot in bots:
-            logger.info("Обработка бота: %s (%s)", bot.get('name'), bot.get('username'))
-
-            result = await self.load_bot_history(
-                bot_id=bot['id'],
-                bot_username=bot['username'],
-                days=days
-            )
 
-            results[bot['username']] = result
-            total_loaded += result['loaded']
-            total_saved += result['saved']
+        До concurrency ботов загружаются одновременно, ошибка одного бота не
+        прерывает остальные. Вместо фиксированной паузы между ботами - общий
+        TokenBucket: FloodWait любого бота приостанавливает старт новых
+        попыток у всех на указанное Telegram время, а сам бот повторяется
+        (загрузка продолжается с контрольной точки).
 
-            await asyncio.sleep(2)
+        Returns:
+            {total_loaded, total_saved, bots: {username: результат load_bot_history}}
+        """
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        pacer = TokenBucket(rate=HISTORY_BOTS_RATE, burst=max(1, concurrency))
+
+        async def load_one(bot: Dict) -> Dict:
+            async with semaphore:
+                logger.info("Обработка бота: %s (%s)", bot.get('name'), bot.get('username'))
+                total = None
+                for attempt in range(1, HISTORY_FLOOD_RETRIES + 2):
+                    await pacer.acquire()
+                    try:
+                        result = await self.load_bot_history(
+                            bot_id=bot['id'],
+                            bot_username=bot['username'],
+                            days=days
+                        )
+                    except Exception as e:
+                        logger.error("Ошибка загрузки истории от %s: %s", bot.get('username'), e)
+                        result = {'loaded': 0, 'saved': 0, 'skipped': 0, 'errors': 1, 'error_message': str(e)}
+
+                    total = _merge_results(total, result)
+                    flood_wait = result.get('flood_wait')
+                    if flood_wait is None or attempt > HISTORY_FLOOD_RETRIES:
+                        return total
+                    pacer.pause(flood_wait)
+                    logger.info("История %s: повтор %s после FloodWait %s сек",
+                                bot.get('username'), attempt, flood_wait)
+                return total
+
+        outcomes = await asyncio.gather(*(load_one(bot) for bot in bots))
+        results = {bot['username']: result for bot, result in zip(bots, outcomes)}
 
         return {
-            'total_loaded': total_loaded,
-            'total_saved': total_saved,
+            'total_loaded': sum(result['loaded'] for result in outcomes),
+            'total_saved': sum(result['saved'] for result in outcomes),
             'bots': results
         }
 
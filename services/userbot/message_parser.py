@@ -0,0 +1,155 @@
+"""
+Userbot: разбор сообщений банковских ботов до сохранения
+
+Известные форматы:
+- @CardXabarBot / HUMO: «💸 Оплата / ➖ сумма / 📍 продавец / 💳 карта / 🕓 время»
+- SMS Uzum Bank: «Spisanie, karta ***1234: ... Dostupno: ...»
+
+Разбор - в процессе userbot, в пуле потоков (не занимает event loop Telethon):
+классификаторы OCR-сервиса (classifiers.py, lexer.py, markers.py из
+USERBOT_OCR_DIR) импортируются напрямую, так что у форматов один парсер, а
+сетевого вызова на сообщение нет. Результат переводится в операции формата
+backend (parserService.postProcessData), backend создаёт по ним чек без
+повторного разбора и LLM. Сообщения других форматов разбирает backend.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+# Модули OCR-сервиса импортируются без пакета (как в самом сервисе); каталог
+# добавляется в конец sys.path, чтобы не перекрыть модули userbot
+OCR_DIR = os.getenv('USERBOT_OCR_DIR') or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ocr'
+)
+if OCR_DIR not in sys.path:
+    sys.path.append(OCR_DIR)
+
+from classifiers import classify_and_parse  # noqa: E402
+
+PARSE_WORKERS = int(os.getenv('USERBOT_PARSE_WORKERS', '2'))
+
+# Тексты длиннее не разбираются локально (выписки, рассылки)
+PARSE_MAX_LENGTH = int(os.getenv('USERBOT_PARSE_MAX_LENGTH', '4000'))
+
+# Классификаторы OCR-сервиса, результатам которых userbot доверяет -> metadata.parser
+BOT_CLASSIFIERS = {
+    'CardXabarClassifier': 'cardxabar',
+    'UzumSmsClassifier': 'uzumbank_sms',
+}
+
+# Время в сообщениях ботов - Asia/Tashkent (UTC+5, без перехода на летнее время)
+TASHKENT_TZ = timezone(timedelta(hours=5))
+
+logger = logging.getLogger('userbot.message_parser')
+
+_parse_executor = ThreadPoolExecutor(max_workers=PARSE_WORKERS, thread_name_prefix='userbot-parse')
+
+
+def to_operations(parsed: dict, message_date: Optional[datetime] = None) -> Optional[List[dict]]:
+    """
+    Операции формата backend из результата classify_and_parse OCR-сервиса
+
+    Args:
+        parsed: dict - {classifier, data, confidence}
+        message_date: datetime - время сообщения в Telegram (в SMS даты нет)
+
+    Returns:
+        list операций или None, если классификатор не из BOT_CLASSIFIERS
+    """
+    parser = BOT_CLASSIFIERS.get(parsed.get('classifier'))
+    if not parser:
+        return None
+
+    data = parsed['data']
+    if data.get('datetime'):
+        # Время в сообщении - местное (Asia/Tashkent), backend так его и трактует
+        stamp = datetime.strptime(data['datetime'], '%Y-%m-%d %H:%M:%S').strftime('%Y-%m-%dT%H:%M:%S')
+    else:
+        stamp = (message_date or datetime.now(timezone.utc)).isoformat()
+
+    operations = []
+    for item in data.get('operations') or [data]:
+        metadata = {'parser': parser}
+        if 'card_type' in data:
+            metadata['card_type'] = data['card_type']
+        if 'direction' in item:
+            metadata['direction'] = item['direction']
+            metadata['index'] = item['index']
+        operations.append({
+            'datetime': stamp,
+            'transactionType': item['transaction_type'],
+            'amount': item['amount'],
+            'currency': data.get('currency') or 'UZS',
+            'operator': item.get('operator') or '',
+            'cardLast4': item['card_last4'],
+            'balance': item.get('balance'),
+            'isIncome': bool(item.get('is_income')),
+            'isP2p': bool(item.get('is_p2p')),
+            'metadata': metadata,
+        })
+    return operations
+
+
+def parse_message_sync(text: str, message_date: Optional[datetime] = None) -> Optional[List[dict]]:
+    """
+    Разбирает сообщение классификаторами OCR-сервиса (в вызывающем потоке)
+
+    Args:
+        text: str - текст сообщения бота
+        message_date: datetime - время сообщения в Telegram
+
+    Returns:
+        list операций в формате backend или None - сообщение разберёт backend
+    """
+    if not text or len(text) > PARSE_MAX_LENGTH:
+        return None
+    try:
+        return to_operations(classify_and_parse(text), message_date)
+    except ValueError:
+        # Ни один классификатор не подошёл
+        return None
+    except Exception as e:
+        # Любой сбой разбора - сообщение уходит в backend как раньше
+        logger.warning("Локальный разбор сообщения не удался: %s", e)
+        return None
+
+
+async def parse_message(text: str, message_date: Optional[datetime] = None) -> Optional[List[dict]]:
+    """parse_message_sync в пуле потоков USERBOT_PARSE_WORKERS"""
+    if not text or len(text) > PARSE_MAX_LENGTH:
+        return None
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_parse_executor, parse_message_sync, text, message_date)
+
+
+def ui_payload(operations: List[dict]) -> dict:
+    """
+    Поля для bot_messages.data (как buildUiPayloadFromCheck в backend) по первой операции
+
+    В operations - все операции целиком: outbox передаёт их backend вместо текста
+    """
+    operation = operations[0]
+    amount = operation['amount'] if operation['isIncome'] else -operation['amount']
+    try:
+        dt = datetime.fromisoformat(operation['datetime'])
+        if dt.tzinfo is not None:
+            dt = dt.astimezone(TASHKENT_TZ)
+        date, time_ = dt.strftime('%d.%m.%Y'), dt.strftime('%H:%M')
+    except ValueError:
+        date = time_ = None
+    return {
+        'amount': amount,
+        'currency': operation['currency'],
+        'merchant': operation['operator'],
+        'card': operation['cardLast4'],
+        'date': date,
+        'time': time_,
+        'type': operation['transactionType'],
+        'parser': operation['metadata'].get('parser'),
+        'operations': operations,
+    }
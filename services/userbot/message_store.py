@@ -0,0 +1,337 @@
+"""
+Userbot: история чата для /messages из bot_messages с дозагрузкой пропусков
+
+Страница читается из БД по курсору (message_id < before). В Telegram идут
+только за диапазонами id, которых нет в bot_message_ranges; полученные
+сообщения записываются в bot_messages, а диапазон отмечается полным.
+
+Диапазон [low_id, high_id] полный - все текстовые сообщения чата с такими id
+есть в bot_messages. reaches_start - старше low_id сообщений нет.
+Верх чата полным не бывает: первая страница всегда спрашивает Telegram
+о сообщениях новее самого верхнего диапазона (обычно пустой ответ).
+
+Свежесть: диапазон считается полным USERBOT_MESSAGES_RANGE_TTL_SEC секунд
+с проверки в Telegram (bot_message_ranges.updated_at), потом он снова
+запрашивается. При этом изменённый текст перезаписывается, а сообщения,
+которых в Telegram больше нет, помечаются telegram_deleted_at и не
+отдаются (строки остаются - на них ссылаются чеки). Между проверками
+правки и удаления не видны. Загрузка истории (history_loader.py) TTL не
+учитывает: для неё диапазоны - только контрольные точки.
+
+В bot_messages хранятся только сообщения с текстом, поэтому /messages
+тоже отдаёт только их. Курсор (nextCursor) - id последнего сообщения
+страницы, так что пропуски id на месте сообщений без текста не мешают
+листать дальше.
+"""
+
+import logging
+import os
+from datetime import timezone
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+PAGE_MAX = int(os.getenv('USERBOT_MESSAGES_PAGE_MAX', '200'))
+RANGE_TTL_SEC = int(os.getenv('USERBOT_MESSAGES_RANGE_TTL_SEC', '3600'))
+
+# Защита от зацикливания: шагов БД/Telegram на одну страницу
+MAX_STEPS = 20
+
+# fresh: диапазон проверен в Telegram не раньше $2 секунд назад ($2 = NULL - без TTL)
+RANGES_SQL = """SELECT low_id, high_id, reaches_start, updated_at,
+        ($2::float8 IS NULL OR updated_at > NOW() - make_interval(secs => $2::float8)) AS fresh
+    FROM bot_message_ranges
+    WHERE chat_id = $1 ORDER BY high_id DESC"""
+
+PAGE_SQL = """SELECT message_id, chat_id, sender_id, timestamp, text FROM bot_messages
+    WHERE chat_id = $1 AND message_num <= $2 AND message_num >= $3
+      AND telegram_deleted_at IS NULL
+    ORDER BY message_num DESC
+    LIMIT $4"""
+
+# Повторная проверка диапазона: изменённый в Telegram текст перезаписывается
+INSERT_SQL = """INSERT INTO bot_messages
+    (bot_id, telegram_message_id, chat_id, message_id, sender_id, timestamp, text, status, process_attempts)
+    SELECT $1, message_id, $1, message_id, sender_id, ts, text, 'new', 0
+    FROM unnest($2::text[], $3::text[], $4::timestamptz[], $5::text[])
+        AS t(message_id, sender_id, ts, text)
+    ON CONFLICT (chat_id, message_id) DO UPDATE
+    SET text = EXCLUDED.text,
+        telegram_deleted_at = NULL
+    WHERE bot_messages.text IS DISTINCT FROM EXCLUDED.text
+       OR bot_messages.telegram_deleted_at IS NOT NULL"""
+
+# Сообщения диапазона, которых Telegram не вернул, удалены
+MARK_DELETED_SQL = """UPDATE bot_messages SET telegram_deleted_at = NOW()
+    WHERE chat_id = $1 AND message_num BETWEEN $2 AND $3
+      AND telegram_deleted_at IS NULL
+      AND message_id <> ALL($4::text[])"""
+
+LOCK_SQL = "SELECT pg_advisory_xact_lock(hashtext('bot_message_ranges:' || $1))"
+
+DELETE_RANGES_SQL = "DELETE FROM bot_message_ranges WHERE chat_id = $1"
+
+# updated_at = NULL - диапазон проверен сейчас
+INSERT_RANGES_SQL = """INSERT INTO bot_message_ranges (chat_id, low_id, high_id, reaches_start, updated_at)
+    SELECT $1, low_id, high_id, reaches_start, COALESCE(updated_at, NOW())
+    FROM unnest($2::bigint[], $3::bigint[], $4::boolean[], $5::timestamptz[])
+        AS t(low_id, high_id, reaches_start, updated_at)"""
+
+# (low_id, high_id, reaches_start)
+Range = Tuple[int, int, bool]
+
+logger = logging.getLogger('userbot.message_store')
+
+
+def merge_ranges(ranges: List[Range]) -> List[Range]:
+    """
+    Слияние пересекающихся и соседних диапазонов
+
+    Returns:
+        list диапазонов по убыванию high_id
+    """
+    merged = []
+    for low, high, reaches_start in sorted(ranges):
+        if merged and low <= merged[-1][1] + 1:
+            prev_low, prev_high, prev_start = merged[-1]
+            merged[-1] = (prev_low, max(prev_high, high), prev_start or reaches_start)
+        else:
+            merged.append((low, high, reaches_start))
+    return merged[::-1]
+
+
+def covering_range(ranges: List[Range], message_id: int) -> Optional[Range]:
+    """Диапазон, содержащий message_id"""
+    for low, high, reaches_start in ranges:
+        if low <= message_id <= high:
+            return low, high, reaches_start
+    return None
+
+
+def lower_bound(ranges: List[Range], message_id: Optional[int]) -> int:
+    """high_id ближайшего диапазона ниже message_id (0 - ниже ничего не известно)"""
+    for _, high, _ in ranges:
+        if message_id is None or high < message_id:
+            return high
+    return 0
+
+
+def _subtract(low: int, high: int, cut_low: int, cut_high: int) -> List[Tuple[int, int]]:
+    """Части [low, high] вне [cut_low, cut_high]"""
+    if cut_high < low or cut_low > high:
+        return [(low, high)]
+    pieces = []
+    if low < cut_low:
+        pieces.append((low, cut_low - 1))
+    if high > cut_high:
+        pieces.append((cut_high + 1, high))
+    return pieces
+
+
+def plan_ranges(rows, new_range: Range) -> Tuple[List[Range], list]:
+    """
+    Новый набор диапазонов чата после проверки new_range
+
+    Свежие диапазоны сливаются с new_range; время проверки слитого - самое
+    раннее из свежих частей (None - только что). Устаревшие обрезаются до
+    частей вне слитых и сохраняют своё время.
+
+    Args:
+        rows: строки RANGES_SQL (low_id, high_id, reaches_start, updated_at, fresh)
+
+    Returns:
+        (свежие диапазоны по убыванию high_id, list (low, high, reaches_start, updated_at) для записи)
+    """
+    fresh = [row for row in rows if row['fresh']]
+    merged = merge_ranges([(row['low_id'], row['high_id'], row['reaches_start']) for row in fresh] + [new_range])
+
+    stored = []
+    for low, high, reaches_start in merged:
+        stamps = [row['updated_at'] for row in fresh if low <= row['low_id'] and row['high_id'] <= high]
+        stored.append((low, high, reaches_start, min(stamps) if stamps else None))
+    for row in rows:
+        if row['fresh']:
+            continue
+        pieces = [(row['low_id'], row['high_id'])]
+        for low, high, _ in merged:
+            pieces = [piece for piece_low, piece_high in pieces
+                      for piece in _subtract(piece_low, piece_high, low, high)]
+        for piece_low, piece_high in pieces:
+            stored.append((piece_low, piece_high, row['reaches_start'] and piece_low == row['low_id'],
+                           row['updated_at']))
+    return merged, stored
+
+
+async def load_ranges(conn, chat_id: str, max_age: Optional[float] = None) -> List[Range]:
+    """
+    Полные диапазоны чата по убыванию high_id
+
+    Args:
+        max_age: float - только проверенные в Telegram не раньше max_age секунд назад
+    """
+    rows = await conn.fetch(RANGES_SQL, chat_id, max_age)
+    return [(row['low_id'], row['high_id'], row['reaches_start']) for row in rows if row['fresh']]
+
+
+async def add_range(conn, chat_id: str, new_range: Range, max_age: Optional[float] = None) -> List[Range]:
+    """
+    Отметить диапазон полным и слить с уже известными
+
+    Вызывается внутри транзакции: диапазоны чата блокируются advisory-lock.
+
+    Args:
+        max_age: float - TTL диапазонов (см. plan_ranges), None - все свежие
+
+    Returns:
+        list свежих диапазонов чата после слияния
+    """
+    await conn.execute(LOCK_SQL, chat_id)
+    merged, stored = plan_ranges(await conn.fetch(RANGES_SQL, chat_id, max_age), new_range)
+    await conn.execute(DELETE_RANGES_SQL, chat_id)
+    await conn.execute(
+        INSERT_RANGES_SQL,
+        chat_id,
+        [low for low, _, _, _ in stored],
+        [high for _, high, _, _ in stored],
+        [reaches_start for _, _, reaches_start, _ in stored],
+        [updated_at for _, _, _, updated_at in stored],
+    )
+    return merged
+
+
+class MessageStore:
+    """
+    Страницы истории чата из bot_messages
+
+    Args:
+        get_pool: корутина, возвращающая asyncpg.Pool
+        fetch_remote: корутина (chat_id, offset_id, min_id, limit) -> list dict
+            {id, sender_id, date, text} - сообщения Telegram с min_id < id < offset_id
+            (offset_id=0 - с самого нового), от новых к старым
+        range_ttl: float - через сколько секунд диапазон проверяется в Telegram заново
+    """
+
+    def __init__(self, get_pool: Callable[[], Awaitable], fetch_remote: Callable[..., Awaitable],
+                 range_ttl: float = RANGE_TTL_SEC):
+        self.get_pool = get_pool
+        self.fetch_remote = fetch_remote
+        self.range_ttl = range_ttl
+        self._stats = {
+            'pages': 0,
+            'db_rows': 0,
+            'remote_calls': 0,
+            'remote_rows': 0,
+        }
+
+    async def page(self, chat_id, limit: int = 50, before_message_id=None) -> List[dict]:
+        """
+        Страница истории: до limit сообщений с id < before_message_id, от новых к старым
+
+        Returns:
+            list dict {message_id, chat_id, sender_id, date, text}
+        """
+        chat_id = str(chat_id)
+        limit = max(1, min(int(limit or 50), PAGE_MAX))
+        cursor = int(str(before_message_id)) - 1 if before_message_id else None
+        ranges = await self._ranges(chat_id)
+
+        out = []
+        for _ in range(MAX_STEPS):
+            need = limit - len(out)
+            if need <= 0 or (cursor is not None and cursor < 1):
+                break
+
+            covered = covering_range(ranges, cursor) if cursor is not None else None
+            if covered:
+                low, _, reaches_start = covered
+                rows = await self._read(chat_id, cursor, low, need)
+                self._stats['db_rows'] += len(rows)
+                out.extend(rows)
+                if len(rows) == need or reaches_start:
+                    break
+                cursor = low - 1
+                continue
+
+            # Пропуск: от cursor вниз до ближайшего известного диапазона
+            floor = lower_bound(ranges, cursor)
+            remote = await self.fetch_remote(chat_id, offset_id=cursor + 1 if cursor is not None else 0,
+                                             min_id=floor, limit=need)
+            self._stats['remote_calls'] += 1
+            self._stats['remote_rows'] += len(remote)
+
+            texts = [message for message in remote if message.get('text')]
+            complete = len(remote) < need
+            top = cursor if cursor is not None else max((message['id'] for message in remote), default=None)
+            if top is not None:
+                low = floor + 1 if complete else min(message['id'] for message in remote)
+                new_range = (low, top, complete and floor == 0)
+                await self._write(chat_id, texts, new_range)
+                ranges = merge_ranges(ranges + [new_range])
+            out.extend(self._from_remote(chat_id, message) for message in texts)
+
+            if complete and floor == 0:
+                break
+            cursor = floor if complete else min(message['id'] for message in remote) - 1
+
+        self._stats['pages'] += 1
+        return out[:limit]
+
+    @staticmethod
+    def _from_remote(chat_id, message) -> dict:
+        date = message.get('date')
+        return {
+            'message_id': str(message['id']),
+            'chat_id': chat_id,
+            'sender_id': str(message.get('sender_id') or ''),
+            'date': date.isoformat() if date else None,
+            'text': message['text'],
+        }
+
+    async def _ranges(self, chat_id) -> List[Range]:
+        pool = await self.get_pool()
+        async with pool.acquire() as conn:
+            return await load_ranges(conn, chat_id, self.range_ttl)
+
+    async def _read(self, chat_id, high: int, low: int, limit: int) -> List[dict]:
+        pool = await self.get_pool()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(PAGE_SQL, chat_id, high, low, limit)
+        out = []
+        for row in rows:
+            # timestamp без зоны записан в UTC
+            date = row['timestamp']
+            if date is not None and date.tzinfo is None:
+                date = date.replace(tzinfo=timezone.utc)
+            out.append({
+                'message_id': row['message_id'],
+                'chat_id': row['chat_id'],
+                'sender_id': row['sender_id'] or '',
+                'date': date.isoformat() if date else None,
+                'text': row['text'],
+            })
+        return out
+
+    async def _write(self, chat_id, messages: List[dict], new_range: Range):
+        """
+        Записать сообщения из Telegram и отметить диапазон полным (одна транзакция)
+
+        В new_range Telegram вернул все сообщения: сохранённые, которых среди них нет, удалены
+        """
+        pool = await self.get_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                if messages:
+                    await conn.execute(
+                        INSERT_SQL,
+                        chat_id,
+                        [str(message['id']) for message in messages],
+                        [str(message.get('sender_id') or '') or None for message in messages],
+                        [message.get('date') for message in messages],
+                        [message['text'] for message in messages],
+                    )
+                low, high, _ = new_range
+                await conn.execute(MARK_DELETED_SQL, chat_id, low, high,
+                                   [str(message['id']) for message in messages])
+                await add_range(conn, chat_id, new_range, self.range_ttl)
+        logger.debug("Чат %s: записано %s сообщений, диапазон %s", chat_id, len(messages), new_range)
+
+    def stats(self) -> dict:
+        return dict(self._stats)
@@ -0,0 +1,277 @@
+"""
+Userbot: outbox для отправки сообщений в backend
+
+Очередь - сама таблица bot_messages: строка ждёт отправки, пока её status
+new/parsed, а next_attempt_at наступил (write_buffer ставит NOW() при вставке).
+Разобранные в userbot строки (status = 'parsed') идут с операциями в поле
+parsed: backend создаёт по ним чек без повторного разбора.
+Диспетчер (USERBOT_OUTBOX_WORKERS параллельных циклов - backend разбирает
+пачку последовательно, поэтому пачки отправляются одновременно):
+1. забирает до USERBOT_OUTBOX_BATCH строк (FOR UPDATE SKIP LOCKED) и сдвигает
+   им next_attempt_at на время аренды - строки упавшего диспетчера вернутся
+2. отправляет пачку одним POST /api/userbot-chat/process-multiple
+3. по ответу снимает строки с отправки (next_attempt_at = NULL) или назначает
+   повтор с экспоненциальной задержкой; при 4xx снимаются только строки,
+   названные в data.errors[].recordId, остальные повторяются
+
+Размер пачки подстраивается под время её обработки: пачка должна укладываться
+в BATCH_TIME_SHARE таймаута HTTP, после таймаута следующая пачка вдвое меньше.
+
+Доставка - «хотя бы один раз»: backend пропускает уже обработанные строки
+по их статусу.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Optional
+
+import aiohttp
+
+OUTBOX_BATCH = int(os.getenv('USERBOT_OUTBOX_BATCH', '20'))
+OUTBOX_POLL_SEC = float(os.getenv('USERBOT_OUTBOX_POLL_MS', '1000')) / 1000
+OUTBOX_HTTP_TIMEOUT = float(os.getenv('USERBOT_OUTBOX_HTTP_TIMEOUT', '120'))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('USERBOT_OUTBOX_MAX_ATTEMPTS', '8'))
+OUTBOX_WORKERS = int(os.getenv('USERBOT_OUTBOX_WORKERS', '3'))
+
+# Доля таймаута HTTP, в которую должна укладываться обработка пачки
+BATCH_TIME_SHARE = 0.5
+
+# Повтор: RETRY_BASE_SEC * 2^(attempts-1), не больше RETRY_MAX_SEC
+RETRY_BASE_SEC = 5
+RETRY_MAX_SEC = 1800
+
+# Аренда строки на время отправки (дольше таймаута HTTP)
+LEASE_SEC = int(OUTBOX_HTTP_TIMEOUT + 30)
+
+# Коды ошибок backend по отдельному сообщению, после которых стоит повторить
+RETRYABLE_CODES = {'UNEXPECTED'}
+
+CLAIM_SQL = """UPDATE bot_messages
+    SET next_attempt_at = NOW() + make_interval(secs => $2),
+        dispatch_attempts = dispatch_attempts + 1
+    WHERE id IN (
+        SELECT id FROM bot_messages
+        WHERE next_attempt_at IS NOT NULL
+          AND next_attempt_at <= NOW()
+          AND status IN ('new', 'parsed')
+        ORDER BY next_attempt_at
+        LIMIT $1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, chat_id, message_id, text, data, dispatch_attempts"""
+
+DONE_SQL = "UPDATE bot_messages SET next_attempt_at = NULL WHERE id = ANY($1::uuid[])"
+
+RETRY_SQL = """UPDATE bot_messages
+    SET next_attempt_at = CASE WHEN dispatch_attempts >= $3 THEN NULL
+                               ELSE NOW() + make_interval(secs => $2) END,
+        error = $4
+    WHERE id = ANY($1::uuid[]) AND status IN ('new', 'parsed')"""
+
+BACKLOG_SQL = """SELECT COUNT(*) FROM bot_messages
+    WHERE next_attempt_at IS NOT NULL AND status IN ('new', 'parsed')"""
+
+logger = logging.getLogger('userbot.outbox')
+
+
+def retry_delay(attempts: int) -> float:
+    """Задержка перед следующей попыткой после attempts неудачных"""
+    return min(RETRY_BASE_SEC * 2 ** max(0, attempts - 1), RETRY_MAX_SEC)
+
+
+def build_item(row) -> dict:
+    """Строка bot_messages -> элемент messages для /process-multiple"""
+    item = {
+        'record_id': str(row['id']),
+        'chat_id': row['chat_id'],
+        'message_id': row['message_id'],
+        'raw_text': row['text'],
+    }
+    data = row['data']
+    if isinstance(data, str):
+        data = json.loads(data)
+    if data and data.get('operations'):
+        # Операции локального разбора: backend не разбирает текст заново
+        item['parsed'] = data['operations']
+    return item
+
+
+class Outbox:
+    """
+    Диспетчер outbox
+
+    Args:
+        get_pool: корутина, возвращающая asyncpg.Pool
+        get_session: корутина, возвращающая aiohttp.ClientSession
+        url: str - адрес пакетного endpoint backend
+        semaphore: asyncio.Semaphore - общий лимит одновременных запросов в backend
+        workers: int - число параллельных циклов отправки
+    """
+
+    def __init__(self, get_pool: Callable[[], Awaitable], get_session: Callable[[], Awaitable], url: str,
+                 semaphore: Optional[asyncio.Semaphore] = None, batch_size: int = OUTBOX_BATCH,
+                 poll_interval: float = OUTBOX_POLL_SEC, http_timeout: float = OUTBOX_HTTP_TIMEOUT,
+                 workers: int = OUTBOX_WORKERS):
+        self.get_pool = get_pool
+        self.get_session = get_session
+        self.url = url
+        self.workers = max(1, workers)
+        self.semaphore = semaphore or asyncio.Semaphore(self.workers)
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.http_timeout = http_timeout
+
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+        # Текущий размер пачки (подстраивается под время обработки)
+        self._batch_limit = batch_size
+        self._backlog = None
+        self._stats = {
+            'batches': 0,
+            'sent': 0,
+            'retried': 0,
+            'http_errors': 0,
+            'rejected': 0,
+            'db_errors': 0,
+        }
+        self._last_batch_ms = None
+
+    def start(self):
+        """Запускает циклы диспетчера (идемпотентно)"""
+        self._tasks = [task for task in self._tasks if not task.done()]
+        for index in range(len(self._tasks), self.workers):
+            self._tasks.append(asyncio.create_task(self._run(), name=f'userbot-outbox-{index}'))
+
+    def notify(self):
+        """Разбудить диспетчер: в outbox появились строки"""
+        self._wakeup.set()
+
+    async def close(self):
+        """Останавливает диспетчер; неотправленное остаётся в таблице"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run(self):
+        while True:
+            limit = self._batch_limit
+            try:
+                sent = await self.dispatch_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as dispatch_error:
+                self._stats['db_errors'] += 1
+                logger.warning("Outbox: ошибка диспетчера: %s", dispatch_error)
+                sent = 0
+            # Полная пачка - сразу следующая, иначе ждём сигнала или интервала опроса
+            if sent < limit:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+    async def dispatch_once(self) -> int:
+        """
+        Одна итерация: забрать пачку, отправить, отметить результат
+
+        Returns:
+            int - сколько строк было в пачке
+        """
+        pool = await self.get_pool()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(CLAIM_SQL, self._batch_limit, float(LEASE_SEC))
+            self._backlog = await conn.fetchval(BACKLOG_SQL)
+        if not rows:
+            return 0
+
+        items = [build_item(row) for row in rows]
+        ids = [row['id'] for row in rows]
+        attempts = max(row['dispatch_attempts'] for row in rows)
+        started = time.perf_counter()
+        try:
+            status, retry_ids = await self._post(items)
+        except Exception as http_error:
+            if isinstance(http_error, asyncio.TimeoutError):
+                # Пачка не уложилась в таймаут: следующие - меньше
+                self._batch_limit = max(1, len(rows) // 2)
+            self._stats['http_errors'] += 1
+            logger.warning("Outbox: пачка из %s не отправлена (попытка %s): %s", len(rows), attempts, http_error)
+            await self._schedule_retry(ids, attempts, f'OUTBOX: {http_error}')
+            return len(rows)
+
+        elapsed = time.perf_counter() - started
+        self._last_batch_ms = round(elapsed * 1000, 1)
+        if status == 413:
+            # Слишком большое тело запроса: следующие пачки меньше
+            self._batch_limit = max(1, len(rows) // 2)
+        elif status < 400:
+            per_row = elapsed / len(rows)
+            self._batch_limit = max(1, min(self.batch_size, int(self.http_timeout * BATCH_TIME_SHARE / per_row)
+                                           if per_row > 0 else self.batch_size))
+        done_ids = [row_id for row_id in ids if str(row_id) not in retry_ids]
+        async with pool.acquire() as conn:
+            await conn.execute(DONE_SQL, done_ids)
+        if retry_ids:
+            await self._schedule_retry([row_id for row_id in ids if str(row_id) in retry_ids],
+                                       attempts, 'OUTBOX: backend error')
+        self._stats['batches'] += 1
+        if status < 400:
+            self._stats['sent'] += len(done_ids)
+        logger.debug("Outbox: пачка %s строк за %sмс", len(rows), self._last_batch_ms)
+        return len(rows)
+
+    async def _post(self, items) -> tuple:
+        """
+        POST пачки в backend
+
+        Returns:
+            tuple - (HTTP-статус, set record_id, которые надо повторить)
+
+        Raises:
+            Exception: сеть, таймаут или ответ 5xx - повторяется вся пачка
+        """
+        session = await self.get_session()
+        async with self.semaphore:
+            async with session.post(
+                self.url,
+                json={'messages': items},
+                timeout=aiohttp.ClientTimeout(total=self.http_timeout)
+            ) as response:
+                body = await response.text()
+                if response.status >= 500:
+                    raise RuntimeError(f'backend HTTP {response.status}')
+
+        try:
+            errors = (json.loads(body).get('data') or {}).get('errors') or []
+        except (ValueError, AttributeError):
+            errors = []
+        if response.status >= 400:
+            # Повтором не исправится ошибка только названных строк - остальные повторяются
+            rejected = {str(error.get('recordId')) for error in errors if error.get('recordId')}
+            self._stats['rejected'] += len(rejected)
+            logger.error("Outbox: backend отклонил пачку (%s), строк с ошибкой %s: %s",
+                         response.status, len(rejected), body[:500])
+            return response.status, {item['record_id'] for item in items} - rejected
+        return response.status, {
+            str(error.get('recordId'))
+            for error in errors
+            if error.get('code') in RETRYABLE_CODES and error.get('recordId')
+        }
+
+    async def _schedule_retry(self, ids, attempts, error):
+        self._stats['retried'] += len(ids)
+        pool = await self.get_pool()
+        async with pool.acquire() as conn:
+            await conn.execute(RETRY_SQL, ids, float(retry_delay(attempts)), OUTBOX_MAX_ATTEMPTS, error)
+
+    def stats(self) -> dict:
+        result = dict(self._stats)
+        result['backlog'] = self._backlog
+        result['last_batch_ms'] = self._last_batch_ms
+        result['batch_limit'] = self._batch_limit
+        return result
@@ -0,0 +1,231 @@
+"""
+Userbot: конвейер обработки входящих сообщений
+
+Обработчик Telethon только кладёт событие в первую очередь; дальше
+сообщение проходит стадии, у каждой - своя ограниченная очередь и свои
+воркеры:
+
+    filter -> persist -> forward
+
+(отправку записанных сообщений в backend ведёт outbox.py)
+
+Медленная БД или Telegram задерживают только свою стадию. Когда очередь
+стадии заполнена, put ждёт (backpressure доходит до обработчика Telethon),
+сообщения не отбрасываются. Ошибка обработчика повторяется (retries), после
+последней попытки элемент уходит в on_error (dead letter) - тоже без
+молчаливой потери. Глубина очередей и задержки стадий - в stats().
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, List, Optional
+
+logger = logging.getLogger('userbot.pipeline')
+
+# Сколько последних замеров задержки хранится для перцентилей
+LATENCY_WINDOW = 512
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class Stage:
+    """
+    Стадия конвейера: очередь + воркеры
+
+    handler(item) возвращает элемент для следующей стадии или None, если
+    обработка сообщения на этой стадии закончена (например, отфильтровано).
+    Исключение handler повторяется до retries раз с паузой retry_delay * попытка,
+    затем элемент передаётся в on_error(item, error).
+
+    Args:
+        name: str - имя стадии (для логов и метрик)
+        handler: корутина-обработчик элемента
+        workers: int - число воркеров (параллельность стадии)
+        maxsize: int - ёмкость очереди
+        retries: int - повторы handler после ошибки
+        retry_delay: float - базовая пауза между повторами, сек
+        on_error: корутина (item, error) - dead letter для элемента после всех попыток
+        describe: функция item -> str для логов (например, id сообщения)
+    """
+
+    def __init__(self, name: str, handler: Callable[[object], Awaitable], workers: int = 1, maxsize: int = 1000,
+                 retries: int = 0, retry_delay: float = 0.5,
+                 on_error: Optional[Callable[[object, Exception], Awaitable]] = None,
+                 describe: Callable[[object], str] = repr):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.retries = max(0, retries)
+        self.retry_delay = retry_delay
+        self.on_error = on_error
+        self.describe = describe
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.next: Optional['Stage'] = None
+
+        self._tasks: List[asyncio.Task] = []
+        self._busy = 0
+        self._processed = 0
+        self._passed = 0
+        self._errors = 0
+        self._retried = 0
+        self._dead_letters = 0
+        self._latency = deque(maxlen=LATENCY_WINDOW)
+        self._wait = deque(maxlen=LATENCY_WINDOW)
+
+    @property
+    def running(self) -> bool:
+        return any(not task.done() for task in self._tasks)
+
+    def start(self):
+        if self.running:
+            return
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f'userbot-{self.name}-{index}')
+            for index in range(self.workers)
+        ]
+
+    async def put(self, item):
+        """Ставит элемент в очередь стадии; ждёт, если очередь заполнена"""
+        await self.queue.put((time.perf_counter(), item))
+
+    async def _worker(self):
+        while True:
+            queued_at, item = await self.queue.get()
+            started = time.perf_counter()
+            self._wait.append(started - queued_at)
+            self._busy += 1
+            try:
+                try:
+                    result = await self._handle(item)
+                finally:
+                    self._busy -= 1
+                    self._processed += 1
+                    self._latency.append(time.perf_counter() - started)
+
+                if result is not None and self.next is not None:
+                    self._passed += 1
+                    await self.next.put(result)
+            finally:
+                # Элемент считается обработанным, только когда передан дальше:
+                # stop() не потеряет его при остановке
+                self.queue.task_done()
+
+    async def _handle(self, item):
+        for attempt in range(self.retries + 1):
+            try:
+                return await self.handler(item)
+            except Exception as error:
+                self._errors += 1
+                if attempt < self.retries:
+                    self._retried += 1
+                    logger.warning("Стадия %s: ошибка обработки %s (попытка %s/%s): %s",
+                                   self.name, self.describe(item), attempt + 1, self.retries + 1, error)
+                    await asyncio.sleep(self.retry_delay * (attempt + 1))
+                    continue
+                logger.exception("Стадия %s: сообщение %s не обработано после %s попыток",
+                                 self.name, self.describe(item), attempt + 1)
+                await self._dead_letter(item, error)
+        return None
+
+    async def _dead_letter(self, item, error):
+        self._dead_letters += 1
+        if self.on_error is None:
+            return
+        try:
+            await self.on_error(item, error)
+        except Exception:
+            logger.exception("Стадия %s: не удалось сохранить %s в dead letter", self.name, self.describe(item))
+
+    async def stop(self):
+        """Дожидается опустошения очереди и останавливает воркеры"""
+        if self.running:
+            await self.queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> dict:
+        latency = list(self._latency)
+        wait = list(self._wait)
+        return {
+            'depth': self.queue.qsize(),
+            'maxsize': self.queue.maxsize,
+            'workers': self.workers,
+            'busy': self._busy,
+            'processed': self._processed,
+            'passed': self._passed,
+            'errors': self._errors,
+            'retried': self._retried,
+            'dead_letters': self._dead_letters,
+            'latency_ms': {
+                'avg': round(sum(latency) / len(latency) * 1000, 1),
+                'p95': round(_percentile(latency, 0.95) * 1000, 1),
+                'max': round(max(latency) * 1000, 1),
+            } if latency else None,
+            'queue_wait_ms': {
+                'avg': round(sum(wait) / len(wait) * 1000, 1),
+                'p95': round(_percentile(wait, 0.95) * 1000, 1),
+            } if wait else None,
+        }
+
+
+class Pipeline:
+    """
+    Цепочка стадий; элемент, возвращённый стадией, попадает в следующую
+    """
+
+    def __init__(self, stages: List[Stage]):
+        self.stages = stages
+        for stage, following in zip(stages, stages[1:]):
+            stage.next = following
+
+    def start(self):
+        """Запускает воркеры всех стадий (идемпотентно)"""
+        for stage in self.stages:
+            stage.start()
+
+    async def submit(self, item):
+        """Ставит элемент в первую стадию (с backpressure)"""
+        if not self.stages[0].running:
+            self.start()
+        await self.stages[0].put(item)
+
+    async def _handle(self, item):
+        for attempt in range(self.retries + 1):
+            try:
+                return await self.handler(item)
+            except Exception as error:
+                self._errors += 1
+                if attempt < self.retries:
+                    self._retried += 1
+                    logger.warning("Стадия %s: ошибка обработки %s (попытка %s/%s): %s",
+                                   self.name, self.describe(item), attempt + 1, self.retries + 1, error)
+                    await asyncio.sleep(self.retry_delay * (attempt + 1))
+                    continue
+                logger.exception("Стадия %s: сообщение %s не обработано после %s попыток",
+                                 self.name, self.describe(item), attempt + 1)
+                await self._dead_letter(item, error)
+        return None
+
+    async def _dead_letter(self, item, error):
+        self._dead_letters += 1
+        if self.on_error is None:
+            return
+        try:
+            await self.on_error(item, error)
+        except Exception:
+            logger.exception("Стадия %s: не удалось сохранить %s в dead letter", self.name, self.describe(item))
+
+    async def stop(self):
+        """Дообрабатывает очереди по порядку стадий и останавливает воркеры"""
+        for stage in self.stages:
+            await stage.stop()
+
+    def stats(self) -> dict:
+        return {stage.name: stage.stats() for stage in self.stages}
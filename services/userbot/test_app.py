@@ -0,0 +1,146 @@
+import asyncio
+import time
+import unittest
+from unittest import mock
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from services.userbot import app as api
+from services.userbot.userbot import userbot_manager
+
+
+def run_client(scenario):
+    async def runner():
+        async with TestClient(TestServer(api.create_app(autostart=False))) as client:
+            return await scenario(client)
+
+    return asyncio.run(runner())
+
+
+class ApiTest(unittest.TestCase):
+    def test_health(self):
+        async def scenario(client):
+            response = await client.get('/health')
+            return response.status, await response.json(), response.headers
+
+        status, body, headers = run_client(scenario)
+        self.assertEqual(status, 200)
+        self.assertEqual(body['service'], 'userbot')
+        self.assertIn('outbox', body)
+        self.assertEqual(headers['Access-Control-Allow-Origin'], '*')
+
+    def test_concurrent_requests_do_not_queue(self):
+        async def slow_messages(chat_id, limit=50, before_message_id=None):
+            await asyncio.sleep(0.2)
+            return [{'message_id': 5}]
+
+        async def slow_status():
+            await asyncio.sleep(0.2)
+            return {'running': True, 'authorized': True}
+
+        async def scenario(client):
+            started = time.monotonic()
+            responses = await asyncio.gather(*(
+                [client.get('/messages', params={'chat_id': '1'}) for _ in range(5)]
+                + [client.get('/status') for _ in range(5)]
+            ))
+            return time.monotonic() - started, [response.status for response in responses]
+
+        with mock.patch.object(userbot_manager, 'get_messages', side_effect=slow_messages), \
+                mock.patch.object(userbot_manager, 'get_status', side_effect=slow_status):
+            elapsed, statuses = run_client(scenario)
+        self.assertEqual(statuses, [200] * 10)
+        self.assertLess(elapsed, 1.0)
+
+    def test_timeout_returns_504_and_cancels(self):
+        cancelled = asyncio.Event()
+
+        async def hanging(chat_id):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        async def scenario(client):
+            response = await client.post('/chat-meta', json={'chat_id': '1'})
+            return response.status, cancelled.is_set()
+
+        with mock.patch.object(api, 'API_TIMEOUT', 0.05), \
+                mock.patch.object(userbot_manager, 'get_chat_meta', side_effect=hanging), \
+                self.assertLogs('userbot.api', level='WARNING'):
+            status, was_cancelled = run_client(scenario)
+        self.assertEqual(status, 504)
+        self.assertTrue(was_cancelled)
+
+    def test_validation_and_not_found(self):
+        async def scenario(client):
+            missing = await client.get('/messages')
+            bad_json = await client.post('/chat-meta', data='{', headers={'Content-Type': 'application/json'})
+            not_found = await client.post('/message-text', json={'chat_id': '1', 'message_id': '2'})
+            return missing.status, bad_json.status, not_found.status, (await not_found.json())['error']
+
+        with mock.patch.object(userbot_manager, 'fetch_message_text',
+                               side_effect=ValueError('Сообщение не найдено')):
+            self.assertEqual(run_client(scenario), (400, 400, 404, 'Сообщение не найдено'))
+
+    def test_history_load_runs_in_background(self):
+        release = asyncio.Event()
+        calls = []
+
+        async def load(bot_id, bot_username, days):
+            calls.append(bot_id)
+            await release.wait()
+            return {'loaded': 3, 'saved': 2, 'skipped': 1, 'errors': 0}
+
+        async def scenario(client):
+            body = {'bot_id': 915326936, 'bot_username': '@CardXabarBot', 'days': 30}
+            started = await client.post('/load-history', json=body)
+            joined = await client.post('/load-history', json=body)
+            running = await client.get('/load-history', params={'bot_id': '915326936'})
+            release.set()
+            await asyncio.sleep(0.01)
+            done = await client.get('/load-history', params={'bot_id': '915326936'})
+            unknown = await client.get('/load-history', params={'bot_id': '1'})
+            return (started.status, joined.status, (await running.json())['state'],
+                    await done.json(), unknown.status)
+
+        with mock.patch.object(userbot_manager, 'load_bot_history', side_effect=load):
+            started, joined, running, done, unknown = run_client(scenario)
+        self.assertEqual((started, joined, running, unknown), (202, 202, 'running', 404))
+        self.assertEqual(calls, [915326936])
+        self.assertEqual((done['state'], done['saved']), ('done', 2))
+
+    def test_history_load_survives_client_disconnect(self):
+        finished = asyncio.Event()
+
+        async def load(bot_id, bot_username, days):
+            await asyncio.sleep(0.1)
+            finished.set()
+            return {'loaded': 0, 'saved': 0, 'skipped': 0, 'errors': 0}
+
+        async def scenario(client):
+            response = await client.post('/load-history', json={'bot_id': 1, 'bot_username': '@bot'})
+            response.close()
+            await asyncio.wait_for(finished.wait(), 1)
+            return response.status
+
+        with mock.patch.object(userbot_manager, 'load_bot_history', side_effect=load):
+            self.assertEqual(run_client(scenario), 202)
+
+    def test_history_load_failure_is_reported(self):
+        async def load(bot_id, bot_username, days):
+            return {'loaded': 0, 'saved': 0, 'skipped': 0, 'errors': 1, 'error_message': 'Userbot не подключен'}
+
+        async def scenario(client):
+            await client.post('/load-history', json={'bot_id': 1, 'bot_username': '@bot'})
+            await asyncio.sleep(0.01)
+            return await (await client.get('/load-history', params={'bot_id': '1'})).json()
+
+        with mock.patch.object(userbot_manager, 'load_bot_history', side_effect=load):
+            body = run_client(scenario)
+        self.assertEqual((body['success'], body['state'], body['error']), (False, 'failed', 'Userbot не подключен'))
+
+
+if __name__ == '__main__':
+    unittest.main()
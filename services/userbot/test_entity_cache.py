@@ -0,0 +1,87 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from telethon.tl.types import InputPeerChannel, InputPeerUser
+
+from services.userbot.entity_cache import CachedLookupError, EntityCache, peer_from_dict, peer_to_dict
+from services.userbot.userbot import UserbotManager
+
+
+class EntityCacheTest(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = EntityCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+
+    def test_ttl_expiry(self):
+        cache = EntityCache()
+        with mock.patch('services.userbot.entity_cache.time.time', return_value=1000):
+            cache.set('a', 1, ttl=10)
+        with mock.patch('services.userbot.entity_cache.time.time', return_value=1011):
+            self.assertIsNone(cache.get('a'))
+
+    def test_negative_entry_raises(self):
+        cache = EntityCache()
+        cache.set_negative('peer:@missing', 'No user has "missing" as username')
+        with self.assertRaises(CachedLookupError):
+            cache.get('peer:@missing')
+
+    def test_survives_restart(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'entity_cache.json')
+            first = EntityCache(path)
+            first.set('peer:1', {'type': 'user', 'id': 1, 'access_hash': 42})
+            first.set_negative('peer:2', 'not found')
+            first.save()
+
+            second = EntityCache(path)
+            self.assertEqual(second.get('peer:1')['access_hash'], 42)
+            self.assertIsNone(second.get('peer:2'))
+
+    def test_peer_roundtrip(self):
+        for peer in (InputPeerUser(1, 42), InputPeerChannel(2, 43)):
+            self.assertEqual(peer_from_dict(peer_to_dict(peer)), peer)
+
+
+class ResolveEntityCacheTest(unittest.TestCase):
+    def test_repeated_resolve_hits_cache(self):
+        manager = UserbotManager()
+        manager.entity_cache = EntityCache()
+        manager.client = SimpleNamespace(
+            get_entity=mock.AsyncMock(return_value=SimpleNamespace(id=7, access_hash=99, first_name='Bot', bot=True))
+        )
+
+        async def scenario():
+            first = await manager.resolve_entity(7)
+            second = await manager.resolve_entity('7')
+            return first, second
+
+        first, second = asyncio.run(scenario())
+        self.assertEqual(first, InputPeerUser(7, 99))
+        self.assertEqual(second, first)
+        self.assertEqual(manager.client.get_entity.await_count, 1)
+
+    def test_not_found_is_cached_briefly(self):
+        manager = UserbotManager()
+        manager.entity_cache = EntityCache()
+        manager.client = SimpleNamespace(get_input_entity=mock.AsyncMock(side_effect=ValueError('not found')))
+
+        async def scenario():
+            for _ in range(3):
+                with self.assertRaises(ValueError):
+                    await manager.resolve_entity('@missing')
+
+        asyncio.run(scenario())
+        self.assertEqual(manager.client.get_input_entity.await_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
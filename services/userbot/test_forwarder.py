@@ -0,0 +1,242 @@
+import asyncio
+import time
+import unittest
+from datetime import datetime, timezone
+
+from telethon.errors import FloodWaitError, MessageIdInvalidError
+
+from services.userbot.forwarder import CLAIM_SQL, DONE_SQL, Forwarder, TokenBucket
+
+
+class FakeClient:
+    def __init__(self, failures=(), send_failures=()):
+        self.calls = []
+        self.sent = []
+        self.failures = list(failures)
+        self.send_failures = list(send_failures)
+
+    async def forward_messages(self, target, ids, from_peer=None):
+        if self.failures:
+            raise self.failures.pop(0)
+        self.calls.append((target, from_peer, list(ids)))
+
+    async def send_message(self, target, text):
+        failure = self.send_failures.pop(0) if self.send_failures else None
+        if failure:
+            raise failure
+        self.sent.append(text)
+
+
+class FakeConnection:
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def executemany(self, sql, rows):
+        self.pool.rows.extend(rows)
+
+    async def execute(self, sql, *args):
+        self.pool.executed.append((sql, args))
+
+    async def fetch(self, sql, *args):
+        self.pool.executed.append((sql, args))
+        rows, self.pool.claimable = self.pool.claimable, []
+        return rows
+
+    async def fetchval(self, sql, *args):
+        return len(self.pool.claimable)
+
+
+class FakeAcquire:
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def __aenter__(self):
+        return FakeConnection(self.pool)
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakePool:
+    def __init__(self, claimable=()):
+        self.rows = []
+        self.executed = []
+        self.claimable = list(claimable)
+
+    def acquire(self):
+        return FakeAcquire(self)
+
+
+def make_forwarder(client, pool=None, **kwargs):
+    async def resolve_peer(chat_id):
+        return f'peer:{chat_id}'
+
+    async def get_pool():
+        return pool
+
+    kwargs.setdefault('window_ms', 20)
+    kwargs.setdefault('rate', 1000)
+    return Forwarder(lambda: client, resolve_peer, 'our-bot', get_pool=get_pool if pool else None, **kwargs)
+
+
+class ForwarderTest(unittest.TestCase):
+    def test_burst_is_coalesced_per_chat(self):
+        client = FakeClient()
+
+        async def scenario():
+            forwarder = make_forwarder(client)
+            for message_id in range(1, 6):
+                await forwarder.submit(1, message_id, 'text')
+            await forwarder.submit(2, 10, 'text')
+            await forwarder.close()
+            return forwarder.stats()
+
+        stats = asyncio.run(scenario())
+        self.assertEqual(client.calls, [('our-bot', 'peer:1', [1, 2, 3, 4, 5]), ('our-bot', 'peer:2', [10])])
+        self.assertEqual((stats['forwarded'], stats['requests']), (6, 2))
+
+    def test_flood_wait_is_honored(self):
+        client = FakeClient(failures=[FloodWaitError(request=None, capture=0)])
+
+        async def scenario():
+            forwarder = make_forwarder(client)
+            await forwarder.submit(1, 1, 'text')
+            await forwarder.close()
+            return forwarder.stats()
+
+        stats = asyncio.run(scenario())
+        self.assertEqual(client.calls, [('our-bot', 'peer:1', [1])])
+        self.assertEqual(stats['flood_waits'], 1)
+
+    def test_long_flood_wait_goes_to_retry_queue(self):
+        client = FakeClient(failures=[FloodWaitError(request=None, capture=3600)])
+        pool = FakePool()
+
+        async def scenario():
+            forwarder = make_forwarder(client, pool, max_wait=60)
+            await forwarder.submit(1, 1, 'text')
+            await forwarder.close()
+
+        asyncio.run(scenario())
+        self.assertEqual(client.calls, [])
+        [(chat_id, message_id, _, attempts, next_attempt_at, error)] = pool.rows
+        self.assertEqual((chat_id, message_id, attempts), ('1', '1', 1))
+        self.assertIn('FloodWait', error)
+        self.assertIsNotNone(next_attempt_at)
+
+    def test_error_is_persisted_not_lost(self):
+        client = FakeClient(failures=[ConnectionError('network down')])
+        pool = FakePool()
+
+        async def scenario():
+            forwarder = make_forwarder(client, pool)
+            await forwarder.submit(1, 1, 'text')
+            await forwarder.close()
+
+        with self.assertLogs('userbot.forwarder', level='ERROR'):
+            asyncio.run(scenario())
+        self.assertEqual(len(pool.rows), 1)
+
+
+    def test_long_flood_wait_does_not_block_forwarder(self):
+        client = FakeClient(failures=[FloodWaitError(request=None, capture=3600)])
+        pool = FakePool()
+
+        async def scenario():
+            forwarder = make_forwarder(client, pool, max_wait=60)
+            await forwarder.submit(1, 1, 'text')
+            await asyncio.sleep(0.1)
+            start = time.monotonic()
+            await forwarder.submit(2, 2, 'text')
+            await forwarder.close()
+            return time.monotonic() - start, forwarder.stats()
+
+        elapsed, stats = asyncio.run(scenario())
+        self.assertLess(elapsed, 1)
+        self.assertEqual(client.calls, [])
+        self.assertEqual([row[:2] for row in pool.rows], [('1', '1'), ('2', '2')])
+        # Отложенное во время FloodWait - не неудачная попытка
+        self.assertEqual(pool.rows[1][3], 0)
+        self.assertEqual((stats['requests'], stats['deferred']), (1, 1))
+
+    def test_fallback_text_is_not_sent_twice(self):
+        client = FakeClient(
+            failures=[MessageIdInvalidError(request=None), MessageIdInvalidError(request=None)],
+            send_failures=[None, FloodWaitError(request=None, capture=0)],
+        )
+
+        async def scenario():
+            forwarder = make_forwarder(client)
+            await forwarder.submit(1, 1, 'first')
+            await forwarder.submit(1, 2, 'second')
+            await forwarder.close()
+            return forwarder.stats()
+
+        # Второй send_message упал с FloodWait: повтор пачки досылает только неотправленное
+        stats = asyncio.run(scenario())
+        self.assertEqual(client.sent, ['first', 'second'])
+        self.assertEqual(stats['fallback_sends'], 2)
+
+    def test_retry_queue_rows_are_leased_and_deleted_after_send(self):
+        client = FakeClient()
+        created_at = datetime.now(timezone.utc)
+        pool = FakePool(claimable=[
+            {'chat_id': '1', 'message_id': '7', 'text': 'text', 'attempts': 2, 'created_at': created_at},
+        ])
+
+        async def scenario():
+            forwarder = make_forwarder(client, pool, lease=600)
+            self.assertEqual(await forwarder.retry_due(), 1)
+            await forwarder.close()
+
+        asyncio.run(scenario())
+        self.assertNotIn('DELETE', CLAIM_SQL)
+        self.assertEqual(pool.executed[0], (CLAIM_SQL, (100, 600)))
+        self.assertEqual(client.calls, [('our-bot', 'peer:1', [7])])
+        self.assertEqual(pool.executed[-1], (DONE_SQL, (['1'], ['7'])))
+
+    def test_failed_retry_is_rescheduled_not_deleted(self):
+        client = FakeClient(failures=[ConnectionError('network down')])
+        created_at = datetime.now(timezone.utc)
+        pool = FakePool(claimable=[
+            {'chat_id': '1', 'message_id': '7', 'text': 'text', 'attempts': 2, 'created_at': created_at},
+        ])
+
+        async def scenario():
+            forwarder = make_forwarder(client, pool)
+            await forwarder.retry_due()
+            await forwarder.close()
+
+        with self.assertLogs('userbot.forwarder', level='ERROR'):
+            asyncio.run(scenario())
+        self.assertNotIn(DONE_SQL, [sql for sql, _ in pool.executed])
+        [(_, message_id, _, attempts, next_attempt_at, _)] = pool.rows
+        self.assertEqual((message_id, attempts), ('7', 3))
+        self.assertIsNotNone(next_attempt_at)
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_rate_limit(self):
+        async def scenario():
+            bucket = TokenBucket(rate=50, burst=2)
+            start = time.monotonic()
+            for _ in range(7):
+                await bucket.acquire()
+            return time.monotonic() - start
+
+        # 2 токена сразу, ещё 5 - по 20мс
+        self.assertGreaterEqual(asyncio.run(scenario()), 0.09)
+
+    def test_pause_blocks_bucket(self):
+        async def scenario():
+            bucket = TokenBucket(rate=1000, burst=5)
+            bucket.pause(0.05)
+            start = time.monotonic()
+            await bucket.acquire()
+            return time.monotonic() - start
+
+        self.assertGreaterEqual(asyncio.run(scenario()), 0.04)
+
+
+if __name__ == '__main__':
+    unittest.main()
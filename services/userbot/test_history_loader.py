@@ -0,0 +1,337 @@
+import asyncio
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from unittest import mock
+
+from telethon.errors import FloodWaitError
+
+from services.userbot import history_loader
+from services.userbot.history_loader import (
+    CREATE_STAGING_SQL, INSERT_FROM_STAGING_SQL, INSERT_ROW_SQL, STAGING_TABLE, HistoryLoader
+)
+from services.userbot.message_store import merge_ranges
+
+
+class FakeClient:
+    """Чат с сообщениями 1..count, сообщение id на (count - id) часов + 30 минут старше текущего"""
+
+    def __init__(self, count, fail_after=None):
+        self.count = count
+        self.fail_after = fail_after
+        self.yielded = 0
+        self.calls = []
+        self.now = datetime.now(timezone.utc)
+
+    def date_of(self, message_id):
+        return self.now - timedelta(hours=self.count - message_id, minutes=30)
+
+    async def iter_messages(self, entity, limit=None, offset_id=0, min_id=0, reverse=False):
+        self.calls.append((offset_id, min_id))
+        top = offset_id - 1 if offset_id else self.count
+        for index, message_id in enumerate(range(top, min_id, -1)):
+            if limit is not None and index >= limit:
+                return
+            if self.fail_after is not None and index == self.fail_after:
+                # Соединение рвётся один раз
+                self.fail_after = None
+                raise ConnectionError('connection lost')
+            self.yielded += 1
+            await asyncio.sleep(0)
+            yield SimpleNamespace(id=message_id, text=f'text {message_id}', date=self.date_of(message_id))
+
+
+class RecordingLoader(HistoryLoader):
+    """Вместо БД запоминает страницы, диапазоны и сколько сообщений было получено к моменту записи"""
+
+    def __init__(self, client, write_delay=0):
+        super().__init__(client, db_pool=object())
+        self.pages = []
+        self.in_flight = []
+        self.write_delay = write_delay
+        self.ranges = []
+
+    async def _resolve_entity(self, bot_id, bot_username):
+        return bot_username
+
+    async def _save_messages_to_db(self, messages):
+        self.in_flight.append(self.client.yielded - sum(len(page) for page in self.pages))
+        await asyncio.sleep(self.write_delay)
+        self.pages.append(messages)
+        return {'saved': len(messages), 'skipped': 0, 'errors': 0}
+
+    async def _load_ranges(self, chat_id):
+        return list(self.ranges)
+
+    async def _save_range(self, chat_id, new_range):
+        self.ranges = merge_ranges(self.ranges + [new_range])
+
+    async def _older_than(self, chat_id, low_id, cutoff_date):
+        return bool(cutoff_date) and self.client.date_of(low_id) < cutoff_date
+
+    def saved_ids(self):
+        return [int(message['telegram_message_id']) for page in self.pages for message in page]
+
+
+@mock.patch.object(history_loader, 'HISTORY_PAGE_SIZE', 10)
+@mock.patch.object(history_loader, 'HISTORY_QUEUE_PAGES', 2)
+class HistoryLoaderStreamingTest(unittest.TestCase):
+    def test_pages_are_written_while_fetching(self):
+        loader = RecordingLoader(FakeClient(95))
+        result = asyncio.run(loader.load_bot_history(1, '@bot'))
+
+        self.assertEqual(result, {
+            'loaded': 95, 'saved': 95, 'skipped': 0, 'errors': 0,
+            'sync': {'high_id': 95, 'low_id': 1, 'reaches_start': True}
+        })
+        self.assertEqual([len(page) for page in loader.pages], [10] * 9 + [5])
+        # Первая страница записана задолго до конца выборки
+        self.assertLess(loader.in_flight[0], 95)
+        self.assertEqual(loader.progress['1']['state'], 'done')
+        self.assertEqual(loader.progress['1']['pages_written'], 10)
+
+    def test_slow_writer_bounds_memory(self):
+        loader = RecordingLoader(FakeClient(200), write_delay=0.005)
+        asyncio.run(loader.load_bot_history(1, '@bot'))
+
+        # Не больше очереди + страницы у писателя + собираемой страницы
+        self.assertLessEqual(max(loader.in_flight), (2 + 2) * 10)
+
+    def test_failure_keeps_fetched_pages(self):
+        loader = RecordingLoader(FakeClient(100, fail_after=35))
+        with self.assertLogs('userbot.history_loader', level='ERROR'):
+            result = asyncio.run(loader.load_bot_history(1, '@bot'))
+
+        self.assertEqual(result['saved'], 35)
+        self.assertEqual(result['error_message'], 'connection lost')
+        self.assertEqual(result['sync'], {'high_id': 100, 'low_id': 66, 'reaches_start': False})
+        self.assertEqual(loader.progress['1']['state'], 'failed')
+
+    def test_flood_wait_is_reported(self):
+        client = FakeClient(50)
+        loader = RecordingLoader(client)
+        with mock.patch.object(client, 'iter_messages',
+                               side_effect=FloodWaitError(request=None, capture=120)), \
+                self.assertLogs('userbot.history_loader', level='WARNING'):
+            result = asyncio.run(loader.load_bot_history(1, '@bot'))
+
+        self.assertEqual(result['flood_wait'], 120)
+        self.assertEqual(result['errors'], 1)
+
+    def test_days_cutoff(self):
+        loader = RecordingLoader(FakeClient(100))
+        result = asyncio.run(loader.load_bot_history(1, '@bot', days=1))
+        self.assertEqual(result['loaded'], 24)
+        self.assertEqual(loader.ranges, [(77, 100, False)])
+
+
+@mock.patch.object(history_loader, 'HISTORY_PAGE_SIZE', 10)
+class HistoryLoaderIncrementalTest(unittest.TestCase):
+    def test_routine_sync_fetches_only_new_messages(self):
+        client = FakeClient(50)
+        loader = RecordingLoader(client)
+
+        async def scenario():
+            await loader.load_bot_history(1, '@bot')
+            client.count = 53
+            client.calls.clear()
+            loader.pages.clear()
+            return await loader.load_bot_history(1, '@bot')
+
+        result = asyncio.run(scenario())
+        self.assertEqual(loader.saved_ids(), [53, 52, 51])
+        self.assertEqual(client.calls, [(0, 50)])
+        self.assertEqual(result['sync'], {'high_id': 53, 'low_id': 1, 'reaches_start': True})
+
+    def test_interrupted_backfill_resumes_from_checkpoint(self):
+        client = FakeClient(100, fail_after=42)
+        loader = RecordingLoader(client)
+
+        async def scenario():
+            with self.assertLogs('userbot.history_loader', level='ERROR'):
+                await loader.load_bot_history(1, '@bot')
+            loader.pages.clear()
+            client.calls.clear()
+            return await loader.load_bot_history(1, '@bot')
+
+        result = asyncio.run(scenario())
+        # Новых нет (один пустой запрос), дальше - с контрольной точки 59
+        self.assertEqual(client.calls, [(0, 100), (59, 0)])
+        self.assertEqual(loader.saved_ids(), list(range(58, 0, -1)))
+        self.assertEqual(result['sync'], {'high_id': 100, 'low_id': 1, 'reaches_start': True})
+
+    def test_days_window_already_synced_is_skipped(self):
+        client = FakeClient(100)
+        loader = RecordingLoader(client)
+
+        async def scenario():
+            await loader.load_bot_history(1, '@bot', days=2)
+            client.calls.clear()
+            return await loader.load_bot_history(1, '@bot', days=1)
+
+        result = asyncio.run(scenario())
+        self.assertEqual(client.calls, [(0, 100)])
+        self.assertEqual(result['loaded'], 0)
+
+
+class FakeTransaction:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeConnection:
+    """bot_messages с уникальным (chat_id, message_id); existing - уже сохранённые ключи"""
+
+    def __init__(self, existing=(), copy_error=None):
+        self.keys = set(existing)
+        self.copy_error = copy_error
+        self.staging = []
+        self.calls = []
+
+    def transaction(self):
+        return FakeTransaction()
+
+    async def execute(self, sql, *args):
+        self.calls.append(sql)
+
+    async def copy_records_to_table(self, table, records, columns):
+        self.calls.append(('COPY', table, len(records)))
+        if self.copy_error:
+            raise self.copy_error
+        self.staging = [dict(zip(columns, record)) for record in records]
+
+    async def fetch(self, sql, *args):
+        self.calls.append(sql)
+        inserted = []
+        for row in self.staging:
+            key = (row['chat_id'], row['message_id'])
+            if key not in self.keys:
+                self.keys.add(key)
+                inserted.append({'?column?': 1})
+        self.staging = []
+        return inserted
+
+    async def fetchrow(self, sql, *args):
+        self.calls.append(sql)
+        if args[5] is None:
+            raise ValueError('text is null')
+        key = (args[2], args[3])
+        if key in self.keys:
+            return None
+        self.keys.add(key)
+        return {'?column?': 1}
+
+
+class FakePool:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def acquire(self):
+        conn = self.conn
+
+        class Acquire:
+            async def __aenter__(self):
+                return conn
+
+            async def __aexit__(self, *exc):
+                return False
+
+        return Acquire()
+
+
+def make_page(ids, text='text'):
+    now = datetime.now(timezone.utc)
+    return [{'bot_id': 1, 'telegram_message_id': str(message_id), 'text': text, 'timestamp': now}
+            for message_id in ids]
+
+
+class HistoryLoaderBulkInsertTest(unittest.TestCase):
+    def test_page_is_copied_and_inserted_once(self):
+        conn = FakeConnection(existing={('1', '2')})
+        loader = HistoryLoader(None, db_pool=FakePool(conn))
+        result = asyncio.run(loader._save_messages_to_db(make_page([1, 2, 3, 3])))
+
+        self.assertEqual(result, {'saved': 2, 'skipped': 2, 'errors': 0})
+        self.assertEqual(conn.calls, [CREATE_STAGING_SQL, ('COPY', STAGING_TABLE, 4), INSERT_FROM_STAGING_SQL])
+
+    def test_copy_failure_falls_back_to_rows(self):
+        conn = FakeConnection(existing={('1', '1')}, copy_error=ValueError('invalid input'))
+        loader = HistoryLoader(None, db_pool=FakePool(conn))
+        page = make_page([1, 2]) + make_page([3], text=None)
+        with self.assertLogs('userbot.history_loader', level='WARNING'):
+            result = asyncio.run(loader._save_messages_to_db(page))
+
+        self.assertEqual(result, {'saved': 1, 'skipped': 1, 'errors': 1})
+        self.assertEqual(conn.calls[-3:], [INSERT_ROW_SQL] * 3)
+
+
+class MultiBotLoader(HistoryLoader):
+    """load_bot_history по сценарию: список результатов/исключений на бота"""
+
+    def __init__(self, scripts, delay=0.05):
+        super().__init__(None, db_pool=object())
+        self.scripts = {bot_id: list(script) for bot_id, script in scripts.items()}
+        self.delay = delay
+        self.active = 0
+        self.max_active = 0
+        self.started = []
+
+    async def load_bot_history(self, bot_id, bot_username, limit=None, days=None):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        self.started.append((bot_id, time.monotonic()))
+        try:
+            await asyncio.sleep(self.delay)
+            outcome = self.scripts[bot_id].pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+        finally:
+            self.active -= 1
+
+
+def ok(loaded, saved):
+    return {'loaded': loaded, 'saved': saved, 'skipped': loaded - saved, 'errors': 0}
+
+
+@mock.patch.object(history_loader, 'HISTORY_BOTS_RATE', 1000)
+class LoadAllBotsTest(unittest.TestCase):
+    bots = [{'id': index, 'username': f'@bot{index}', 'name': f'Bot {index}'} for index in range(4)]
+
+    def test_bots_load_concurrently_with_limit(self):
+        loader = MultiBotLoader({index: [ok(10, 5)] for index in range(4)})
+        started = time.monotonic()
+        result = asyncio.run(loader.load_all_bots_history(self.bots, concurrency=2))
+
+        self.assertEqual(loader.max_active, 2)
+        self.assertLess(time.monotonic() - started, 0.18)
+        self.assertEqual((result['total_loaded'], result['total_saved']), (40, 20))
+        self.assertEqual(list(result['bots']), ['@bot0', '@bot1', '@bot2', '@bot3'])
+
+    def test_failure_is_isolated(self):
+        loader = MultiBotLoader({0: [ok(3, 3)], 1: [RuntimeError('boom')], 2: [ok(2, 1)], 3: [ok(0, 0)]})
+        with self.assertLogs('userbot.history_loader', level='ERROR'):
+            result = asyncio.run(loader.load_all_bots_history(self.bots, concurrency=4))
+
+        self.assertEqual(result['bots']['@bot1']['error_message'], 'boom')
+        self.assertEqual(result['bots']['@bot2'], ok(2, 1))
+        self.assertEqual(result['total_saved'], 4)
+
+    def test_flood_wait_pauses_and_retries(self):
+        flooded = {'loaded': 4, 'saved': 4, 'skipped': 0, 'errors': 1,
+                   'error_message': 'A wait of 1 seconds is required', 'flood_wait': 0.1}
+        loader = MultiBotLoader({0: [flooded, ok(6, 6)], 1: [ok(1, 1)], 2: [ok(1, 1)], 3: [ok(1, 1)]})
+        result = asyncio.run(loader.load_all_bots_history(self.bots, concurrency=1))
+
+        self.assertEqual(result['bots']['@bot0'], ok(10, 10))
+        # Следующая попытка стартует не раньше паузы FloodWait
+        (_, first), (_, retry) = [item for item in loader.started if item[0] == 0]
+        self.assertGreaterEqual(retry - first, 0.1 + loader.delay - 0.01)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import asyncio
+import unittest
+from datetime import datetime, timezone
+from unittest import mock
+
+from services.userbot import message_parser
+from services.userbot.message_parser import parse_message, parse_message_sync, to_operations, ui_payload
+
+
+# Результаты classify_and_parse (классификаторы OCR-сервиса)
+CARDXABAR = {
+    'classifier': 'CardXabarClassifier',
+    'confidence': 100,
+    'data': {
+        'operator': 'KORZINKA SAMARQAND DARVOZA', 'amount': 50000.0, 'currency': 'UZS',
+        'datetime': '2025-01-15 14:30:00', 'card_last4': '6543', 'card_type': 'HUMOCARD',
+        'balance': 1000000.0, 'is_income': False, 'transaction_type': 'Оплата',
+        'is_p2p': False, 'app_name': 'CardXabar', 'source': 'bot', 'confidence': 100,
+    },
+}
+UZUM_SMS = {
+    'classifier': 'UzumSmsClassifier',
+    'confidence': 70,
+    'data': {
+        'operator': 'UZUM MARKET', 'amount': 25000.0, 'card_last4': '1234', 'balance': 100500.0,
+        'is_income': False, 'is_p2p': False, 'transaction_type': 'Оплата', 'direction': 'debit',
+        'index': 0, 'currency': 'UZS', 'datetime': None, 'app_name': 'Uzum Bank', 'source': 'bot',
+        'confidence': 70,
+        'operations': [
+            {'operator': 'UZUM MARKET', 'amount': 25000.0, 'card_last4': '1234', 'balance': 100500.0,
+             'is_income': False, 'is_p2p': False, 'transaction_type': 'Оплата',
+             'direction': 'debit', 'index': 0},
+            {'operator': 'IVAN I', 'amount': 300000.0, 'card_last4': '1234', 'balance': 400500.0,
+             'is_income': True, 'is_p2p': False, 'transaction_type': 'Пополнение',
+             'direction': 'credit', 'index': 1},
+        ],
+    },
+}
+
+
+class ToOperationsTest(unittest.TestCase):
+    def test_cardxabar(self):
+        [operation] = to_operations(CARDXABAR)
+        self.assertEqual(operation['amount'], 50000.0)
+        self.assertEqual(operation['operator'], 'KORZINKA SAMARQAND DARVOZA')
+        self.assertEqual(operation['cardLast4'], '6543')
+        self.assertEqual(operation['datetime'], '2025-01-15T14:30:00')
+        self.assertEqual(operation['balance'], 1000000.0)
+        self.assertFalse(operation['isIncome'])
+        self.assertEqual(operation['metadata'], {'parser': 'cardxabar', 'card_type': 'HUMOCARD'})
+
+    def test_uzum_sms_uses_message_date(self):
+        date = datetime(2025, 1, 15, 9, 30, tzinfo=timezone.utc)
+        debit, credit = to_operations(UZUM_SMS, date)
+        self.assertEqual((debit['amount'], debit['operator'], debit['isIncome']), (25000.0, 'UZUM MARKET', False))
+        self.assertEqual((credit['amount'], credit['operator'], credit['isIncome']), (300000.0, 'IVAN I', True))
+        self.assertEqual(debit['datetime'], date.isoformat())
+        self.assertEqual(credit['metadata']['direction'], 'credit')
+
+    def test_receipt_classifiers_go_to_backend(self):
+        self.assertIsNone(to_operations({**CARDXABAR, 'classifier': 'GenericBankClassifier'}))
+
+
+class UiPayloadTest(unittest.TestCase):
+    def test_payload_matches_backend_fields(self):
+        payload = ui_payload(to_operations(CARDXABAR))
+        self.assertEqual(payload['amount'], -50000.0)
+        self.assertEqual(payload['merchant'], 'KORZINKA SAMARQAND DARVOZA')
+        self.assertEqual((payload['date'], payload['time']), ('15.01.2025', '14:30'))
+
+    def test_sms_time_is_local(self):
+        operations = to_operations(UZUM_SMS, datetime(2025, 1, 15, 9, 30, tzinfo=timezone.utc))
+        self.assertEqual(ui_payload(operations)['time'], '14:30')
+
+
+class ParseMessageTest(unittest.TestCase):
+    def test_known_formats_are_parsed_in_process(self):
+        cardxabar = (
+            '💸 Оплата\n➖ 50 000.00 UZS\n📍 KORZINKA SAMARQAND DARVOZA\n💳 HUMOCARD *6543\n'
+            '🕓 14:30 15.01.2025\n💰 1 000 000.00 UZS'
+        )
+        sms = 'Spisanie, karta ***1234: 25000.00 UZS, UZUM MARKET. Dostupno: 100500.00 UZS'
+        date = datetime(2025, 1, 15, 9, 30, tzinfo=timezone.utc)
+
+        async def scenario():
+            return await parse_message(cardxabar), await parse_message(sms, date)
+
+        [operation], [debit] = asyncio.run(scenario())
+        self.assertEqual((operation['amount'], operation['cardLast4']), (50000.0, '6543'))
+        self.assertEqual(operation['metadata']['parser'], 'cardxabar')
+        self.assertEqual((debit['amount'], debit['datetime']), (25000.0, date.isoformat()))
+
+    def test_unknown_text_goes_to_backend(self):
+        self.assertIsNone(asyncio.run(parse_message('Привет, как дела?')))
+        self.assertIsNone(asyncio.run(parse_message('')))
+
+    def test_receipt_formats_go_to_backend(self):
+        text = (
+            'UZUM Bank\nТранзакция успешно завершена\nПродавец: KORZINKA\n'
+            'Сумма: 150 000 UZS\nДата: 15.01.2025 14:30\nКарта: *1234'
+        )
+        self.assertIsNone(parse_message_sync(text))
+
+    def test_parser_failure_goes_to_backend(self):
+        with mock.patch.object(message_parser, 'classify_and_parse', side_effect=RuntimeError('boom')), \
+                self.assertLogs('userbot.message_parser', level='WARNING'):
+            self.assertIsNone(parse_message_sync('text'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,202 @@
+import asyncio
+import unittest
+from datetime import datetime, timezone
+
+from services.userbot.message_store import (
+    INSERT_RANGES_SQL, MARK_DELETED_SQL, RANGES_SQL, MessageStore, covering_range, lower_bound, merge_ranges,
+    plan_ranges
+)
+
+
+class FakeTelegram:
+    """Чат с сообщениями 1..count; id из no_text - без текста"""
+
+    def __init__(self, count, no_text=()):
+        self.count = count
+        self.no_text = set(no_text)
+        self.calls = []
+
+    async def fetch(self, chat_id, offset_id=0, min_id=0, limit=50):
+        self.calls.append((offset_id, min_id, limit))
+        top = offset_id - 1 if offset_id else self.count
+        ids = [message_id for message_id in range(top, min_id, -1)][:limit]
+        return [{
+            'id': message_id,
+            'sender_id': 42,
+            'date': datetime(2026, 1, 1, tzinfo=timezone.utc),
+            'text': '' if message_id in self.no_text else f'text {message_id}',
+        } for message_id in ids]
+
+
+class InMemoryStore(MessageStore):
+    """MessageStore с bot_messages и bot_message_ranges в памяти"""
+
+    def __init__(self, telegram):
+        super().__init__(None, telegram.fetch)
+        self.rows = {}
+        self.saved_ranges = []
+
+    async def _ranges(self, chat_id):
+        return list(self.saved_ranges)
+
+    async def _read(self, chat_id, high, low, limit):
+        ids = sorted((message_id for message_id in self.rows if low <= message_id <= high), reverse=True)
+        return [self.rows[message_id] for message_id in ids[:limit]]
+
+    async def _write(self, chat_id, messages, new_range):
+        for message in messages:
+            self.rows.setdefault(message['id'], self._from_remote(chat_id, message))
+        self.saved_ranges = merge_ranges(self.saved_ranges + [new_range])
+
+
+class FakeConnection:
+    """asyncpg-соединение: fetch отдаёт ranges, execute записывается"""
+
+    def __init__(self, ranges=()):
+        self.ranges = list(ranges)
+        self.fetched = []
+        self.executed = []
+
+    async def fetch(self, sql, *args):
+        self.fetched.append((sql, args))
+        return self.ranges
+
+    async def execute(self, sql, *args):
+        self.executed.append((sql, args))
+
+    def transaction(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakePool:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def acquire(self):
+        return self.conn
+
+
+def range_row(low, high, reaches_start=False, updated_at=None, fresh=True):
+    return {'low_id': low, 'high_id': high, 'reaches_start': reaches_start,
+            'updated_at': updated_at, 'fresh': fresh}
+
+
+def ids(page):
+    return [int(message['message_id']) for message in page]
+
+
+class RangesTest(unittest.TestCase):
+    def test_merge_overlapping_and_adjacent(self):
+        merged = merge_ranges([(1, 10, True), (11, 20, False), (30, 40, False), (35, 50, False)])
+        self.assertEqual(merged, [(30, 50, False), (1, 20, True)])
+
+    def test_covering_and_lower_bound(self):
+        ranges = [(30, 50, False), (1, 20, True)]
+        self.assertEqual(covering_range(ranges, 15), (1, 20, True))
+        self.assertIsNone(covering_range(ranges, 25))
+        self.assertEqual(lower_bound(ranges, 25), 20)
+        self.assertEqual(lower_bound(ranges, None), 50)
+        self.assertEqual(lower_bound([(5, 9, False)], 3), 0)
+
+    def test_plan_keeps_oldest_check_and_trims_stale(self):
+        checked = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        stale_at = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        rows = [range_row(60, 80, updated_at=checked), range_row(1, 50, True, stale_at, fresh=False)]
+
+        merged, stored = plan_ranges(rows, (40, 59, False))
+        self.assertEqual(merged, [(40, 80, False)])
+        self.assertEqual(stored, [(40, 80, False, checked), (1, 39, True, stale_at)])
+
+    def test_plan_new_range_is_checked_now(self):
+        merged, stored = plan_ranges([], (1, 10, True))
+        self.assertEqual(merged, [(1, 10, True)])
+        self.assertEqual(stored, [(1, 10, True, None)])
+
+
+class MessageStoreTest(unittest.TestCase):
+    def test_second_visit_is_served_from_db(self):
+        telegram = FakeTelegram(120)
+        store = InMemoryStore(telegram)
+
+        async def scenario():
+            first = await store.page('1', limit=50)
+            second = await store.page('1', limit=50, before_message_id=first[-1]['message_id'])
+            calls_after_scroll = len(telegram.calls)
+            again = await store.page('1', limit=50)
+            again_second = await store.page('1', limit=50, before_message_id=again[-1]['message_id'])
+            return first, second, calls_after_scroll, again, again_second
+
+        first, second, calls_after_scroll, again, again_second = asyncio.run(scenario())
+        self.assertEqual(ids(first), list(range(120, 70, -1)))
+        self.assertEqual(ids(second), list(range(70, 20, -1)))
+        self.assertEqual(calls_after_scroll, 2)
+        # Повторный просмотр: один пустой запрос о новых сообщениях, остальное из БД
+        self.assertEqual(ids(again), ids(first))
+        self.assertEqual(ids(again_second), ids(second))
+        self.assertEqual(telegram.calls[2:], [(0, 120, 50)])
+        self.assertEqual(store.saved_ranges, [(21, 120, False)])
+
+    def test_new_messages_fill_only_the_top_gap(self):
+        telegram = FakeTelegram(60)
+        store = InMemoryStore(telegram)
+
+        async def scenario():
+            await store.page('1', limit=30)
+            telegram.count = 65
+            return await store.page('1', limit=30)
+
+        page = asyncio.run(scenario())
+        self.assertEqual(ids(page), list(range(65, 35, -1)))
+        self.assertEqual(telegram.calls[-1], (0, 60, 30))
+        self.assertEqual(store.saved_ranges, [(31, 65, False)])
+
+    def test_start_of_chat_is_remembered(self):
+        telegram = FakeTelegram(10, no_text={3})
+        store = InMemoryStore(telegram)
+
+        async def scenario():
+            first = await store.page('1', limit=50)
+            calls = len(telegram.calls)
+            tail = await store.page('1', limit=50, before_message_id=5)
+            return first, calls, tail
+
+        first, calls, tail = asyncio.run(scenario())
+        self.assertEqual(ids(first), [10, 9, 8, 7, 6, 5, 4, 2, 1])
+        self.assertEqual(store.saved_ranges, [(1, 10, True)])
+        self.assertEqual(ids(tail), [4, 2, 1])
+        self.assertEqual(len(telegram.calls), calls)
+
+    def test_stale_ranges_are_not_served(self):
+        conn = FakeConnection([range_row(1, 50, True, fresh=False)])
+
+        async def get_pool():
+            return FakePool(conn)
+
+        store = MessageStore(get_pool, None, range_ttl=60)
+        ranges = asyncio.run(store._ranges('1'))
+        self.assertEqual(ranges, [])
+        self.assertEqual(conn.fetched, [(RANGES_SQL, ('1', 60))])
+
+    def test_recheck_marks_missing_messages_deleted(self):
+        conn = FakeConnection()
+
+        async def get_pool():
+            return FakePool(conn)
+
+        store = MessageStore(get_pool, None, range_ttl=60)
+        message = {'id': 7, 'sender_id': 42, 'date': None, 'text': 'edited'}
+        asyncio.run(store._write('1', [message], (5, 9, False)))
+
+        executed = {sql: args for sql, args in conn.executed}
+        self.assertEqual(executed[MARK_DELETED_SQL], ('1', 5, 9, ['7']))
+        self.assertEqual(executed[INSERT_RANGES_SQL], ('1', [5], [9], [False], [None]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,237 @@
+import asyncio
+import json
+import unittest
+
+from services.userbot.outbox import (
+    CLAIM_SQL, DONE_SQL, RETRY_BASE_SEC, RETRY_MAX_SEC, RETRY_SQL, Outbox, build_item, retry_delay
+)
+
+
+class FakeConnection:
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def fetch(self, sql, *args):
+        assert sql == CLAIM_SQL
+        limit = args[0]
+        rows, self.pool.claimable = self.pool.claimable[:limit], self.pool.claimable[limit:]
+        self.pool.claims.append(limit)
+        return rows
+
+    async def fetchval(self, sql, *args):
+        return 0
+
+    async def execute(self, sql, *args):
+        self.pool.executed.append((sql, args))
+
+
+class FakeAcquire:
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def __aenter__(self):
+        return FakeConnection(self.pool)
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakePool:
+    def __init__(self, rows):
+        self.claimable = list(rows)
+        self.executed = []
+        self.claims = []
+
+    def acquire(self):
+        return FakeAcquire(self)
+
+
+class FakeResponse:
+    def __init__(self, status, body):
+        self.status = status
+        self.body = body
+
+    async def text(self):
+        return json.dumps(self.body)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeSession:
+    def __init__(self, status=200, body=None, error=None):
+        self.status = status
+        self.body = body if body is not None else {'success': True, 'data': {'errors': []}}
+        self.error = error
+        self.posts = []
+
+    def post(self, url, json=None, timeout=None):
+        self.posts.append((url, json))
+        if self.error:
+            raise self.error
+        return FakeResponse(self.status, self.body)
+
+
+class SlowResponse(FakeResponse):
+    def __init__(self, session):
+        super().__init__(200, {'success': True, 'data': {'errors': []}})
+        self.session = session
+
+    async def __aenter__(self):
+        self.session.active += 1
+        self.session.peak = max(self.session.peak, self.session.active)
+        await asyncio.sleep(0.05)
+        self.session.active -= 1
+        return self
+
+
+class SlowSession(FakeSession):
+    def __init__(self):
+        super().__init__()
+        self.active = 0
+        self.peak = 0
+
+    def post(self, url, json=None, timeout=None):
+        self.posts.append((url, json))
+        return SlowResponse(self)
+
+
+def make_row(record_id, data=None, attempts=1):
+    return {
+        'id': record_id,
+        'chat_id': '915326936',
+        'message_id': str(record_id),
+        'text': 'Оплата 10 000 UZS',
+        'data': json.dumps(data) if data is not None else None,
+        'dispatch_attempts': attempts,
+    }
+
+
+def run_once(pool, session):
+    async def get_pool():
+        return pool
+
+    async def get_session():
+        return session
+
+    async def scenario():
+        outbox = Outbox(get_pool, get_session, 'http://backend/api/userbot-chat/process-multiple')
+        sent = await outbox.dispatch_once()
+        return sent, outbox.stats()
+
+    return asyncio.run(scenario())
+
+
+def run_workers(pool, session, **kwargs):
+    async def get_pool():
+        return pool
+
+    async def get_session():
+        return session
+
+    async def scenario():
+        outbox = Outbox(get_pool, get_session, 'http://backend/api/userbot-chat/process-multiple',
+                        poll_interval=0.01, **kwargs)
+        outbox.start()
+        while pool.claimable:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.1)
+        await outbox.close()
+        return outbox.stats()
+
+    return asyncio.run(scenario())
+
+
+class OutboxTest(unittest.TestCase):
+    def test_build_item_passes_local_operations(self):
+        operations = [{'amount': 10000, 'currency': 'UZS'}]
+        item = build_item(make_row(1, {'operations': operations}))
+        self.assertEqual(item['record_id'], '1')
+        self.assertEqual(item['parsed'], operations)
+        self.assertNotIn('parsed', build_item(make_row(2)))
+
+    def test_retry_delay_is_exponential_and_capped(self):
+        self.assertEqual(retry_delay(1), RETRY_BASE_SEC)
+        self.assertEqual(retry_delay(3), RETRY_BASE_SEC * 4)
+        self.assertEqual(retry_delay(50), RETRY_MAX_SEC)
+
+    def test_batch_is_sent_in_one_request(self):
+        pool = FakePool([make_row(1), make_row(2)])
+        session = FakeSession()
+        sent, stats = run_once(pool, session)
+
+        self.assertEqual(sent, 2)
+        self.assertEqual(len(session.posts), 1)
+        self.assertEqual([item['record_id'] for item in session.posts[0][1]['messages']], ['1', '2'])
+        self.assertEqual(pool.executed, [(DONE_SQL, ([1, 2],))])
+        self.assertEqual(stats['sent'], 2)
+
+    def test_unexpected_item_error_is_retried(self):
+        pool = FakePool([make_row(1), make_row(2)])
+        session = FakeSession(body={'success': True, 'data': {'errors': [
+            {'recordId': '2', 'code': 'UNEXPECTED', 'detail': 'timeout'},
+        ]}})
+        run_once(pool, session)
+
+        self.assertEqual(pool.executed[0], (DONE_SQL, ([1],)))
+        sql, (ids, delay, _, _) = pool.executed[1]
+        self.assertEqual((sql, ids, delay), (RETRY_SQL, [2], float(RETRY_BASE_SEC)))
+
+    def test_server_error_schedules_retry(self):
+        pool = FakePool([make_row(1, attempts=2)])
+        with self.assertLogs('userbot.outbox', level='WARNING'):
+            sent, stats = run_once(pool, FakeSession(status=502))
+
+        self.assertEqual(sent, 1)
+        [(sql, (ids, delay, _, error))] = pool.executed
+        self.assertEqual((sql, ids, delay), (RETRY_SQL, [1], float(RETRY_BASE_SEC * 2)))
+        self.assertIn('502', error)
+        self.assertEqual(stats['http_errors'], 1)
+
+    def test_client_error_drops_only_named_rows(self):
+        pool = FakePool([make_row(1), make_row(2), make_row(3)])
+        session = FakeSession(status=422, body={'success': False, 'data': {'errors': [
+            {'recordId': '2', 'code': 'BAD_REQUEST', 'detail': 'raw_text is required'},
+        ]}})
+        with self.assertLogs('userbot.outbox', level='ERROR'):
+            _, stats = run_once(pool, session)
+
+        self.assertEqual(pool.executed[0], (DONE_SQL, ([2],)))
+        sql, (ids, _, _, _) = pool.executed[1]
+        self.assertEqual((sql, ids), (RETRY_SQL, [1, 3]))
+        self.assertEqual(stats['rejected'], 1)
+
+    def test_client_error_without_details_retries_batch(self):
+        pool = FakePool([make_row(1), make_row(2)])
+        with self.assertLogs('userbot.outbox', level='ERROR'):
+            _, stats = run_once(pool, FakeSession(status=413, body={'success': False}))
+
+        sql, (ids, _, _, _) = pool.executed[1]
+        self.assertEqual((sql, ids), (RETRY_SQL, [1, 2]))
+        # Слишком большая пачка: следующая вдвое меньше
+        self.assertEqual(stats['batch_limit'], 1)
+
+    def test_timeout_halves_next_batch(self):
+        pool = FakePool([make_row(index) for index in range(1, 21)])
+        with self.assertLogs('userbot.outbox', level='WARNING'):
+            _, stats = run_once(pool, FakeSession(error=asyncio.TimeoutError()))
+
+        self.assertEqual(stats['batch_limit'], 10)
+        [(sql, (ids, _, _, _))] = pool.executed
+        self.assertEqual((sql, len(ids)), (RETRY_SQL, 20))
+
+    def test_workers_send_batches_concurrently(self):
+        pool = FakePool([make_row(index) for index in range(1, 7)])
+        session = SlowSession()
+        stats = run_workers(pool, session, workers=3, batch_size=2)
+
+        self.assertEqual(stats['sent'], 6)
+        self.assertEqual(len(session.posts), 3)
+        self.assertEqual(session.peak, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
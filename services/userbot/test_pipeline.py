@@ -0,0 +1,125 @@
+import asyncio
+import unittest
+
+from services.userbot.pipeline import Pipeline, Stage
+
+
+class PipelineTest(unittest.TestCase):
+    def test_items_flow_through_stages(self):
+        seen = []
+
+        async def double(item):
+            return item * 2
+
+        async def skip_odd(item):
+            return item if item % 4 == 0 else None
+
+        async def collect(item):
+            seen.append(item)
+
+        async def scenario():
+            pipeline = Pipeline([Stage('double', double), Stage('filter', skip_odd), Stage('sink', collect)])
+            for item in range(10):
+                await pipeline.submit(item)
+            await pipeline.stop()
+            return pipeline.stats()
+
+        stats = asyncio.run(scenario())
+        self.assertEqual(sorted(seen), [0, 4, 8, 12, 16])
+        self.assertEqual(stats['filter']['processed'], 10)
+        self.assertEqual(stats['filter']['passed'], 5)
+        self.assertIsNotNone(stats['sink']['latency_ms'])
+
+    def test_slow_stage_applies_backpressure_without_loss(self):
+        seen = []
+
+        async def scenario():
+            gate = asyncio.Event()
+
+            async def slow(item):
+                await gate.wait()
+                seen.append(item)
+
+            async def passthrough(item):
+                return item
+
+            pipeline = Pipeline([
+                Stage('first', passthrough, maxsize=2),
+                Stage('slow', slow, maxsize=2),
+            ])
+            producer = asyncio.ensure_future(asyncio.gather(*(pipeline.submit(n) for n in range(20))))
+            await asyncio.sleep(0.05)
+            # Очереди заполнены: отправитель ждёт, ничего не отброшено
+            self.assertFalse(producer.done())
+            self.assertEqual(pipeline.stats()['slow']['depth'], 2)
+            gate.set()
+            await producer
+            await pipeline.stop()
+
+        asyncio.run(scenario())
+        self.assertEqual(sorted(seen), list(range(20)))
+
+    def test_handler_error_is_counted(self):
+        async def broken(item):
+            raise RuntimeError('boom')
+
+        async def scenario():
+            pipeline = Pipeline([Stage('broken', broken)])
+            await pipeline.submit(1)
+            await pipeline.stop()
+            return pipeline.stats()
+
+        with self.assertLogs('userbot.pipeline', level='ERROR'):
+            stats = asyncio.run(scenario())
+        self.assertEqual(stats['broken']['errors'], 1)
+
+    def test_failed_item_is_retried(self):
+        attempts = []
+        seen = []
+
+        async def flaky(item):
+            attempts.append(item)
+            if len(attempts) < 3:
+                raise ConnectionError('db down')
+            return item
+
+        async def collect(item):
+            seen.append(item)
+
+        async def scenario():
+            pipeline = Pipeline([Stage('flaky', flaky, retries=2, retry_delay=0), Stage('sink', collect)])
+            await pipeline.submit(7)
+            await pipeline.stop()
+            return pipeline.stats()
+
+        stats = asyncio.run(scenario())
+        self.assertEqual(seen, [7])
+        self.assertEqual(stats['flaky']['retried'], 2)
+        self.assertEqual(stats['flaky']['dead_letters'], 0)
+
+    def test_exhausted_item_goes_to_dead_letter(self):
+        dead = []
+
+        async def broken(item):
+            raise RuntimeError('boom')
+
+        async def on_error(item, error):
+            dead.append((item, str(error)))
+
+        async def scenario():
+            stage = Stage('broken', broken, retries=1, retry_delay=0, on_error=on_error,
+                          describe=lambda item: f'message {item}')
+            pipeline = Pipeline([stage])
+            await pipeline.submit(42)
+            await pipeline.stop()
+            return pipeline.stats()
+
+        with self.assertLogs('userbot.pipeline', level='ERROR') as logs:
+            stats = asyncio.run(scenario())
+        self.assertEqual(dead, [(42, 'boom')])
+        self.assertEqual(stats['broken']['dead_letters'], 1)
+        self.assertTrue(any('message 42' in line for line in logs.output))
+
+
+if __name__ == '__main__':
+    unittest.main()
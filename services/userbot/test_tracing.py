@@ -0,0 +1,65 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from services.userbot.tracing import Tracer, parse_sample_rates
+
+
+class TracerTest(unittest.TestCase):
+    def test_ring_buffer_keeps_latest(self):
+        tracer = Tracer(path='', buffer_size=3)
+        for index in range(5):
+            tracer.trace('db_upsert', index=index)
+        self.assertEqual([record['data']['index'] for record in tracer.recent()], [2, 3, 4])
+        self.assertEqual([record['seq'] for record in tracer.recent(2)], [4, 5])
+
+    def test_recent_filters_by_event(self):
+        tracer = Tracer(path='')
+        tracer.trace('db_upsert', inserted=True)
+        tracer.trace('skip_old_message', age_seconds=900)
+        self.assertEqual([record['event'] for record in tracer.recent(event='skip_old_message')],
+                         ['skip_old_message'])
+
+    def test_sampling_per_event(self):
+        tracer = Tracer(path='', sample_rate=1, event_rates={'db_upsert': 0})
+        tracer.trace('db_upsert')
+        tracer.trace('loop_ready')
+        self.assertEqual([record['event'] for record in tracer.recent()], ['loop_ready'])
+        self.assertEqual(tracer.stats()['sampled_out'], 1)
+
+    def test_parse_sample_rates(self):
+        with self.assertLogs('userbot.tracing', level='WARNING'):
+            rates = parse_sample_rates('db_upsert=0.1, loop_ready=5,bad=x,')
+        self.assertEqual(rates, {'db_upsert': 0.1, 'loop_ready': 1.0})
+
+    def test_trace_does_not_touch_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            tracer = Tracer(path=os.path.join(directory, 'trace.ndjson'), flush_interval_ms=60000)
+            with mock.patch('builtins.open', side_effect=AssertionError('I/O on hot path')), \
+                    mock.patch.object(tracer, '_start_writer'):
+                tracer.trace('db_upsert', inserted=True)
+            self.assertEqual(tracer.stats()['pending'], 1)
+
+    def test_background_writer_and_rotation(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'trace.ndjson')
+            tracer = Tracer(path=path, max_bytes=200, backups=2, flush_interval_ms=10)
+            for index in range(3):
+                tracer.trace('db_upsert', index=index, text='x' * 100)
+                tracer.flush()
+            tracer.trace('db_upsert', index=3)
+            tracer.close()
+
+            self.assertTrue(os.path.exists(path + '.1'))
+            self.assertFalse(os.path.exists(path + '.3'))
+            with open(path, encoding='utf-8') as fp:
+                last = [json.loads(line) for line in fp]
+            self.assertEqual(last[-1]['data']['index'], 3)
+            self.assertEqual(tracer.stats()['written'], 4)
+            self.assertGreaterEqual(tracer.stats()['rotations'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import asyncio
+import unittest
+
+from services.userbot.write_buffer import MessageWriteBuffer
+
+
+class FakeConnection:
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def fetch(self, sql, *columns):
+        self.pool.calls.append(columns)
+        if self.pool.fail:
+            raise ConnectionError('db down')
+        records = []
+        for chat_id, message_id in zip(columns[2], columns[3]):
+            if (chat_id, message_id) not in self.pool.existing:
+                self.pool.existing.add((chat_id, message_id))
+                records.append({'chat_id': chat_id, 'message_id': message_id})
+        return records
+
+    async def execute(self, sql, *args):
+        self.pool.executed.append((sql, args))
+
+
+class FakeAcquire:
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def __aenter__(self):
+        return FakeConnection(self.pool)
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakePool:
+    def __init__(self, existing=(), fail=False):
+        self.calls = []
+        self.executed = []
+        self.existing = set(existing)
+        self.fail = fail
+
+    def acquire(self):
+        return FakeAcquire(self)
+
+
+def make_buffer(pool, **kwargs):
+    async def get_pool():
+        return pool
+    kwargs.setdefault('flush_interval_ms', 20)
+    kwargs.setdefault('retry_delay', 0)
+    return MessageWriteBuffer(get_pool, **kwargs)
+
+
+class MessageWriteBufferTest(unittest.TestCase):
+    def test_burst_is_one_insert(self):
+        pool = FakePool(existing={('1', '5')})
+
+        async def scenario():
+            buffer = make_buffer(pool)
+            results = await asyncio.gather(*(buffer.add(1, n, f'text {n}') for n in range(100)))
+            await buffer.close()
+            return results, buffer.stats()
+
+        results, stats = asyncio.run(scenario())
+        self.assertEqual(len(pool.calls), 1)
+        self.assertEqual(results.count(True), 99)
+        self.assertFalse(results[5])
+        self.assertEqual(stats['inserted'], 99)
+
+    def test_flushes_when_full(self):
+        pool = FakePool()
+
+        async def scenario():
+            buffer = make_buffer(pool, flush_interval_ms=10_000, max_rows=10)
+            tasks = [asyncio.ensure_future(buffer.add(1, n, 'x')) for n in range(25)]
+            # Полные пакеты пишутся сразу, остаток ждёт интервала или закрытия
+            await asyncio.wait_for(asyncio.gather(*tasks[:20]), timeout=1)
+            self.assertFalse(any(task.done() for task in tasks[20:]))
+            await buffer.close()
+            await asyncio.gather(*tasks)
+
+        asyncio.run(scenario())
+        self.assertEqual([len(call[0]) for call in pool.calls], [10, 10, 5])
+
+    def test_duplicate_in_batch_inserted_once(self):
+        pool = FakePool()
+
+        async def scenario():
+            buffer = make_buffer(pool)
+            results = await asyncio.gather(buffer.add(1, 7, 'a'), buffer.add(1, 7, 'a'))
+            await buffer.close()
+            return results
+
+        self.assertEqual(asyncio.run(scenario()), [True, False])
+        self.assertEqual(len(pool.calls[0][0]), 1)
+
+    def test_close_flushes_pending_rows(self):
+        pool = FakePool()
+
+        async def scenario():
+            buffer = make_buffer(pool, flush_interval_ms=10_000)
+            pending = asyncio.ensure_future(buffer.add(1, 1, 'a'))
+            await asyncio.sleep(0)
+            await buffer.close()
+            return await pending
+
+        self.assertTrue(asyncio.run(scenario()))
+
+    def test_failed_batch_reports_not_inserted(self):
+        pool = FakePool(fail=True)
+
+        async def scenario():
+            buffer = make_buffer(pool, retries=2)
+            result = await buffer.add(1, 1, 'a')
+            await buffer.close()
+            return result, buffer.stats()
+
+        result, stats = asyncio.run(scenario())
+        self.assertFalse(result)
+        self.assertEqual(len(pool.calls), 2)
+        self.assertEqual(stats['failed_rows'], 1)
+
+    def test_dead_letter_is_written_with_error_status(self):
+        pool = FakePool()
+
+        async def scenario():
+            buffer = make_buffer(pool)
+            await buffer.dead_letter(5, 9, 'text', error='RuntimeError: boom')
+            return buffer.stats()
+
+        stats = asyncio.run(scenario())
+        sql, args = pool.executed[0]
+        self.assertIn("'error'", sql)
+        self.assertEqual(args[:2], ('5', '9'))
+        self.assertEqual(args[-1], 'RuntimeError: boom')
+        self.assertEqual(stats['dead_letters'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,210 @@
+"""
+Userbot: структурированная трассировка событий
+
+Замена записи debug-событий прямо в файл из event loop:
+- trace() кладёт событие в кольцевой буфер (deque) и в очередь записи
+  (queue.SimpleQueue) - без блокировок и без файлового I/O на горячем пути
+- фоновый поток раз в USERBOT_TRACE_FLUSH_MS пишет накопленное в NDJSON
+  с ротацией по размеру (USERBOT_TRACE_MAX_BYTES, USERBOT_TRACE_BACKUPS)
+- сэмплирование: общая доля USERBOT_TRACE_SAMPLE и переопределения по
+  событиям USERBOT_TRACE_SAMPLE_EVENTS ("db_upsert=0.1,skip_old_message=1")
+- recent() отдаёт последние события для GET /debug/trace
+
+Файл пишется, только если задан USERBOT_TRACE_FILE; буфер работает всегда.
+"""
+
+import atexit
+import itertools
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import Counter, deque
+from typing import Dict, List, Optional
+
+TRACE_FILE = os.getenv('USERBOT_TRACE_FILE', '')
+TRACE_BUFFER = int(os.getenv('USERBOT_TRACE_BUFFER', '2000'))
+TRACE_SAMPLE = float(os.getenv('USERBOT_TRACE_SAMPLE', '1'))
+TRACE_SAMPLE_EVENTS = os.getenv('USERBOT_TRACE_SAMPLE_EVENTS', '')
+TRACE_MAX_BYTES = int(os.getenv('USERBOT_TRACE_MAX_BYTES', str(10 * 1024 * 1024)))
+TRACE_BACKUPS = int(os.getenv('USERBOT_TRACE_BACKUPS', '5'))
+TRACE_FLUSH_MS = int(os.getenv('USERBOT_TRACE_FLUSH_MS', '500'))
+
+# Очередь записи больше этого - новые события в файл не попадают (только в буфер)
+MAX_PENDING = 50000
+
+logger = logging.getLogger('userbot.tracing')
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    """
+    Разбор переопределений сэмплирования
+
+    Args:
+        spec: str - "event=rate,event=rate"
+
+    Returns:
+        dict event -> доля 0..1
+    """
+    rates = {}
+    for part in spec.split(','):
+        name, _, rate = part.partition('=')
+        if not name.strip() or not rate.strip():
+            continue
+        try:
+            rates[name.strip()] = min(1.0, max(0.0, float(rate)))
+        except ValueError:
+            logger.warning("Трассировка: неверная доля сэмплирования %r", part)
+    return rates
+
+
+class Tracer:
+    """
+    Трассировщик событий
+
+    Args:
+        path: str - NDJSON-файл ('' - только кольцевой буфер)
+        buffer_size: int - сколько последних событий держать в памяти
+        sample_rate: float - доля событий по умолчанию
+        event_rates: dict - доля по имени события
+        max_bytes: int - размер файла, после которого он ротируется
+        backups: int - сколько ротированных файлов хранить
+        flush_interval_ms: int - период записи фонового потока
+    """
+
+    def __init__(self, path: str = TRACE_FILE, buffer_size: int = TRACE_BUFFER,
+                 sample_rate: float = TRACE_SAMPLE, event_rates: Optional[Dict[str, float]] = None,
+                 max_bytes: int = TRACE_MAX_BYTES, backups: int = TRACE_BACKUPS,
+                 flush_interval_ms: int = TRACE_FLUSH_MS):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.event_rates = event_rates if event_rates is not None else parse_sample_rates(TRACE_SAMPLE_EVENTS)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval_ms / 1000
+
+        self._ring = deque(maxlen=buffer_size)
+        self._pending = queue.SimpleQueue()
+        self._seq = itertools.count(1)
+        self._stats = Counter()
+        self._stop = threading.Event()
+        self._writer: Optional[threading.Thread] = None
+        self._writer_lock = threading.Lock()
+
+    def trace(self, event: str, **data):
+        """
+        Записать событие (без блокировок и I/O)
+
+        Args:
+            event: str - имя события
+            **data: поля события (должны сериализоваться в JSON)
+        """
+        rate = self.event_rates.get(event, self.sample_rate)
+        if rate < 1 and random.random() >= rate:
+            self._stats['sampled_out'] += 1
+            return
+
+        record = {
+            'seq': next(self._seq),
+            'ts': int(time.time() * 1000),
+            'event': event,
+            'thread': threading.current_thread().name,
+            'data': data,
+        }
+        self._ring.append(record)
+        self._stats['events'] += 1
+
+        if not self.path:
+            return
+        if self._pending.qsize() >= MAX_PENDING:
+            self._stats['dropped'] += 1
+            return
+        self._pending.put(record)
+        if self._writer is None:
+            self._start_writer()
+
+    def recent(self, limit: int = 100, event: Optional[str] = None) -> List[dict]:
+        """
+        Последние события из кольцевого буфера, новые в конце
+
+        Args:
+            limit: int - сколько событий вернуть
+            event: str - только события с этим именем
+        """
+        records = list(self._ring)
+        if event:
+            records = [record for record in records if record['event'] == event]
+        return records[-limit:] if limit > 0 else []
+
+    def _start_writer(self):
+        with self._writer_lock:
+            if self._writer is not None:
+                return
+            self._stop.clear()
+            self._writer = threading.Thread(target=self._write_loop, name='userbot-trace-writer', daemon=True)
+            self._writer.start()
+
+    def _write_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        """Записать накопленные события в файл (вызывается фоновым потоком)"""
+        lines = []
+        while True:
+            try:
+                lines.append(json.dumps(self._pending.get_nowait(), ensure_ascii=False, default=str))
+            except queue.Empty:
+                break
+        if not lines or not self.path:
+            return
+        try:
+            self._rotate_if_needed()
+            with open(self.path, 'a', encoding='utf-8') as fp:
+                fp.write('\n'.join(lines) + '\n')
+            self._stats['written'] += len(lines)
+        except OSError as write_error:
+            self._stats['write_errors'] += 1
+            logger.warning("Трассировка: не удалось записать %s событий: %s", len(lines), write_error)
+
+    def _rotate_if_needed(self):
+        try:
+            if os.path.getsize(self.path) < self.max_bytes:
+                return
+        except OSError:
+            return
+        for index in range(self.backups - 1, 0, -1):
+            source = f'{self.path}.{index}'
+            if os.path.exists(source):
+                os.replace(source, f'{self.path}.{index + 1}')
+        if self.backups > 0:
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
+        self._stats['rotations'] += 1
+
+    def close(self):
+        """Останавливает фоновый поток, дописав очередь"""
+        writer = self._writer
+        if writer is not None:
+            self._stop.set()
+            writer.join(timeout=5)
+            self._writer = None
+
+    def stats(self) -> dict:
+        """Счётчики: events, sampled_out, written, dropped, write_errors, rotations, pending"""
+        result = dict(self._stats)
+        result['pending'] = self._pending.qsize()
+        result['buffered'] = len(self._ring)
+        result['file'] = self.path or None
+        result['sample_rate'] = self.sample_rate
+        return result
+
+
+# Общий трассировщик процесса (userbot.py и app.py)
+tracer = Tracer()
+atexit.register(tracer.close)
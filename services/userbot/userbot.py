@@ -5,8 +5,6 @@ patch-017 §4: Telethon Userbot
 """
 
 import os
-import json
-import time
 import asyncio
 import logging
 from typing import Optional, Tuple
@@ -17,35 +15,17 @@ from telethon import TelegramClient, events
 from telethon.tl.types import User, PeerChannel, PeerChat, PeerUser, Channel, Chat
 from telethon.tl.types import InputPeerUser, InputPeerChannel, InputPeerChat
 import services.userbot.config as config
+from services.userbot.message_parser import parse_message, ui_payload
+from services.userbot.write_buffer import MessageWriteBuffer
+from services.userbot.pipeline import Pipeline, Stage
+from services.userbot.entity_cache import EntityCache, peer_to_dict, peer_from_dict
+from services.userbot.forwarder import Forwarder
+from services.userbot.outbox import Outbox
+from services.userbot.message_store import MessageStore
+from services.userbot.tracing import tracer
 
 BACKEND_BASE = os.getenv('BACKEND_BASE', config.BACKEND_URL if hasattr(config, 'BACKEND_URL') else 'http://backend:3001')
 
-# region agent log helper
-DEBUG_LOG_PATH = r'c:\Users\Дмитрий\Desktop\parcer\parcer\.cursor\debug.log'
-DEBUG_SESSION_ID = 'debug-session'
-DEBUG_RUN_ID = 'pre-fix'
-
-
-def _agent_log(hypothesis_id: str, location: str, message: str, data=None):
-    """Lightweight NDJSON logger for debug-mode instrumentation."""
-    payload = {
-        'sessionId': DEBUG_SESSION_ID,
-        'runId': DEBUG_RUN_ID,
-        'hypothesisId': hypothesis_id,
-        'location': location,
-        'message': message,
-        'data': data or {},
-        'timestamp': int(time.time() * 1000),
-    }
-    try:
-        with open(DEBUG_LOG_PATH, 'a', encoding='utf-8') as fp:
-            fp.write(json.dumps(payload, ensure_ascii=False) + '\n')
-    except Exception:
-        # Логирование не должно ломать основной поток
-        pass
-
-# endregion
-
 LOG_LEVEL = os.getenv('USERBOT_LOG_LEVEL', 'INFO').upper()
 logging.basicConfig(
     level=LOG_LEVEL,
@@ -82,16 +62,67 @@ class UserbotManager:
         self.db_retry_delay = float(os.getenv('USERBOT_DB_RETRY_DELAY', '0.2'))
         self.db_pool_min_size = int(os.getenv('USERBOT_DB_POOL_MIN_SIZE', '1'))
         self.db_pool_max_size = int(os.getenv('USERBOT_DB_POOL_MAX_SIZE', '5'))
+        # Вставки bot_messages копятся и пишутся пакетами (USERBOT_DB_FLUSH_MS / USERBOT_DB_FLUSH_ROWS)
+        self.write_buffer = MessageWriteBuffer(
+            self._ensure_db_pool,
+            timeout=self.db_timeout,
+            retries=self.db_retries,
+            retry_delay=self.db_retry_delay
+        )
 
         self.http_session: Optional[aiohttp.ClientSession] = None
         self.http_timeout = float(os.getenv('USERBOT_HTTP_TIMEOUT_SECONDS', '5'))
-        self.http_retries = int(os.getenv('USERBOT_HTTP_RETRIES', '3'))
-        self.http_retry_delay = float(os.getenv('USERBOT_HTTP_RETRY_DELAY', '0.3'))
         self.http_semaphore = asyncio.Semaphore(int(os.getenv('USERBOT_BACKEND_CONCURRENCY', '3')))
 
+        # Отправка в backend: outbox на bot_messages, пачками в /process-multiple
+        self.outbox = Outbox(
+            self._ensure_db_pool,
+            self._ensure_http_session,
+            f"{BACKEND_BASE}/api/userbot-chat/process-multiple",
+            semaphore=self.http_semaphore
+        )
+
+        # /messages: история из bot_messages, пропуски дозагружаются из Telegram
+        self.message_store = MessageStore(self._ensure_db_pool, self._fetch_remote_messages)
+
+        # Прогресс загрузок истории по bot_id (см. history_loader.py)
+        self.history_progress = {}
+
+        # Кэш InputPeer, метаданных чатов и своего профиля (память + файл в SESSION_DIR)
+        self.entity_cache = EntityCache(os.path.join(config.SESSION_DIR, 'entity_cache.json'))
+        self.me_ttl = int(os.getenv('USERBOT_ME_TTL', '300'))
+        self.chat_meta_ttl = int(os.getenv('USERBOT_CHAT_META_TTL', '3600'))
+
+        # Пересылка в наш бот: склейка, rate limit, FloodWait, повторы через БД
+        self.forwarder = Forwarder(
+            lambda: self.client,
+            self.resolve_entity,
+            config.OUR_BOT_ID,
+            get_pool=self._ensure_db_pool
+        )
+
         # Максимальный возраст сообщения, которое мы считаем «новым» (в минутах)
         self.max_message_age = int(os.getenv('USERBOT_MAX_MESSAGE_AGE_MINUTES', '30'))
 
+        # Конвейер входящих: у каждой стадии своя очередь и свои воркеры.
+        # persist - много воркеров, чтобы write_buffer собирал пакеты.
+        # filter и persist обрабатывают сообщения параллельно, поэтому порядок
+        # пересылок не гарантирован (склейку и rate limit ведёт forwarder).
+        # Ошибка стадии повторяется, затем сообщение пишется в bot_messages со
+        # статусом error. Отправку в backend ведёт outbox по записанным строкам
+        queue_size = int(os.getenv('USERBOT_PIPELINE_QUEUE_SIZE', '1000'))
+        stage_retries = int(os.getenv('USERBOT_STAGE_RETRIES', '2'))
+        stage_options = dict(maxsize=queue_size, retries=stage_retries,
+                             on_error=self._dead_letter, describe=self._describe_message)
+        self.pipeline = Pipeline([
+            Stage('filter', self._stage_filter,
+                  workers=int(os.getenv('USERBOT_FILTER_WORKERS', '4')), **stage_options),
+            Stage('persist', self._stage_persist,
+                  workers=int(os.getenv('USERBOT_PERSIST_WORKERS', '32')), **stage_options),
+            Stage('forward', self._stage_forward,
+                  workers=int(os.getenv('USERBOT_FORWARD_WORKERS', '1')), **stage_options),
+        ])
+
     def _validate_config(self):
         errors = []
         if not config.API_ID or config.API_ID == 0:
@@ -213,9 +244,9 @@ class UserbotManager:
                 'error': str(e)
             }
 
-    async def _ensure_db_pool(self):
+    async def _ensure_db_pool(self) -> asyncpg.Pool:
         if self.db_pool and not getattr(self.db_pool, 'closed', False):
-            return
+            return self.db_pool
         self.db_pool = None
         self.db_pool = await asyncpg.create_pool(
             host=os.getenv('DB_HOST', 'postgres'),
@@ -228,6 +259,7 @@ class UserbotManager:
             timeout=self.db_timeout,
         )
         logger.info("DB pool создан (%s-%s)", self.db_pool_min_size, self.db_pool_max_size)
+        return self.db_pool
 
     async def _close_db_pool(self):
         if self.db_pool:
@@ -235,13 +267,14 @@ class UserbotManager:
             self.db_pool = None
             logger.info("DB pool закрыт")
 
-    async def _ensure_http_session(self):
+    async def _ensure_http_session(self) -> aiohttp.ClientSession:
         if self.http_session and not self.http_session.closed:
-            return
+            return self.http_session
         self.http_session = None
         timeout = aiohttp.ClientTimeout(total=self.http_timeout)
         self.http_session = aiohttp.ClientSession(timeout=timeout)
         logger.info("HTTP сессия создана (timeout=%s)", self.http_timeout)
+        return self.http_session
 
     async def _close_http_session(self):
         if self.http_session and not self.http_session.closed:
@@ -264,49 +297,40 @@ class UserbotManager:
 
             await self._ensure_db_pool()
             await self._ensure_http_session()
+            self.write_buffer.start()
+            self.forwarder.start()
+            self.outbox.start()
+            self.pipeline.start()
 
             if self.is_running:
-                me = await self.client.get_me()
                 return {
                     'success': True,
                     'status': 'already_running',
-                    'user': {
-                        'id': me.id,
-                        'first_name': me.first_name,
-                        'last_name': me.last_name,
-                        'username': me.username,
-                        'phone': me.phone
-                    }
+                    'user': await self.get_me_profile()
                 }
 
             await self.client.start()
             self.is_running = True
 
-            me = await self.client.get_me()
+            me = await self.get_me_profile(refresh=True)
 
-            # Получаем реальные названия ботов из Telegram
+            # Получаем реальные названия ботов из Telegram (кэшируются)
             bot_names_list = []
             for bot_id in config.MONITOR_BOT_IDS:
                 try:
-                    bot_entity = await self.resolve_entity(bot_id)
-                    bot_name = bot_entity.first_name or f"ID:{bot_id}"
-                    bot_names_list.append(f"{bot_name} (@{bot_entity.username})")
+                    bot_meta = await self.get_chat_meta(bot_id)
+                    bot_name = bot_meta['title'] or f"ID:{bot_id}"
+                    bot_names_list.append(f"{bot_name} (@{bot_meta['username']})")
                 except Exception:
                     bot_names_list.append(f"ID:{bot_id}")
 
             bot_names = ', '.join(bot_names_list)
-            logger.info("Userbot запущен %s (@%s), мониторим: %s", me.first_name, me.username, bot_names)
+            logger.info("Userbot запущен %s (@%s), мониторим: %s", me['first_name'], me['username'], bot_names)
 
             return {
                 'success': True,
-                'message': f'Userbot запущен как {me.first_name}',
-                'user': {
-                    'id': me.id,
-                    'first_name': me.first_name,
-                    'last_name': me.last_name,
-                    'username': me.username,
-                    'phone': me.phone
-                }
+                'message': f"Userbot запущен как {me['first_name']}",
+                'user': me
             }
 
     async def stop(self):
@@ -314,9 +338,16 @@ class UserbotManager:
         Остановка userbot
         """
         async with self._lifecycle_lock:
+            # Принятые сообщения дообрабатываются (пересылке нужен клиент),
+            # недописанные строки сбрасываются до закрытия пула
+            await self.pipeline.stop()
+            await self.forwarder.close()
+            await self.outbox.close()
             if self.client and self.client.is_connected():
                 await self.client.disconnect()
 
+            await self.write_buffer.close()
+            self.entity_cache.save()
             await self._close_http_session()
             await self._close_db_pool()
 
@@ -344,17 +375,10 @@ class UserbotManager:
             is_authorized = await self.client.is_user_authorized()
 
             if is_authorized:
-                me = await self.client.get_me()
                 return {
                     'running': self.is_running,
                     'authorized': True,
-                    'user': {
-                        'id': me.id,
-                        'first_name': me.first_name,
-                        'last_name': me.last_name,
-                        'username': me.username,
-                        'phone': me.phone
-                    }
+                    'user': await self.get_me_profile()
                 }
 
             return {
@@ -370,68 +394,33 @@ class UserbotManager:
                 'error': str(e)
             }
 
-    async def save_message_to_db(self, bot_id, telegram_message_id, text, message_date=None) -> bool:
+    async def save_message_to_db(self, bot_id, telegram_message_id, text, message_date=None,
+                                 status='new', data=None) -> bool:
         """
-        Сохранить сообщение в БД (asyncpg + retry)
+        Сохранить сообщение в БД (пакетная запись через write_buffer, с retry)
         Возвращает True если была вставка, False если запись уже существовала
+
+        status и data (поля локального разбора) пишутся той же вставкой
         """
-        await self._ensure_db_pool()
-        attempt = 1
-        sql = """INSERT INTO bot_messages
-                 (bot_id, telegram_message_id, chat_id, message_id, timestamp, text, status, process_attempts)
-                 VALUES ($1, $2, $3, $4, $5, $6, 'new', 0)
-                 ON CONFLICT (chat_id, message_id) DO NOTHING
-                 RETURNING 1"""
-
-        while attempt <= self.db_retries:
-            try:
-                async with self.db_pool.acquire() as conn:
-                    res = await asyncio.wait_for(
-                        conn.fetchrow(
-                            sql,
-                            str(bot_id),
-                            str(telegram_message_id),
-                            str(bot_id),
-                            str(telegram_message_id),
-                            message_date or datetime.now(timezone.utc),
-                            text
-                        ),
-                        timeout=self.db_timeout
-                    )
-                    inserted = res is not None
-                    if inserted:
-                        logger.debug("Сообщение сохранено в БД (bot_id=%s)", bot_id)
-                    else:
-                        logger.debug("Сообщение уже в БД (bot_id=%s)", bot_id)
-                    _agent_log(
-                        'H3',
-                        'userbot.py:save_message_to_db',
-                        'db_upsert',
-                        {
-                            'bot_id': str(bot_id),
-                            'telegram_message_id': str(telegram_message_id),
-                            'inserted': inserted,
-                        },
-                    )
-                    return inserted
-            except Exception as db_error:
-                _agent_log(
-                    'H3',
-                    'userbot.py:save_message_to_db',
-                    'db_error',
-                    {
-                        'bot_id': str(bot_id),
-                        'telegram_message_id': str(telegram_message_id),
-                        'error': str(db_error),
-                        'attempt': attempt,
-                    },
-                )
-                logger.warning("Ошибка сохранения в БД (попытка %s/%s): %s", attempt, self.db_retries, db_error)
-                if attempt >= self.db_retries:
-                    return False
-                await asyncio.sleep(self.db_retry_delay * attempt)
-                attempt += 1
-        return False
+        inserted = await self.write_buffer.add(
+            bot_id,
+            telegram_message_id,
+            text,
+            message_date,
+            status=status,
+            data=data
+        )
+        if inserted:
+            logger.debug("Сообщение сохранено в БД (bot_id=%s)", bot_id)
+        else:
+            logger.debug("Сообщение уже в БД или не записано (bot_id=%s)", bot_id)
+        tracer.trace(
+            'db_upsert',
+            bot_id=str(bot_id),
+            telegram_message_id=str(telegram_message_id),
+            inserted=inserted,
+        )
+        return inserted
 
     def _normalize_dt(self, value) -> datetime:
         dt = value if isinstance(value, datetime) else datetime.now(timezone.utc)
@@ -445,127 +434,124 @@ class UserbotManager:
         age_seconds = int((now_ts - msg_dt).total_seconds())
         return age_seconds > self.max_message_age * 60, age_seconds
 
-    async def _push_to_backend(self, payload: dict):
-        await self._ensure_http_session()
-        attempt = 1
-        while attempt <= self.http_retries:
-            try:
-                async with self.http_semaphore:
-                    start_ts = time.perf_counter()
-                    async with self.http_session.post(
-                        f"{BACKEND_BASE}/api/userbot-chat/process",
-                        json=payload
-                    ) as response:
-                        _ = await response.text()
-                        duration_ms = int((time.perf_counter() - start_ts) * 1000)
-                        _agent_log(
-                            'H4',
-                            'userbot.py:_push_to_backend',
-                            'push_backend',
-                            {
-                                'status_code': response.status,
-                                'duration_ms': duration_ms,
-                                'chat_id': payload.get('chat_id'),
-                                'message_id': payload.get('message_id'),
-                                'attempt': attempt,
-                            },
-                        )
-                        if 200 <= response.status < 500:
-                            return
-                        logger.warning("Backend ответ %s, повтор", response.status)
-            except Exception as push_error:
-                _agent_log(
-                    'H4',
-                    'userbot.py:_push_to_backend',
-                    'push_backend_failed',
-                    {
-                        'error': str(push_error),
-                        'chat_id': payload.get('chat_id'),
-                        'message_id': payload.get('message_id'),
-                        'attempt': attempt,
-                    },
-                )
-                logger.warning("[userbot] автообработка ошибка (attempt %s/%s): %s", attempt, self.http_retries, push_error)
-            if attempt >= self.http_retries:
-                return
-            await asyncio.sleep(self.http_retry_delay * attempt)
-            attempt += 1
-
     async def handle_new_message(self, event):
         """
-        Обработчик новых сообщений
+        Обработчик новых сообщений: только ставит событие в конвейер (см. pipeline.py)
+
+        Ждёт, если первая стадия заполнена - backpressure вместо потери сообщений
+        """
+        await self.pipeline.submit(event)
+
+    async def _stage_filter(self, event):
+        """
+        Стадия filter: отправитель, текст, возраст, локальный разбор
+
+        Returns:
+            dict сообщения для следующих стадий или None (не наше/старое/без текста)
         """
         try:
             sender = await event.get_sender()
         except Exception as err:
             logger.warning("Не удалось получить отправителя: %s", err)
-            return
+            return None
 
         sender_id = getattr(sender, 'id', None)
         sender_name = getattr(sender, 'first_name', '') or 'Unknown'
         logger.debug("Входящее сообщение от %s (ID: %s)", sender_name, sender_id)
 
         if not (isinstance(sender, User) and sender_id in config.MONITOR_BOT_IDS):
-            return
+            return None
 
         message_text = getattr(event.message, 'message', None) or getattr(event.message, 'raw_text', None) or ''
         if not message_text:
             logger.info("Сообщение без текста, пропускаем (ID: %s)", sender_id)
-            return
+            return None
 
         msg_dt = self._normalize_dt(getattr(event.message, 'date', None))
         is_old, age_seconds = self._is_old_message(msg_dt)
         if is_old:
-            _agent_log(
-                'H2',
-                'userbot.py:handle_new_message',
+            tracer.trace(
                 'skip_old_message',
-                {
-                    'sender_id': str(sender_id),
-                    'message_id': str(getattr(event.message, 'id', '')),
-                    'age_seconds': age_seconds,
-                    'max_age_minutes': self.max_message_age,
-                    'has_text': bool(message_text),
-                    'text_len': len(message_text or ''),
-                },
+                sender_id=str(sender_id),
+                message_id=str(getattr(event.message, 'id', '')),
+                age_seconds=age_seconds,
+                max_age_minutes=self.max_message_age,
+                text_len=len(message_text),
             )
             logger.info("Сообщение слишком старое (%s сек), пропускаем", age_seconds)
-            return
+            return None
 
-        inserted = await self.save_message_to_db(sender_id, event.message.id, message_text, msg_dt)
-        _agent_log(
-            'H2',
-            'userbot.py:handle_new_message',
-            'process_monitored_message',
-            {
-                'sender_id': str(sender_id),
-                'message_id': str(getattr(event.message, 'id', '')),
-                'age_seconds': age_seconds,
-                'inserted': inserted,
-                'has_text': bool(message_text),
-                'text_len': len(message_text or ''),
-            },
-        )
-
-        payload = {
-            'chat_id': str(sender_id),
-            'message_id': str(getattr(event.message, 'id', '')),
-            'raw_text': message_text
+        # Известные форматы ботов разбираются здесь же (пул потоков): поля и статус пишутся той же вставкой
+        operations = await parse_message(message_text, msg_dt)
+        return {
+            'sender_id': sender_id,
+            'message_id': event.message.id,
+            'text': message_text,
+            'date': msg_dt,
+            'age_seconds': age_seconds,
+            'operations': operations,
+            'inserted': False,
         }
 
-        if inserted:
-            asyncio.create_task(self._push_to_backend(payload))
+    async def _stage_persist(self, message):
+        """Стадия persist: запись в bot_messages (пакетами через write_buffer) и сигнал outbox"""
+        operations = message['operations']
+        message['inserted'] = await self.save_message_to_db(
+            message['sender_id'],
+            message['message_id'],
+            message['text'],
+            message['date'],
+            status='parsed' if operations else 'new',
+            data=ui_payload(operations) if operations else None
+        )
+        tracer.trace(
+            'process_monitored_message',
+            sender_id=str(message['sender_id']),
+            message_id=str(message['message_id']),
+            age_seconds=message['age_seconds'],
+            inserted=message['inserted'],
+            parsed_locally=bool(operations),
+            text_len=len(message['text']),
+        )
+        if message['inserted']:
+            self.outbox.notify()
         else:
             logger.debug("Автообработка не запущена: запись уже существовала")
+        return message
+
+    async def _stage_forward(self, message):
+        """Стадия forward: постановка в очередь пересылки в наш бот (forwarder.py)"""
+        await self.forwarder.submit(message['sender_id'], message['message_id'], message['text'])
+        return None
+
+    @staticmethod
+    def _message_fields(item):
+        """(sender_id, message_id, text, date) элемента конвейера: события Telethon или dict стадий"""
+        if isinstance(item, dict):
+            return item['sender_id'], item['message_id'], item['text'], item['date']
+        message = getattr(item, 'message', None)
+        text = getattr(message, 'message', None) or getattr(message, 'raw_text', None) or ''
+        return getattr(item, 'sender_id', None), getattr(message, 'id', None), text, getattr(message, 'date', None)
 
-        try:
-            await self.client.send_message(
-                config.OUR_BOT_ID,
-                message_text
-            )
-            logger.debug("Сообщение переслано в бот %s", config.OUR_BOT_ID)
-        except Exception as forward_error:
-            logger.error("Ошибка пересылки: %s", forward_error)
+    def _describe_message(self, item) -> str:
+        sender_id, message_id, _, _ = self._message_fields(item)
+        return f"{sender_id}/{message_id}"
+
+    async def _dead_letter(self, item, error):
+        """Сообщение, не обработанное стадией после всех попыток: bot_messages со статусом error"""
+        sender_id, message_id, text, message_date = self._message_fields(item)
+        if sender_id not in config.MONITOR_BOT_IDS or message_id is None:
+            # Не сообщение отслеживаемого бота - хранить нечего, ошибка уже в логе
+            return
+        await self.write_buffer.dead_letter(
+            sender_id,
+            message_id,
+            text,
+            self._normalize_dt(message_date),
+            error=f"{type(error).__name__}: {error}",
+        )
+        tracer.trace('dead_letter', sender_id=str(sender_id), message_id=str(message_id), error=str(error))
+        logger.error("Сообщение %s/%s сохранено со статусом error: %s", sender_id, message_id, error)
 
     async def run_until_disconnected(self):
         """
@@ -616,7 +602,7 @@ class UserbotManager:
 
         try:
             await self._ensure_db_pool()
-            loader = HistoryLoader(self.client, db_pool=self.db_pool)
+            loader = HistoryLoader(self.client, db_pool=self.db_pool, progress=self.history_progress)
             result = await loader.load_bot_history(
                 bot_id=bot_id,
                 bot_username=bot_username,
@@ -635,11 +621,63 @@ class UserbotManager:
                 'error_message': str(e)
             }
 
+    async def get_me_profile(self, refresh=False) -> dict:
+        """
+        Профиль аккаунта userbot (get_me кэшируется на USERBOT_ME_TTL секунд)
+
+        Args:
+            refresh: bool - запросить заново, минуя кэш
+        """
+        if not refresh:
+            cached = self.entity_cache.get('me')
+            if cached is not None:
+                return cached
+
+        me = await self.client.get_me()
+        profile = {
+            'id': me.id,
+            'first_name': me.first_name,
+            'last_name': me.last_name,
+            'username': me.username,
+            'phone': me.phone
+        }
+        # Другой аккаунт: access_hash в кэше ему не подходят
+        owner = self.entity_cache.get('owner')
+        if owner is not None and owner != me.id:
+            self.entity_cache.clear()
+        self.entity_cache.set('owner', me.id)
+        self.entity_cache.set('me', profile, ttl=self.me_ttl)
+        return profile
+
     async def resolve_entity(self, identifier):
-        """Вернуть InputPeer для переданного идентификатора"""
+        """
+        Вернуть InputPeer для переданного идентификатора
+
+        Результат кэшируется (entity_cache.py); «не найдено» - коротко,
+        ошибки сети и FloodWait не кэшируются
+        """
         if identifier is None:
             raise ValueError("identifier is required")
 
+        key = f'peer:{identifier}'
+        cached = self.entity_cache.get(key)
+        if cached is not None:
+            return peer_from_dict(cached)
+
+        try:
+            peer = await self._resolve_entity_remote(identifier)
+        except ValueError as lookup_error:
+            self.entity_cache.set_negative(key, lookup_error)
+            raise
+
+        serialized = peer_to_dict(peer)
+        if serialized is not None:
+            self.entity_cache.set(key, serialized)
+        return peer
+
+    async def _resolve_entity_remote(self, identifier):
+        """Разрешение идентификатора через Telegram (перебор типов peer)"""
+
         if isinstance(identifier, (int,)):
             entity = await self.client.get_entity(identifier)
             return self._to_input_peer(entity)
@@ -706,6 +744,13 @@ class UserbotManager:
         return text
 
     async def get_messages(self, chat_id, limit=50, before_message_id=None):
+        """
+        Страница истории чата: из bot_messages, пропуски - из Telegram (см. message_store.py)
+        """
+        return await self.message_store.page(chat_id, limit=limit, before_message_id=before_message_id)
+
+    async def _fetch_remote_messages(self, chat_id, offset_id=0, min_id=0, limit=50):
+        """Сообщения Telegram с min_id < id < offset_id (offset_id=0 - с самого нового)"""
         if not self.client:
             await self.initialize()
 
@@ -713,38 +758,18 @@ class UserbotManager:
             await self.client.connect()
 
         peer = await self.resolve_entity(chat_id)
-        kwargs = {
-            'limit': max(1, min(int(limit or 50), 200))
-        }
-
-        if before_message_id:
-            try:
-                kwargs['offset_id'] = int(str(before_message_id))
-            except (TypeError, ValueError):
-                kwargs['offset_id'] = int(before_message_id)
-
-        messages = await self.client.get_messages(peer, **kwargs)
+        messages = await self.client.get_messages(peer, limit=limit, offset_id=offset_id, min_id=min_id)
 
-        dedup = set()
         out = []
         for message in messages:
-            message_id = getattr(message, 'id', None)
-            if message_id is None:
+            if getattr(message, 'id', None) is None:
                 continue
-            message_id = str(message_id)
-            if message_id in dedup:
-                continue
-            dedup.add(message_id)
-
-            text = getattr(message, 'message', None) or getattr(message, 'raw_text', None) or ''
             out.append({
-                'message_id': message_id,
-                'chat_id': str(chat_id),
-                'sender_id': str(getattr(message, 'sender_id', '') or ''),
-                'date': message.date.isoformat() if getattr(message, 'date', None) else None,
-                'text': text
+                'id': message.id,
+                'sender_id': getattr(message, 'sender_id', None),
+                'date': getattr(message, 'date', None),
+                'text': getattr(message, 'message', None) or getattr(message, 'raw_text', None) or ''
             })
-
         return out
 
     async def get_chat_meta(self, chat_id):
@@ -754,17 +779,24 @@ class UserbotManager:
         if not self.client.is_connected():
             await self.client.connect()
 
+        key = f'meta:{chat_id}'
+        cached = self.entity_cache.get(key)
+        if cached is not None:
+            return cached
+
         peer = await self.resolve_entity(chat_id)
         entity = await self.client.get_entity(peer)
 
         title = getattr(entity, 'title', None) or getattr(entity, 'first_name', None) or getattr(entity, 'last_name', None)
 
-        return {
+        meta = {
             'id': getattr(entity, 'id', None),
             'username': getattr(entity, 'username', None),
             'title': title,
             'bot': getattr(entity, 'bot', False)
         }
+        self.entity_cache.set(key, meta, ttl=self.chat_meta_ttl)
+        return meta
 
 
 # Глобальный экземпляр userbot manager
@@ -0,0 +1,214 @@
+"""
+Userbot: отложенная пакетная запись сообщений в bot_messages
+
+Вместо INSERT на каждое сообщение строки копятся в буфере и записываются
+одним многострочным INSERT ... SELECT FROM unnest(...) раз в
+USERBOT_DB_FLUSH_MS миллисекунд или сразу по набору USERBOT_DB_FLUSH_ROWS строк.
+После переподключения Telethon отдаёт сотни пропущенных сообщений разом -
+они уходят в БД несколькими запросами вместо сотен.
+
+Каждый вызывающий получает свой результат: была ли вставлена его строка
+(ON CONFLICT (chat_id, message_id) DO NOTHING RETURNING chat_id, message_id).
+
+Вставленные строки сразу попадают в outbox (next_attempt_at = NOW(), см. outbox.py).
+
+dead_letter() пишет сообщение, которое конвейер не смог обработать, сразу
+(без буфера) со статусом error и текстом ошибки; в outbox такая строка не
+попадает. Если строка уже есть, у неё обновляется только error.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Optional
+
+FLUSH_INTERVAL_MS = int(os.getenv('USERBOT_DB_FLUSH_MS', '50'))
+FLUSH_MAX_ROWS = int(os.getenv('USERBOT_DB_FLUSH_ROWS', '200'))
+
+INSERT_BATCH_SQL = """INSERT INTO bot_messages
+    (bot_id, telegram_message_id, chat_id, message_id, timestamp, text, status, data, process_attempts,
+     next_attempt_at)
+    SELECT bot_id, telegram_message_id, chat_id, message_id, ts, text, status, data, 0, NOW()
+    FROM unnest($1::text[], $2::text[], $3::text[], $4::text[], $5::timestamptz[],
+                $6::text[], $7::text[], $8::jsonb[])
+        AS t(bot_id, telegram_message_id, chat_id, message_id, ts, text, status, data)
+    ON CONFLICT (chat_id, message_id) DO NOTHING
+    RETURNING chat_id, message_id"""
+
+DEAD_LETTER_SQL = """INSERT INTO bot_messages
+    (bot_id, telegram_message_id, chat_id, message_id, timestamp, text, status, error, process_attempts)
+    VALUES ($1, $2, $1, $2, $3, $4, 'error', $5, 0)
+    ON CONFLICT (chat_id, message_id) DO UPDATE SET error = EXCLUDED.error, updated_at = NOW()"""
+
+logger = logging.getLogger('userbot.write_buffer')
+
+
+class MessageWriteBuffer:
+    """
+    Буфер вставок bot_messages с пакетным сбросом
+
+    Args:
+        get_pool: корутина, возвращающая asyncpg.Pool
+        flush_interval_ms: int - максимальная задержка строки в буфере
+        max_rows: int - размер пакета, при котором буфер сбрасывается сразу
+        timeout: float - таймаут одного INSERT, сек
+        retries: int - попыток записи пакета
+        retry_delay: float - базовая пауза между попытками, сек
+    """
+
+    def __init__(self, get_pool: Callable[[], Awaitable], flush_interval_ms: int = FLUSH_INTERVAL_MS,
+                 max_rows: int = FLUSH_MAX_ROWS, timeout: float = 5, retries: int = 3,
+                 retry_delay: float = 0.2):
+        self.get_pool = get_pool
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_rows = max_rows
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+
+        self._rows = []
+        self._has_rows = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self._stats = Counter()
+        self._last_flush_ms = None
+
+    def start(self):
+        """Запускает фоновый сброс буфера (идемпотентно)"""
+        if self._task is None or self._task.done():
+            self._closing = False
+            self._task = asyncio.create_task(self._run(), name='userbot-write-buffer')
+
+    async def close(self):
+        """Сбрасывает оставшиеся строки и останавливает фоновую задачу"""
+        self._closing = True
+        self._has_rows.set()
+        self._full.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        # Строки, добавленные без запущенной задачи
+        while self._rows:
+            await self._flush()
+
+    async def add(self, bot_id, telegram_message_id, text, message_date=None,
+                  status='new', data=None) -> bool:
+        """
+        Ставит сообщение в очередь на запись
+
+        Returns:
+            bool - True если строка вставлена, False если уже была в БД
+                   или запись не удалась после всех попыток
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._rows.append((
+            (
+                str(bot_id),
+                str(telegram_message_id),
+                str(bot_id),
+                str(telegram_message_id),
+                message_date or datetime.now(timezone.utc),
+                text,
+                status,
+                json.dumps(data, ensure_ascii=False) if data is not None else None,
+            ),
+            future,
+        ))
+        self._stats['queued'] += 1
+        self._has_rows.set()
+        if len(self._rows) >= self.max_rows:
+            self._full.set()
+        if self._task is None or self._task.done():
+            self.start()
+        return await future
+
+    async def _run(self):
+        while True:
+            await self._has_rows.wait()
+            if not self._closing:
+                try:
+                    await asyncio.wait_for(self._full.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            await self._flush()
+            if self._closing and not self._rows:
+                return
+
+    async def _flush(self):
+        batch = self._rows[:self.max_rows]
+        del self._rows[:len(batch)]
+        if len(self._rows) < self.max_rows:
+            self._full.clear()
+        if not self._rows:
+            self._has_rows.clear()
+        if not batch:
+            return
+
+        # Повторы одного сообщения в пакете: вставленным считается первый
+        waiters = {}
+        rows = []
+        for row, future in batch:
+            key = (row[2], row[3])
+            if key in waiters:
+                waiters[key].append(future)
+            else:
+                waiters[key] = [future]
+                rows.append(row)
+
+        inserted = await self._insert(rows)
+        for key, futures in waiters.items():
+            for index, future in enumerate(futures):
+                if not future.done():
+                    future.set_result(inserted is not None and index == 0 and key in inserted)
+
+    async def _insert(self, rows):
+        """Один INSERT на пакет; множество вставленных ключей или None при ошибке"""
+        columns = [list(column) for column in zip(*rows)]
+        for attempt in range(1, self.retries + 1):
+            start = time.perf_counter()
+            try:
+                pool = await self.get_pool()
+                async with pool.acquire() as conn:
+                    records = await asyncio.wait_for(conn.fetch(INSERT_BATCH_SQL, *columns), timeout=self.timeout)
+                self._last_flush_ms = round((time.perf_counter() - start) * 1000, 1)
+                self._stats['flushes'] += 1
+                self._stats['rows'] += len(rows)
+                self._stats['inserted'] += len(records)
+                logger.debug("Пакет записан: %s строк, вставлено %s за %sмс",
+                             len(rows), len(records), self._last_flush_ms)
+                return {(record['chat_id'], record['message_id']) for record in records}
+            except Exception as db_error:
+                self._stats['errors'] += 1
+                logger.warning("Ошибка записи пакета (%s строк, попытка %s/%s): %s",
+                               len(rows), attempt, self.retries, db_error)
+                if attempt < self.retries:
+                    await asyncio.sleep(self.retry_delay * attempt)
+        self._stats['failed_rows'] += len(rows)
+        return None
+
+    async def dead_letter(self, bot_id, telegram_message_id, text, message_date=None, error=''):
+        """Записывает необработанное сообщение со статусом error (сразу, мимо буфера)"""
+        pool = await self.get_pool()
+        async with pool.acquire() as conn:
+            await asyncio.wait_for(conn.execute(
+                DEAD_LETTER_SQL,
+                str(bot_id),
+                str(telegram_message_id),
+                message_date or datetime.now(timezone.utc),
+                text or '',
+                error,
+            ), timeout=self.timeout)
+        self._stats['dead_letters'] += 1
+
+    def stats(self) -> dict:
+        """Счётчики буфера: queued, flushes, rows, inserted, errors, failed_rows, pending"""
+        result = dict(self._stats)
+        result['pending'] = len(self._rows)
+        result['last_flush_ms'] = self._last_flush_ms
+        result['avg_batch'] = round(result['rows'] / result['flushes'], 1) if result.get('flushes') else None
+        return result